@@ -29,14 +29,139 @@ from OpenGL.arrays.vbo import VBO
 
 import vector
 from gcodeparser import Movement
+from culling import Frustum, ChunkTree, build_layer_chunks
+from lod import build_detail_levels, choose_level
+import mesh
+import analysis
+import slicer
+from picking import SegmentGrid
+from raster import burn_image, to_intensity, save_png, find_hotspots
+from shaders import VertexArray, ATTRIB_POSITION, ATTRIB_COLOR, ATTRIB_NORMAL
+from stats import count_draw
+from upload import UploadQueue, buffer_data, clip_ranges
+
+
+def update_buffer(buffer, data, target='GL_ARRAY_BUFFER'):
+    """
+    Return a VBO holding data, reusing buffer if possible. A buffer of the
+    right size is updated in place; otherwise it is freed and a new one is
+    created in its stead. See upload.buffer_data() for the types of data.
+    """
+    data = buffer_data(data, target)
+    if buffer is not None and buffer.copied and buffer.size == data.nbytes:
+        buffer.bind()
+        glBufferSubData(buffer.target, 0, data.nbytes, data)
+        buffer.unbind()
+        buffer.data = data
+        return buffer
+
+    if buffer is not None:
+        buffer.delete()
+    return VBO(data, 'GL_STATIC_DRAW', target)
+
+def draw_ranges(mode, ranges, vertices_per_item):
+    """
+    Draw ranges of items (line segments or triangles), given as arrays of
+    start and end item indices, with a single call.
+    """
+    starts, ends = ranges
+    if len(starts) == 0:
+        return
+
+    firsts = numpy.require(starts * vertices_per_item, numpy.int32)
+    counts = numpy.require((ends - starts) * vertices_per_item, numpy.int32)
+    glMultiDrawArrays(mode, firsts, counts, len(firsts))
+    count_draw(1, counts.sum())
+
+def draw_sampled_ranges(mode, ranges, vertices_per_item, stride, index_buffer):
+    """
+    Draw every stride-th item of ranges with a single call. The index buffer
+    lists the vertices of every stride-th item of the whole vertex buffer,
+    so the sampled items of any range are contiguous in it.
+    """
+    starts, ends = ranges
+    firsts = -(-starts // stride) # round up to the next sampled item
+    lasts  = -(-ends // stride)
+    keep = lasts > firsts
+    if not keep.any():
+        return
+
+    draw_indexed_ranges(mode, (firsts[keep], lasts[keep]), vertices_per_item, index_buffer)
+
+def draw_indexed_ranges(mode, ranges, vertices_per_item, index_buffer):
+    """
+    Draw ranges of items whose vertices are listed in an index buffer of
+    32-bit indices, with a single call.
+    """
+    starts, ends = ranges
+    if len(starts) == 0:
+        return
+
+    counts  = numpy.require((ends - starts) * vertices_per_item, numpy.int32)
+    offsets = numpy.require(starts * vertices_per_item * 4, numpy.intp) # in bytes
+
+    index_buffer.bind()
+    glMultiDrawElements(mode, counts, GL_UNSIGNED_INT, offsets, len(counts))
+    index_buffer.unbind()
+    count_draw(1, counts.sum())
 
+def sample_indices(num_items, vertices_per_item, stride):
+    """
+    Return vertex indices of every stride-th item for draw_sampled_ranges().
+    """
+    items = numpy.arange(0, num_items, stride, dtype=numpy.uint32)
+    offsets = numpy.arange(vertices_per_item, dtype=numpy.uint32)
+    return (items[:, None] * vertices_per_item + offsets).ravel()
 
-def compile_display_list(func, *options):
-    display_list = glGenLists(1)
-    glNewList(display_list, GL_COMPILE)
-    func(*options)
-    glEndList()
-    return display_list
+def free_buffer(buffer):
+    """
+    Free a VBO if there is one. Returns None for assigning it in place.
+    """
+    if buffer is not None:
+        buffer.delete()
+    return None
+
+def upload_texture(texture, pixels):
+    """
+    Upload an RGBA image to a texture, creating it if texture is None.
+    """
+    if texture is None:
+        texture = glGenTextures(1)
+
+    h, w = pixels.shape[:2]
+    glBindTexture(GL_TEXTURE_2D, texture)
+    glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, w, h, 0, GL_RGBA, GL_UNSIGNED_BYTE, pixels)
+    glBindTexture(GL_TEXTURE_2D, 0)
+    return texture
+
+def draw_texture(texture, extent):
+    """
+    Draw a texture on a rectangle in the z=0 plane.
+    """
+    x0, y0, x1, y1 = extent
+
+    glEnable(GL_TEXTURE_2D)
+    glBindTexture(GL_TEXTURE_2D, texture)
+    glColor4f(1.0, 1.0, 1.0, 1.0)
+
+    glBegin(GL_QUADS)
+    glTexCoord2f(0.0, 0.0)
+    glVertex3f(x0, y0, 0.0)
+    glTexCoord2f(1.0, 0.0)
+    glVertex3f(x1, y0, 0.0)
+    glTexCoord2f(1.0, 1.0)
+    glVertex3f(x1, y1, 0.0)
+    glTexCoord2f(0.0, 1.0)
+    glVertex3f(x0, y1, 0.0)
+    glEnd()
+
+    glBindTexture(GL_TEXTURE_2D, 0)
+    glDisable(GL_TEXTURE_2D)
 
 class BoundingBox(object):
     """
@@ -80,44 +205,80 @@ class Platform(object):
         self.initialized = False
 
     def init(self):
-        self.display_list = compile_display_list(self.draw)
+        vertices, colors = self.grid_arrays()
+        self.vertex_buffer = VBO(vertices, 'GL_STATIC_DRAW')
+        self.color_buffer  = VBO(colors, 'GL_STATIC_DRAW')
+        self.vertex_count  = len(vertices)
         self.initialized = True
 
-    def draw(self):
-        glPushMatrix()
+    def grid_arrays(self):
+        """
+        Return vertices and colors of the grid lines followed by the four
+        corners of the fill.
+        """
+        def line_colors(n):
+            i = numpy.arange(n)
+            colors = numpy.empty((n, 4), 'f')
+            colors[:] = self.color_grads_minor
+            colors[i % (self.graduations_major / 2) == 0] = self.color_grads_interm
+            colors[i % self.graduations_major == 0] = self.color_grads_major
+            return colors.repeat(2, 0)
+
+        xs = numpy.arange(int(self.width) + 1, dtype='f')
+        ys = numpy.arange(int(self.depth) + 1, dtype='f')
+
+        lines_x = numpy.zeros((len(xs), 2, 3), 'f')
+        lines_x[:, :, 0] = xs[:, None]
+        lines_x[:, 1, 1] = self.depth
+
+        lines_y = numpy.zeros((len(ys), 2, 3), 'f')
+        lines_y[:, :, 1] = ys[:, None]
+        lines_y[:, 1, 0] = self.width
+
+        fill = numpy.array([
+            (0.0,        0.0,        0.0),
+            (self.width, 0.0,        0.0),
+            (self.width, self.depth, 0.0),
+            (0.0,        self.depth, 0.0),
+        ], 'f')
+
+        vertices = numpy.concatenate([lines_x.reshape(-1, 3), lines_y.reshape(-1, 3), fill])
+        colors = numpy.concatenate([line_colors(len(xs)), line_colors(len(ys)),
+                                    numpy.tile(numpy.array(self.color_fill, 'f'), (4, 1))])
+        return vertices, colors
+
+    def buffers(self):
+        return [self.vertex_buffer, self.color_buffer]
+
+    def delete(self):
+        if self.initialized:
+            for buf in self.buffers():
+                buf.delete()
+        self.initialized = False
 
+    def display(self, *args, **kwargs):
+        glPushMatrix()
         glTranslate(-self.width / 2, -self.depth / 2, 0)
 
-        def color(i):
-            if i % self.graduations_major == 0:
-                glColor(*self.color_grads_major)
-            elif i % (self.graduations_major / 2) == 0:
-                glColor(*self.color_grads_interm)
-            else:
-                glColor(*self.color_grads_minor)
-
-        # draw the grid
-        glBegin(GL_LINES)
-        for i in range(0, int(self.width) + 1):
-            color(i)
-            glVertex3f(float(i), 0.0,        0.0)
-            glVertex3f(float(i), self.depth, 0.0)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        self.vertex_buffer.bind()
+        glVertexPointer(3, GL_FLOAT, 0, None)
+        self.color_buffer.bind()
+        glColorPointer(4, GL_FLOAT, 0, None)
 
-        for i in range(0, int(self.depth) + 1):
-            color(i)
-            glVertex3f(0,          float(i), 0.0)
-            glVertex3f(self.width, float(i), 0.0)
-        glEnd()
+        num_lines = self.vertex_count - 4
+        glDrawArrays(GL_LINES, 0, num_lines)
+        glDrawArrays(GL_QUADS, num_lines, 4)
+        count_draw(2, self.vertex_count)
 
-        # draw fill
-        glColor(*self.color_fill)
-        glRectf(0.0, 0.0, self.width, self.depth)
+        self.color_buffer.unbind()
+        self.vertex_buffer.unbind()
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
 
         glPopMatrix()
 
-    def display(self, *args, **kwargs):
-        glCallList(self.display_list)
-
 
 class Model(object):
     """
@@ -135,6 +296,13 @@ class Model(object):
 
     axis_letter_map = dict([(v, k) for k, v in letter_axis_map.items()])
 
+    # mapping the model's arrays are views of, if it was loaded in another
+    # process
+    shared_arrays = None
+
+    # buffers still being filled, a chunk per frame
+    uploads = None
+
     def __init__(self, offset_x=0, offset_y=0, offset_z=0):
         self.offset_x = offset_x
         self.offset_y = offset_y
@@ -152,6 +320,35 @@ class Model(object):
     def invalidate_bounding_box(self):
         self._bounding_box = None
 
+    def buffers(self):
+        """
+        Return a list of vertex buffer objects the model has uploaded.
+        """
+        return []
+
+    def resident_items(self, buffer, vertices_per_item):
+        """
+        Return how many items at the start of buffer are ready to be drawn,
+        or None if all of them are.
+        """
+        rows = self.uploads.resident_rows(buffer) if self.uploads is not None else None
+        return rows // vertices_per_item if rows is not None else None
+
+    def delete(self):
+        """
+        Free the OpenGL objects and shared memory of a model that is no
+        longer displayed.
+        """
+        if self.initialized:
+            for buf in self.buffers():
+                buf.delete()
+        self.initialized = False
+        self.uploads = None
+
+        if self.shared_arrays is not None:
+            self.shared_arrays.close()
+            self.shared_arrays = None
+
     @property
     def bounding_box(self):
         """
@@ -165,11 +362,8 @@ class Model(object):
         """
         Calculate an axis-aligned box enclosing the model.
         """
-        # swap rows and columns in our vertex arrays so that we can do max and
-        # min on axis 1
-        xyz_rows = self.vertices.reshape(-1, order='F').reshape(3, -1)
-        lower_corner = xyz_rows.min(1)
-        upper_corner = xyz_rows.max(1)
+        lower_corner = self.vertices.min(0)
+        upper_corner = self.vertices.max(0)
         box = BoundingBox(upper_corner, lower_corner)
         return box
 
@@ -210,19 +404,36 @@ class GcodeModel(Model):
         [-0.23, -0.23, 0.0],
     ], 'f')
 
+    # largest burn preview image side in pixels
+    BURN_PREVIEW_MAX_SIZE = 4096
+
+    # most movements drawn while the view is being dragged or zoomed; beyond
+    # that only every other, every fourth, etc. movement is drawn
+    INTERACTIVE_MOVEMENTS = 100000
+
+    # index of source file lines, set by the loader when the file is available
+    source = None
+
     def load_data(self, model_data, callback=None):
         t_start = time.time()
 
         vertex_list             = []
         color_list              = []
+        power_list              = []
+        feedrate_list           = []
+        line_list               = []
+        drawn_list              = []
         self.layer_stops        = [0]
         self.layer_heights      = []
         arrow_list              = []
         layer_markers_list      = []
         self.layer_marker_stops = [0]
 
-        num_layers     = len(model_data)
-        callback_every = max(1, int(math.floor(num_layers / 100)))
+        # progress is counted in movements, as laser jobs often have a single
+        # layer
+        num_movements  = sum(len(layer) for layer in model_data)
+        callback_every = max(1, int(math.floor(num_movements / 100)))
+        movement_idx   = 0
 
         # the first movement designates the starting point
         start = prev = model_data[0][0]
@@ -231,6 +442,10 @@ class GcodeModel(Model):
         for layer_idx, layer in enumerate(model_data):
             first = layer[0]
             for movement in layer:
+                movement_idx += 1
+                if callback and movement_idx % callback_every == 0:
+                    callback(movement_idx, num_movements)
+
                 vertex_list.append(prev.v)
                 vertex_list.append(movement.v)
 
@@ -241,6 +456,10 @@ class GcodeModel(Model):
 
                 vertex_color = self.movement_color(movement)
                 color_list.append(vertex_color)
+                power_list.append(movement.spindle_speed)
+                feedrate_list.append(movement.feedrate)
+                line_list.append(movement.line_no)
+                drawn_list.append(self.movement_drawn(movement))
 
                 prev = movement
 
@@ -259,11 +478,14 @@ class GcodeModel(Model):
 
             self.layer_marker_stops.append(len(layer_markers_list))
 
-            if callback and layer_idx % callback_every == 0:
-                callback(layer_idx + 1, num_layers)
+        if callback:
+            callback(num_movements, num_movements)
 
         self.vertices      = numpy.array(vertex_list,        'f')
         self.colors        = numpy.array(color_list,         'f')
+        self.powers        = numpy.array(power_list,         'f')
+        self.feedrates     = numpy.array(feedrate_list,      'f')
+        self.source_lines  = numpy.array(line_list,          'i')
         self.arrows        = numpy.array(arrow_list,         'f')
         self.layer_markers = numpy.array(layer_markers_list, 'f')
 
@@ -272,20 +494,91 @@ class GcodeModel(Model):
         # if we could rotate in a similar fashion...
         self.arrows = self.arrows + self.vertices[1::2].repeat(3, 0)
 
+        # box around what is burned or extruded, leaving out travel and the
+        # first movement, which comes from wherever the machine was waiting
+        drawn = numpy.array(drawn_list, bool)
+        drawn[:1] = False
+        if drawn.any():
+            drawn_vertices = self.vertices.reshape(-1, 2, 3)[drawn].reshape(-1, 3)
+            self.drawn_bounding_box = BoundingBox(drawn_vertices.max(0), drawn_vertices.min(0))
+            # layers up to the topmost one with anything drawn, as the end of
+            # a job often moves away on a layer of its own
+            last_drawn = numpy.flatnonzero(drawn)[-1]
+            self.drawn_layers = int(numpy.searchsorted(
+                numpy.array(self.layer_stops) // 2, last_drawn, 'right'))
+        else:
+            self.drawn_bounding_box = self.bounding_box
+            self.drawn_layers = len(self.layer_stops) - 1
+
         # for every pair of vertices of the model, there are 3 vertices for the arrow
         assert len(self.arrows) == ((len(self.vertices) // 2) * 3), \
             'The 2:3 ratio of model vertices to arrow vertices does not hold.'
 
+        # simplified copies of the toolpath for zoomed-out views, made before
+        # chunking, which breaks up the runs of connected movements
+        self.detail_levels = build_detail_levels(self.vertices, self.colors, self.layer_stops)
+
+        # group movements of every layer into spatial chunks, so that chunks
+        # out of view can be skipped when drawing
+        order, self.chunks = build_layer_chunks(self.vertices, self.layer_stops)
+        self.vertices     = self.vertices.reshape(-1, 2, 3)[order].reshape(-1, 3)
+        self.arrows       = self.arrows.reshape(-1, 3, 3)[order].reshape(-1, 3)
+        self.colors       = self.colors[order]
+        self.powers       = self.powers[order]
+        self.feedrates    = self.feedrates[order]
+        self.source_lines = self.source_lines[order]
+
+        self.detail_chunks = []
+        for level in self.detail_levels:
+            order, chunks = build_layer_chunks(level.vertices, level.layer_stops)
+            level.vertices = level.vertices.reshape(-1, 2, 3)[order].reshape(-1, 3)
+            level.colors   = level.colors[order]
+            self.detail_chunks.append(chunks)
+
+        # lowest height of every layer and the layers above it, for finding
+        # layers below some height in sorted order
+        heights = numpy.array(self.layer_heights, 'f')
+        self._layer_floors = numpy.minimum.accumulate(heights[::-1])[::-1]
+
         self.max_layers         = len(self.layer_stops) - 1
         self.num_layers_to_draw = self.max_layers
         self.arrows_enabled     = True
         self.initialized        = False
         self.vertex_count       = len(self.vertices)
 
+        self.arrow_buffer       = None
+        self.arrow_color_buffer = None
+        self.vertex_arrays      = {} # for the shader renderer, created on demand
+        self.sample_buffers     = {} # (stride, index buffer) per vertex buffer
+
+        self.burn_preview_enabled    = False
+        self.burn_preview_resolution = 0.1 # mm per pixel
+        self._burn_previews          = {} # per layer and size limit
+        self._burn_texture           = None
+        self._burn_texture_layer     = None
+
+        self.hotspots          = None
+        self.hotspots_layer    = None
+        self.hotspots_enabled  = True
+        self._hotspots         = {} # per layer and settings
+        self._hotspot_texture  = None
+
+        self._segment_grid = None
+
         t_end = time.time()
 
         logging.info('Initialized Gcode model in %.2f seconds' % (t_end - t_start))
         logging.info('Vertex count: %d' % self.vertex_count)
+        logging.info('Detail levels: %s' % ', '.join(
+            ['%d (%.2fmm)' % (level.vertex_count, level.tolerance)
+             for level in self.detail_levels]))
+
+    def movement_drawn(self, move):
+        """
+        Return whether the movement burns or extrudes material.
+        """
+        # a laser turned on with M3/M4 sets the same flag as the extruder
+        return bool(move.flags & Movement.FLAG_EXTRUDER_ON or move.delta_e > 0)
 
     def movement_color(self, move):
         """
@@ -293,8 +586,7 @@ class GcodeModel(Model):
         """
         # default movement color is gray
         color = (0.6, 0.6, 0.6, 0.6)
-        extruder_on = (move.flags & Movement.FLAG_EXTRUDER_ON or
-                       move.delta_e > 0)
+        extruder_on = self.movement_drawn(move)
         outer_perimeter = (move.flags & Movement.FLAG_PERIMETER and
                            move.flags & Movement.FLAG_PERIMETER_OUTER)
         if extruder_on and outer_perimeter:
@@ -317,30 +609,97 @@ class GcodeModel(Model):
     # ------------------------------------------------------------------------
 
     def init(self):
-        self.vertex_buffer       = VBO(self.vertices, 'GL_STATIC_DRAW')
-        self.vertex_color_buffer = VBO(self.colors.repeat(2, 0), 'GL_STATIC_DRAW') # each pair of vertices shares the color
-
-        if self.arrows_enabled:
-            self.arrow_buffer       = VBO(self.arrows, 'GL_STATIC_DRAW')
-            self.arrow_color_buffer = VBO(self.colors.repeat(3, 0), 'GL_STATIC_DRAW') # each triplet of vertices shares the color
+        """
+        Create vertex buffer objects (VBOs) that are missing and free the ones
+        that are no longer needed.
 
-        self.layer_marker_buffer = VBO(self.layer_markers, 'GL_STATIC_DRAW')
+        Movement buffers are only created once, so this is cheap to call again
+        after toggling arrows.
+        """
+        if not self.initialized:
+            # buffers are filled over the following frames, bottom layers
+            # first, and drawn as far as they are filled
+            self.uploads = UploadQueue()
+            self.vertex_buffer, self.vertex_color_buffer = self.uploads.add(
+                self.vertices, self.colors.repeat(2, 0)) # each pair of vertices shares the color
+
+            self.detail_buffers = []
+            for level in self.detail_levels:
+                self.detail_buffers.append(tuple(self.uploads.add(
+                    level.vertices, level.colors.repeat(2, 0))))
+
+            self.layer_marker_buffer, = self.uploads.add(self.layer_markers)
+
+        if self.arrows_enabled and self.arrow_buffer is None:
+            self.arrow_buffer, self.arrow_color_buffer = self.uploads.add(
+                self.arrows, self.colors.repeat(3, 0)) # each triplet of vertices shares the color
+        elif not self.arrows_enabled:
+            self.uploads.discard([self.arrow_buffer, self.arrow_color_buffer])
+            self.arrow_buffer       = free_buffer(self.arrow_buffer)
+            self.arrow_color_buffer = free_buffer(self.arrow_color_buffer)
+            if 'arrows' in self.vertex_arrays:
+                self.vertex_arrays.pop('arrows').delete()
+            if 'arrows' in self.sample_buffers:
+                self.sample_buffers.pop('arrows')[1].delete()
 
         self.initialized = True
 
-    def display(self, elevation=0, eye_height=0, mode_ortho=False, mode_2d=False):
+    def buffers(self):
+        if not self.initialized:
+            return []
+
+        buffers = [self.vertex_buffer, self.vertex_color_buffer, self.layer_marker_buffer,
+                   self.arrow_buffer, self.arrow_color_buffer]
+        for level_buffers in self.detail_buffers:
+            buffers.extend(level_buffers)
+        buffers.extend(buf for stride, buf in self.sample_buffers.values())
+        return [buf for buf in buffers if buf is not None]
+
+    def delete(self):
+        super(GcodeModel, self).delete()
+        for vertex_array in self.vertex_arrays.values():
+            vertex_array.delete()
+        self.vertex_arrays = {}
+
+        textures = [t for t in (self._burn_texture, self._hotspot_texture) if t is not None]
+        if textures:
+            glDeleteTextures(textures)
+        self._burn_texture = self._hotspot_texture = None
+
+    def display(self, elevation=0, eye_height=0, mode_ortho=False, mode_2d=False, pixel_size=0,
+                shading=None, interactive=False):
         glPushMatrix()
 
         offset_z = self.offset_z if not mode_2d else 0
         glTranslate(self.offset_x, self.offset_y, offset_z)
+        if mode_2d:
+            glScale(1.0, 1.0, 0.0) # discard z coordinates
 
         glEnableClientState(GL_VERTEX_ARRAY)
         glEnableClientState(GL_COLOR_ARRAY)
 
-        self._display_movements(elevation, eye_height, mode_ortho, mode_2d)
+        # depth is flattened in 2D mode, so near and far planes don't matter
+        frustum = Frustum.from_matrices(glGetDoublev(GL_MODELVIEW_MATRIX),
+                                        glGetDoublev(GL_PROJECTION_MATRIX),
+                                        depth=not mode_2d)
+
+        if shading is not None:
+            shading.set_model(shading.modelview(self.offset_x, self.offset_y, offset_z),
+                              flatten=mode_2d,
+                              top_z=self.layer_heights[self.num_layers_to_draw - 1])
+
+        if mode_2d and self.burn_preview_enabled:
+            self._display_burn_preview()
+        else:
+            self._display_movements(frustum, elevation, eye_height, mode_ortho, mode_2d,
+                                    pixel_size, shading, interactive)
+
+        if (mode_2d and self.hotspots_enabled and self.hotspots is not None and
+                self.hotspots_layer == self.num_layers_to_draw - 1):
+            self._display_hotspots()
 
         if self.arrows_enabled:
-            self._display_arrows()
+            self._display_arrows(frustum, shading, interactive)
 
         glDisableClientState(GL_COLOR_ARRAY)
 
@@ -350,88 +709,137 @@ class GcodeModel(Model):
         glDisableClientState(GL_VERTEX_ARRAY)
         glPopMatrix()
 
-    def _display_movements(self, elevation=0, eye_height=0, mode_ortho=False, mode_2d=False):
-        self.vertex_buffer.bind()
-        glVertexPointer(3, GL_FLOAT, 0, None)
-
-        self.vertex_color_buffer.bind()
-        glColorPointer(4, GL_FLOAT, 0, None)
+    def _display_movements(self, frustum, elevation=0, eye_height=0, mode_ortho=False,
+                           mode_2d=False, pixel_size=0, shading=None, interactive=False):
+        # pick the coarsest level of detail that is still accurate to a pixel
+        level_idx = choose_level(self.detail_levels, pixel_size)
+        if level_idx >= 0 and self.resident_items(self.detail_buffers[level_idx][0], 2) is not None:
+            # levels are uploaded after the full buffer, which draws what it can
+            level_idx = -1
+        if level_idx < 0:
+            chunks        = self.chunks
+            vertex_buffer = self.vertex_buffer
+            color_buffer  = self.vertex_color_buffer
+        else:
+            chunks = self.detail_chunks[level_idx]
+            vertex_buffer, color_buffer = self.detail_buffers[level_idx]
 
         if mode_2d:
-            glScale(1.0, 1.0, 0.0) # discard z coordinates
-            start = self.layer_stops[self.num_layers_to_draw - 1]
-            end   = self.layer_stops[self.num_layers_to_draw]
-
-            glDrawArrays(GL_LINES, start, end - start)
+            tree = chunks.trees[self.num_layers_to_draw - 1]
+            ranges = tree.visible_ranges(frustum)
 
         elif mode_ortho:
-            if elevation >= 0:
-                # draw layers in normal order, bottom to top
-                start = 0
-                end   = self.layer_stops[self.num_layers_to_draw]
+            visible = chunks.visible_leaves(frustum)
 
-                glDrawArrays(GL_LINES, start, end - start)
-
-            else:
-                # draw layers in reverse order, top to bottom
-                stop_idx = self.num_layers_to_draw - 1
-                while stop_idx >= 0:
-                    start = self.layer_stops[stop_idx]
-                    end   = self.layer_stops[stop_idx + 1]
-
-                    glDrawArrays(GL_LINES, start, end - start)
-
-                    stop_idx -= 1
+            # draw layers in normal order, bottom to top, when looking from
+            # above, and in reverse order, top to bottom, otherwise
+            ranges = chunks.layer_ranges(visible, 0, self.num_layers_to_draw,
+                                         reverse=(elevation < 0))
 
         else: # 3d projection mode
+            visible = chunks.visible_leaves(frustum)
+
+            # draw layers up to (and including) the threshold in normal
+            # order, bottom to top, and the ones above it in reverse order
             reverse_threshold_layer = self._layer_up_to_height(eye_height - self.offset_z)
+            normal_layers_to_draw = min(self.num_layers_to_draw, reverse_threshold_layer + 1)
 
-            if reverse_threshold_layer >= 0:
-                # draw layers up to (and including) the threshold in normal order, bottom to top
-                normal_layers_to_draw = min(self.num_layers_to_draw, reverse_threshold_layer + 1)
-                start = 0
-                end   = self.layer_stops[normal_layers_to_draw]
+            normal_starts, normal_ends = chunks.layer_ranges(
+                visible, 0, normal_layers_to_draw)
+            reverse_starts, reverse_ends = chunks.layer_ranges(
+                visible, normal_layers_to_draw, self.num_layers_to_draw, reverse=True)
 
-                glDrawArrays(GL_LINES, start, end - start)
+            ranges = (numpy.concatenate([normal_starts, reverse_starts]),
+                      numpy.concatenate([normal_ends, reverse_ends]))
 
-            if reverse_threshold_layer + 1 < self.num_layers_to_draw:
-                # draw layers from the threshold in reverse order, top to bottom
-                stop_idx = self.num_layers_to_draw - 1
-                while stop_idx > reverse_threshold_layer:
-                    start = self.layer_stops[stop_idx]
-                    end   = self.layer_stops[stop_idx + 1]
+        self._draw_buffers(GL_LINES, ranges, 2, vertex_buffer, color_buffer,
+                           ('level', level_idx), shading, self._stride(ranges, interactive))
 
-                    glDrawArrays(GL_LINES, start, end - start)
+    def _stride(self, ranges, interactive):
+        """
+        Return how many items of ranges to skip per item drawn. While the
+        view is being moved, an even sample is drawn to keep it responsive;
+        full detail is drawn once it settles.
+        """
+        stride = 1
+        if interactive:
+            count = (ranges[1] - ranges[0]).sum()
+            while count > self.INTERACTIVE_MOVEMENTS * stride:
+                stride *= 2
+        return stride
+
+    def _draw_buffers(self, mode, ranges, vertices_per_item, vertex_buffer, color_buffer,
+                      key, shading, stride=1):
+        """
+        Draw ranges of vertex and color buffers, through a vertex array
+        object when using shaders or with client-side state otherwise. With
+        stride over 1, only every stride-th item is drawn. Only items that
+        have been uploaded are drawn.
+        """
+        resident = self.resident_items(vertex_buffer, vertices_per_item)
+        if resident is not None:
+            ranges = clip_ranges(ranges, resident)
+
+        if shading is not None:
+            if key not in self.vertex_arrays:
+                self.vertex_arrays[key] = VertexArray([
+                    (ATTRIB_POSITION, vertex_buffer, 3),
+                    (ATTRIB_COLOR, color_buffer, 4),
+                ])
+            vertex_array = self.vertex_arrays[key]
+
+            shading.use_lines()
+            vertex_array.bind()
+            self._draw_ranges(mode, ranges, vertices_per_item, vertex_buffer, key, stride)
+            vertex_array.unbind()
+            shading.done()
+            return
 
-                    stop_idx -= 1
+        vertex_buffer.bind()
+        glVertexPointer(3, GL_FLOAT, 0, None)
 
-        self.vertex_buffer.unbind()
-        self.vertex_color_buffer.unbind()
+        color_buffer.bind()
+        glColorPointer(4, GL_FLOAT, 0, None)
 
-    def _layer_up_to_height(self, height):
-        """Return the index of the last layer lower than height."""
-        for idx in range(len(self.layer_heights) - 1, -1, -1):
-            if self.layer_heights[idx] < height:
-                return idx
+        self._draw_ranges(mode, ranges, vertices_per_item, vertex_buffer, key, stride)
 
-        return 0
+        vertex_buffer.unbind()
+        color_buffer.unbind()
 
-    def _display_arrows(self):
-        self.arrow_buffer.bind()
-        glVertexPointer(3, GL_FLOAT, 0, None)
+    def _draw_ranges(self, mode, ranges, vertices_per_item, vertex_buffer, key, stride):
+        if stride == 1:
+            draw_ranges(mode, ranges, vertices_per_item)
+            return
 
-        self.arrow_color_buffer.bind()
-        glColorPointer(4, GL_FLOAT, 0, None)
+        # index buffers are kept for the last stride used with each buffer
+        sampled = self.sample_buffers.get(key)
+        if sampled is None or sampled[0] != stride:
+            if sampled is not None:
+                sampled[1].delete()
+            num_items = vertex_buffer.size // (12 * vertices_per_item)
+            indices = sample_indices(num_items, vertices_per_item, stride)
+            sampled = (stride, VBO(indices, 'GL_STATIC_DRAW', 'GL_ELEMENT_ARRAY_BUFFER'))
+            self.sample_buffers[key] = sampled
 
-        start = (self.layer_stops[self.num_layers_to_draw - 1] // 2) * 3
-        end   = (self.layer_stops[self.num_layers_to_draw] // 2) * 3
+        draw_sampled_ranges(mode, ranges, vertices_per_item, stride, sampled[1])
 
-        glDrawArrays(GL_TRIANGLES, start, end - start)
+    def _layer_up_to_height(self, height):
+        """Return the index of the last layer lower than height."""
+        # the lowest height among a layer and the layers above it never
+        # decreases, so the last layer lower than height can be bisected
+        idx = numpy.searchsorted(self._layer_floors, height, 'left') - 1
+        return max(int(idx), 0)
 
-        self.arrow_buffer.unbind()
-        self.arrow_color_buffer.unbind()
+    def _display_arrows(self, frustum, shading=None, interactive=False):
+        tree = self.chunks.trees[self.num_layers_to_draw - 1]
+        ranges = tree.visible_ranges(frustum)
+        self._draw_buffers(GL_TRIANGLES, ranges, 3, self.arrow_buffer, self.arrow_color_buffer,
+                           'arrows', shading, self._stride(ranges, interactive))
 
     def _display_layer_markers(self):
+        if self.resident_items(self.layer_marker_buffer, 1) is not None:
+            return
+
         self.layer_marker_buffer.bind()
         glVertexPointer(3, GL_FLOAT, 0, None)
 
@@ -440,22 +848,202 @@ class GcodeModel(Model):
 
         glColor4f(1.0, 0.0, 0.0, 0.6)
         glDrawArrays(GL_TRIANGLES, start, end - start)
+        count_draw(1, end - start)
 
         self.layer_marker_buffer.unbind()
 
+    def _display_burn_preview(self):
+        layer_idx = self.num_layers_to_draw - 1
+        max_size = min(self.BURN_PREVIEW_MAX_SIZE, glGetIntegerv(GL_MAX_TEXTURE_SIZE))
+        raster = self.burn_preview(layer_idx, max_size)
+        if self._burn_texture_layer != layer_idx:
+            # burn marks are black, with opacity showing how much energy went in
+            pixels = numpy.zeros((raster.height, raster.width, 4), numpy.uint8)
+            pixels[..., 3] = to_intensity(raster.data)
+
+            self._burn_texture = upload_texture(self._burn_texture, pixels)
+            self._burn_texture_layer = layer_idx
+
+        draw_texture(self._burn_texture, raster.extent)
+
+    def _display_hotspots(self):
+        if self._hotspot_texture is None:
+            # overburnt cells are opaque red, everything else is transparent
+            mask = self.hotspots.mask.data
+            pixels = numpy.zeros(mask.shape + (4,), numpy.uint8)
+            pixels[mask] = (255, 0, 0, 200)
+            self._hotspot_texture = upload_texture(None, pixels)
+
+        glDisable(GL_DEPTH_TEST)
+        draw_texture(self._hotspot_texture, self.hotspots.mask.extent)
+        glEnable(GL_DEPTH_TEST)
+
+    # ------------------------------------------------------------------------
+    # BURN PREVIEW
+    # ------------------------------------------------------------------------
+
+    def burn_preview(self, layer_idx, max_size=BURN_PREVIEW_MAX_SIZE):
+        """
+        Return an image of power multiplied by dwell time for a layer.
+
+        Images are computed on first use and cached for each size limit.
+        """
+        key = (layer_idx, max_size)
+        if key not in self._burn_previews:
+            start = self.layer_stops[layer_idx]
+            end   = self.layer_stops[layer_idx + 1]
+            self._burn_previews[key] = burn_image(
+                self.vertices[start:end],
+                self.powers[start // 2:end // 2],
+                self.feedrates[start // 2:end // 2],
+                self.burn_preview_resolution, max_size)
+        return self._burn_previews[key]
+
+    def export_burn_preview(self, path):
+        """
+        Save the burn preview of the currently displayed layer as a PNG file.
+        """
+        save_png(self.burn_preview(self.num_layers_to_draw - 1), path)
+
+    def layer_hotspots(self, layer_idx, watts, power_scale, threshold):
+        """
+        Find cells of a layer that receive more than threshold J/mm^2 when
+        spindle speed power_scale means watts of laser power.
+
+        Energy density is computed at the burn preview resolution, however
+        coarse the preview itself, so that narrow peaks are not averaged out.
+        Results are cached. Nothing is drawn, so this may be called from a
+        worker thread.
+        """
+        key = (layer_idx, watts, power_scale, threshold)
+        if key not in self._hotspots:
+            start = self.layer_stops[layer_idx]
+            end   = self.layer_stops[layer_idx + 1]
+            self._hotspots[key] = find_hotspots(
+                self.vertices[start:end],
+                self.powers[start // 2:end // 2],
+                self.feedrates[start // 2:end // 2],
+                self.burn_preview_resolution, watts, power_scale, threshold,
+                self.BURN_PREVIEW_MAX_SIZE)
+        return self._hotspots[key]
+
+    def set_hotspots(self, hotspots, layer_idx):
+        """
+        Highlight the hotspots found for a layer while it is displayed.
+        """
+        if self.hotspots is hotspots:
+            return
+        self.hotspots = hotspots
+        self.hotspots_layer = layer_idx
+        if self._hotspot_texture is not None:
+            glDeleteTextures([self._hotspot_texture])
+            self._hotspot_texture = None
+
+    def find_hotspots(self, watts, power_scale, threshold):
+        """
+        Find and highlight the hotspots of the currently displayed layer.
+        """
+        layer_idx = self.num_layers_to_draw - 1
+        self.set_hotspots(self.layer_hotspots(layer_idx, watts, power_scale, threshold),
+                          layer_idx)
+        return self.hotspots
+
+    # ------------------------------------------------------------------------
+    # PICKING
+    # ------------------------------------------------------------------------
+
+    @property
+    def segment_grid(self):
+        """
+        Spatial index of movements, built the first time it is needed.
+        """
+        if self._segment_grid is None:
+            self._segment_grid = SegmentGrid(self.vertices[0::2], self.vertices[1::2])
+        return self._segment_grid
+
+    def pick(self, x, y, radius, layer_idx):
+        """
+        Return the index of the movement of a layer closest to point x, y
+        within radius, or None.
+        """
+        lo = self.layer_stops[layer_idx] // 2
+        hi = self.layer_stops[layer_idx + 1] // 2
+        if lo == hi:
+            return None
+        return self.segment_grid.nearest(x, y, radius, lo, hi)
+
+    def pick_layers(self, points, radius):
+        """
+        Return the index of the movement closest to the point given for its
+        layer within radius, on the topmost layer with one, or None. points
+        has one row of x, y for each of the layers from the bottom up.
+        """
+        stops = numpy.asarray(self.layer_stops[:len(points) + 1]) // 2
+        return self.segment_grid.nearest_per_range(points, radius, stops)
+
+    def segment_info(self, idx):
+        """
+        Return a short description of a movement and the Gcode line it came from.
+        """
+        line_no = int(self.source_lines[idx])
+        info = 'Line %d' % line_no
+
+        text = self.source.line(line_no) if self.source is not None else None
+        if text:
+            info += ': %s' % text.strip()
+
+        info += '\nF%g S%g' % (self.feedrates[idx], self.powers[idx])
+        return info
+
 
 class StlModel(Model):
     """
     Model for displaying and manipulating STL data.
+
+    Given a weld tolerance, the model is indexed: vertices closer than the
+    tolerance are merged and facets refer to them by index, instead of each
+    facet having its own three vertices. Normals are then flat, as in the
+    file, or smoothed per vertex. Otherwise there is one normal per facet.
+    Normals are uploaded packed into bytes.
+
+    Scaling, rotating and translating the model changes its model matrix,
+    applied when drawing, rather than the vertices; it is baked into the
+    vertices only when they are exported.
     """
+    def __init__(self, weld_tolerance=None, smooth_normals=False):
+        super(StlModel, self).__init__()
+        self.weld_tolerance = weld_tolerance
+        self.smooth_normals = smooth_normals
+
     def load_data(self, model_data, callback=None):
         t_start = time.time()
 
         vertices, normals = model_data
         # convert python lists to numpy arrays for constructing vbos
-        self.vertices = numpy.require(vertices, 'f')
-        self.normals  = numpy.require(normals, 'f')
+        self.vertices = numpy.require(vertices, 'f').reshape(-1, 3)
+        self.normals  = numpy.require(normals, 'f').reshape(-1, 3)
+
+        # three indices into vertices per facet, if the model is indexed
+        self.indices = None
 
+        # facets without a usable normal in the file get a calculated one
+        missing = ~numpy.isfinite(self.normals).all(1) | (self.normals == 0).all(1)
+        if missing.all():
+            logging.info('STL model has no normal data')
+            self.normals = self.calculate_normals()
+        elif missing.any():
+            self.normals[missing] = mesh.facet_normals(self.facets()[missing])
+
+        if self.weld_tolerance is not None:
+            self.weld()
+
+        # 4x4 transformation for column vectors, applied to the vertices when
+        # drawing and exporting
+        self.matrix = numpy.identity(4)
+        self._local_bounds  = None # box around the untransformed vertices
+        self._hull_points   = None # see mesh.extreme_points()
+        self._hull          = None # see mesh.convex_hull()
+        self.local_metrics  = None # see analyze()
         self.scaling_factor = 1.0
         self.rotation_angle = {
             self.AXIS_X: 0.0,
@@ -470,33 +1058,160 @@ class StlModel(Model):
         self.vertex_count = len(self.vertices)
         self.initialized = False
 
+        # buffers whose data has changed since they were last uploaded
+        self.vertex_buffer = None
+        self.normal_buffer = None
+        self.index_buffer  = None
+        self.vertex_array  = None # for the shader renderer, created on demand
+        self.dirty_buffers = set(['vertices', 'normals', 'indices'])
+
         t_end = time.time()
 
         logging.info('Initialized STL model in %.2f seconds' % (t_end - t_start))
         logging.info('Vertex count: %d' % self.vertex_count)
 
-    def normal_data_empty(self):
+    def weld(self):
         """
-        Return true if the model has no normal data.
+        Merge the copies of vertices shared by facets and index them.
         """
-        empty = (self.normals.max() == 0 and self.normals.min() == 0)
-        return empty
+        t_start = time.time()
+        count = len(self.vertices)
 
-    def calculate_normals(self):
+        if self.smooth_normals:
+            kept, self.indices = mesh.weld(self.vertices, self.weld_tolerance)
+            self.vertices = self.vertices[kept]
+            self.normals  = mesh.vertex_normals(self.vertices, self.indices)
+        else:
+            normals = self.normals.repeat(3, 0)
+            kept, self.indices = mesh.weld(self.vertices, self.weld_tolerance, normals)
+            self.vertices = self.vertices[kept]
+            self.normals  = normals[kept]
+
+        logging.info('Welded %d vertices into %d in %.2f seconds' % (
+            count, len(self.vertices), time.time() - t_start))
+
+    @property
+    def facet_count(self):
+        if self.indices is not None:
+            return len(self.indices) // 3
+        return len(self.vertices) // 3
+
+    def facets(self):
+        """
+        Return the vertices of each facet as an array of shape (n, 3, 3).
+        """
+        if self.indices is not None:
+            return self.vertices[self.indices].reshape(-1, 3, 3)
+        return self.vertices.reshape(-1, 3, 3)
+
+    def facet_normals(self):
+        """
+        Return one normal per facet.
+        """
+        if self.indices is None:
+            return self.normals
+        if self.smooth_normals:
+            return mesh.facet_normals(self.facets())
+        return self.normals[self.indices[0::3]]
+
+    def transformed_facets(self):
+        """
+        Return facets and their normals as facets() and facet_normals() do,
+        with the model matrix applied.
+        """
+        facets = mesh.transform_points(self.facets().reshape(-1, 3), self.matrix)
+        normals = mesh.transform_normals(self.facet_normals(), self.matrix)
+        return facets.reshape(-1, 3, 3), normals
+
+    def hull_points(self):
+        """
+        Return the points of the model on its convex hull, or the corners of
+        a polytope around it for large models, found on first use, which
+        bound the model under any transformation.
+        """
+        if self._hull_points is None:
+            t_start = time.time()
+            self._hull_points = mesh.extreme_points(self.vertices)
+            logging.info('Found %d hull points in %.2f seconds' % (
+                len(self._hull_points), time.time() - t_start))
+        return self._hull_points
+
+    def hull(self):
+        """
+        Return the convex hull of the model as mesh.convex_hull() does,
+        found on first use. Hulls of many points are approximated by the
+        hull of a sample of them.
+        """
+        if self._hull is None:
+            points = mesh.sample_points(self.hull_points(), mesh.HULL_SAMPLE_SIZE)
+            self._hull = mesh.convex_hull(points)
+        return self._hull
+
+    def slice(self, heights, processes=None):
+        """
+        Return the contours of the model as transformed at each of heights,
+        see slicer.slice_heights().
+        """
+        facets = mesh.transform_points(self.facets().reshape(-1, 3), self.matrix)
+        return slicer.slice_heights(facets.reshape(-1, 3, 3), heights, processes)
+
+    def analyze(self):
+        """
+        Return measurements of the model as loaded, kept in local_metrics.
+        Analyzing takes seconds for large meshes, so the loader does it in
+        the background once the model is loaded.
+        """
+        if self.local_metrics is None:
+            t_start = time.time()
+            if self.smooth_normals:
+                # vertices are shared wherever they meet, and the normals
+                # follow the winding by construction
+                metrics = analysis.analyze(self.vertices, self.indices)
+            else:
+                # copies of a vertex with different normals are kept apart
+                # by welding, but have the same coordinates
+                metrics = analysis.analyze(self.facets().reshape(-1, 3),
+                                           normals=self.facet_normals())
+            logging.info('Analyzed STL model in %.2f seconds' % (time.time() - t_start))
+            self.local_metrics = metrics
+        return self.local_metrics
+
+    def metrics(self):
         """
-        Calculate surface normals for model vertices.
+        Return measurements of the model as transformed, see analyze().
         """
-        a = self.vertices[0::3] - self.vertices[1::3]
-        b = self.vertices[1::3] - self.vertices[2::3]
-        cross = numpy.cross(a, b)
+        return self.analyze().transformed(self.matrix)
+
+    def _calculate_bounding_box(self):
+        if self._local_bounds is None:
+            self._local_bounds = self.vertices.min(0), self.vertices.max(0)
+
+        linear = self.matrix[:3, :3]
+        if (numpy.abs(linear) > 1e-6 * numpy.abs(linear).max()).sum(0).max() == 1:
+            # without rotation, or with quarter turns only, the box around
+            # the transformed vertices is the transformed box around them
+            points = mesh.box_corners(*self._local_bounds)
+        else:
+            points = self.hull_points()
 
-        # normalize the cross product
-        magnitudes = numpy.apply_along_axis(numpy.linalg.norm, 1, cross).reshape(-1, 1)
-        normals = cross / magnitudes
+        lower_corner, upper_corner = mesh.transformed_bounds(points, self.matrix)
+        return BoundingBox(upper_corner, lower_corner)
+
+    def calculate_normals(self):
+        """
+        Calculate surface normals: one per facet, or one per vertex if the
+        model is indexed. Degenerate facets get zero normals.
+        """
+        if self.indices is not None:
+            return mesh.vertex_normals(self.vertices, self.indices)
+        return mesh.facet_normals(self.facets())
 
-        # each of 3 facet vertices shares the same normal
-        normals = normals.repeat(3, 0)
-        return normals
+    def packed_normals(self):
+        """
+        Return normals for the normal buffer, one per vertex.
+        """
+        packed = mesh.pack_normals(self.normals)
+        return packed.repeat(3, 0) if self.indices is None else packed
 
     # ------------------------------------------------------------------------
     # DRAWING
@@ -504,16 +1219,77 @@ class StlModel(Model):
 
     def init(self):
         """
-        Create vertex buffer objects (VBOs).
+        Create vertex buffer objects (VBOs) or update the ones whose data has
+        changed since they were uploaded.
         """
-        self.vertex_buffer = VBO(self.vertices, 'GL_STATIC_DRAW')
+        if 'vertices' in self.dirty_buffers:
+            # sort facets into spatial chunks, so that chunks out of view can
+            # be skipped when drawing
+            facets = self.facets()
+            self.chunks = ChunkTree(facets.min(1), facets.max(1))
+
+            order = self.chunks.order
+            if (numpy.diff(order) != 1).any():
+                if self.indices is not None:
+                    self.indices = self.indices.reshape(-1, 3)[order].reshape(-1)
+                    self.dirty_buffers.add('indices')
+                else:
+                    self.vertices = facets[order].reshape(-1, 3)
+                    self.normals  = self.normals[order]
+                    self.dirty_buffers.add('normals')
+
+        if self.uploads is None:
+            # the first upload is spread over frames
+            self.uploads = UploadQueue()
+            self.vertex_buffer, self.normal_buffer = self.uploads.add(self.vertices,
+                                                                      self.packed_normals())
+            if self.indices is not None:
+                self.index_buffer = self.uploads.add_indices(self.indices)
+        else:
+            if self.dirty_buffers and self.uploads.discard(self.buffers()):
+                # edits made before the upload completed are uploaded at once
+                self.dirty_buffers.update(['vertices', 'normals', 'indices'])
+
+            if 'vertices' in self.dirty_buffers:
+                self.vertex_buffer = update_buffer(self.vertex_buffer, self.vertices)
+            if 'normals' in self.dirty_buffers:
+                self.normal_buffer = update_buffer(self.normal_buffer, self.packed_normals())
+            if 'indices' in self.dirty_buffers and self.indices is not None:
+                self.index_buffer = update_buffer(self.index_buffer, self.indices,
+                                                  'GL_ELEMENT_ARRAY_BUFFER')
+
+        # a vertex array object refers to buffers that may have been replaced
+        if self.vertex_array is not None and (
+                self.vertex_array.buffers[0] is not self.vertex_buffer or
+                self.vertex_array.buffers[1] is not self.normal_buffer):
+            self.vertex_array.delete()
+            self.vertex_array = None
+
+        self.dirty_buffers.clear()
+        self.initialized = True
 
-        if self.normal_data_empty():
-            logging.info('STL model has no normal data')
-            self.normals = self.calculate_normals()
+    def buffers(self):
+        return [buf for buf in (self.vertex_buffer, self.normal_buffer, self.index_buffer)
+                if buf is not None]
 
-        self.normal_buffer = VBO(self.normals, 'GL_STATIC_DRAW')
-        self.initialized = True
+    def visible_ranges(self, frustum):
+        """
+        Return ranges of facets in view that have been uploaded.
+        """
+        ranges = self.chunks.visible_ranges(frustum)
+        if self.indices is None:
+            resident = self.resident_items(self.vertex_buffer, 3)
+        elif self.resident_items(self.vertex_buffer, 1) is not None:
+            resident = 0 # facets may use any of the vertices
+        else:
+            resident = self.resident_items(self.index_buffer, 3)
+        return clip_ranges(ranges, resident) if resident is not None else ranges
+
+    def _draw_facet_ranges(self, ranges):
+        if self.indices is not None:
+            draw_indexed_ranges(GL_TRIANGLES, ranges, 3, self.index_buffer)
+        else:
+            draw_ranges(GL_TRIANGLES, ranges, 3)
 
     def draw_facets(self):
         glPushMatrix()
@@ -537,6 +1313,11 @@ class StlModel(Model):
         glLightfv(GL_LIGHT0, GL_POSITION, self.light_position)
         glLightfv(GL_LIGHT1, GL_POSITION, (-20.0, -20.0, 20.0))
 
+        # lights stay put while the model is transformed; scaling changes the
+        # length of normals
+        glMultMatrixd(self.matrix.T)
+        glEnable(GL_NORMALIZE)
+
         glColor(1.0, 1.0, 1.0)
 
         ### VBO stuff
@@ -544,12 +1325,14 @@ class StlModel(Model):
         self.vertex_buffer.bind()
         glVertexPointer(3, GL_FLOAT, 0, None)
         self.normal_buffer.bind()
-        glNormalPointer(GL_FLOAT, 0, None)
+        glNormalPointer(GL_BYTE, 4, None)
 
         glEnableClientState(GL_VERTEX_ARRAY)
         glEnableClientState(GL_NORMAL_ARRAY)
 
-        glDrawArrays(GL_TRIANGLES, 0, len(self.vertices))
+        frustum = Frustum.from_matrices(glGetDoublev(GL_MODELVIEW_MATRIX),
+                                        glGetDoublev(GL_PROJECTION_MATRIX))
+        self._draw_facet_ranges(self.visible_ranges(frustum))
 
         glDisableClientState(GL_NORMAL_ARRAY)
         glDisableClientState(GL_VERTEX_ARRAY)
@@ -558,12 +1341,39 @@ class StlModel(Model):
 
         ### end VBO stuff
 
+        glDisable(GL_NORMALIZE)
         glDisable(GL_LIGHT1)
         glDisable(GL_LIGHT0)
 
         glPopMatrix()
 
+    def draw_facets_shaded(self, shading):
+        """
+        Draw facets with the shader renderer, lighting them in the fragment
+        shader instead of with fixed-function lights.
+        """
+        if self.vertex_array is None:
+            self.vertex_array = VertexArray([
+                (ATTRIB_POSITION, self.vertex_buffer, 3),
+                (ATTRIB_NORMAL, self.normal_buffer, 4, GL_BYTE),
+            ])
+
+        modelview = numpy.dot(shading.view, self.matrix)
+        frustum = Frustum.from_matrices(modelview.T, shading.projection.T)
+
+        shading.set_model(modelview)
+        shading.use_facets()
+        self.vertex_array.bind()
+        self._draw_facet_ranges(self.visible_ranges(frustum))
+        self.vertex_array.unbind()
+        shading.done()
+
     def display(self, *args, **kwargs):
+        shading = kwargs.get('shading')
+        if shading is not None:
+            self.draw_facets_shaded(shading)
+            return
+
         glEnable(GL_LIGHTING)
         self.draw_facets()
         glDisable(GL_LIGHTING)
@@ -572,53 +1382,94 @@ class StlModel(Model):
     # TRANSFORMATIONS
     # ------------------------------------------------------------------------
 
+    def transform(self, matrix):
+        """
+        Apply a 4x4 transformation for column vectors on top of the current
+        ones.
+        """
+        self.matrix = numpy.dot(matrix, self.matrix)
+        self.invalidate_bounding_box()
+        self.modified = True
+
     def scale(self, factor):
         if factor != self.scaling_factor:
-            logging.info('actually scaling vertices')
-            self.vertices *= (factor / self.scaling_factor)
+            ratio = factor / self.scaling_factor
+            self.transform(vector.gl_scale(ratio, ratio, ratio))
             self.scaling_factor = factor
-            self.invalidate_bounding_box()
-            self.modified = True
 
     def translate(self, x, y, z):
-        self.vertices = vector.translate(self.vertices, x, y, z)
-        self.invalidate_bounding_box()
-        self.modified = True
+        self.transform(vector.gl_translate(x, y, z))
 
     def rotate_rel(self, angle, axis):
-        logging.info('rotating vertices by a relative angle of '
+        logging.info('rotating model by a relative angle of '
                      '%.2f degrees along the %s axis' %
                      (angle, self.axis_letter_map[axis]))
 
         angle = angle % 360
-        self.vertices = vector.rotate(self.vertices, angle, *axis)
+        # same direction as multiplying row vectors by vector.rotation_matrix()
+        self.transform(vector.gl_rotate(-angle, *axis))
         self.rotation_angle[axis] += angle
-        self.invalidate_bounding_box()
-        self.modified = True
 
     def rotate_abs(self, angle, axis):
         angle = angle % 360
         if self.rotation_angle[axis] == angle:
             return
 
-        logging.info('rotating vertices by an absolute angle of '
+        logging.info('rotating model by an absolute angle of '
                      '%.2f degrees along the %s axis' %
                      (angle, self.axis_letter_map[axis]))
-        final_matrix = vector.identity_matrix()
-
-        # modify matrix to rotate to initial position
-        for v in [self.AXIS_Z, self.AXIS_Y, self.AXIS_X]:
-            matrix = vector.rotation_matrix(-self.rotation_angle[v], *v)
-            final_matrix = final_matrix.dot(matrix)
 
-        # change the angle
-        self.rotation_angle[axis] = angle
+        angles = dict(self.rotation_angle)
+        angles[axis] = angle
+        self.set_rotation(angles)
 
-        # modify matrix to rotate to new position
+    def set_rotation(self, angles):
+        """
+        Rotate the model to absolute angles about the axes, given as a dict
+        like rotation_angle.
+        """
+        # rotate to initial position, then to the new one
+        final_matrix = numpy.dot(self.rotation_matrix(angles),
+                                 self.rotation_matrix(self.rotation_angle).T)
+        for axis, angle in angles.items():
+            self.rotation_angle[axis] = angle % 360
+        self.transform(final_matrix)
+
+    def rotation_matrix(self, angles):
+        """
+        Return the 4x4 rotation by angles about the x, then the y, then the
+        z axis, given as a dict like rotation_angle.
+        """
+        matrix = numpy.identity(4)
         for v in [self.AXIS_X, self.AXIS_Y, self.AXIS_Z]:
-            matrix = vector.rotation_matrix(self.rotation_angle[v], *v)
-            final_matrix = final_matrix.dot(matrix)
+            # same direction as rotate_rel()
+            matrix = numpy.dot(vector.gl_rotate(-angles[v], *v), matrix)
+        return matrix
 
-        self.vertices = self.vertices.dot(final_matrix)
-        self.invalidate_bounding_box()
-        self.modified = True
+    def lay_flat(self):
+        """
+        Rotate the model about the x and y axes to rest on the largest face
+        of its convex hull that it would not tip over from. Returns False if
+        the model is flat and has nothing to rest on.
+        """
+        t_start = time.time()
+        rotation = self.rotation_matrix(self.rotation_angle)[:3, :3]
+        try:
+            # the way down in model coordinates breaks ties in favor of
+            # the current orientation
+            x, y, z = mesh.resting_normal(*self.hull(), down=numpy.dot(rotation.T, (0, 0, -1)))
+        except ValueError:
+            return False
+
+        # turning about x takes the normal into the xz plane, facing down,
+        # then turning about y points it straight down; the angles are
+        # negated as in rotation_matrix()
+        angle_x = math.atan2(-y, -z)
+        angle_y = math.atan2(x, math.hypot(y, z))
+        self.set_rotation({
+            self.AXIS_X: round(-math.degrees(angle_x), 6),
+            self.AXIS_Y: round(-math.degrees(angle_y), 6),
+            self.AXIS_Z: self.rotation_angle[self.AXIS_Z],
+        })
+        logging.info('Laid STL model flat in %.2f seconds' % (time.time() - t_start))
+        return True
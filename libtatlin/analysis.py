@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 Denis Kobozev
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Measurements and defect checks of triangle meshes.
+
+A closed mesh, which encloses a volume, has every edge shared by exactly two
+facets that run along it in opposite directions. Edges are counted by
+sorting keys made from the vertices at their ends: the vertex indices of an
+indexed mesh, or hashes of the coordinates for a triangle soup, whose
+copies of a vertex are the same to the bit.
+"""
+
+from __future__ import division
+
+import numpy
+
+from . import mesh
+
+
+class MeshMetrics(object):
+    """
+    Size and defects of a mesh.
+    """
+    def __init__(self, facet_count, volume, area, degenerate_facets,
+                 boundary_edges, non_manifold_edges, misoriented_edges, flipped_normals):
+        self.facet_count = facet_count
+        self.volume = volume # signed, negative if the mesh is inside out
+        self.area   = area
+        self.degenerate_facets  = degenerate_facets  # of zero area
+        self.boundary_edges     = boundary_edges     # used by one facet
+        self.non_manifold_edges = non_manifold_edges # used by more than two facets
+        self.misoriented_edges  = misoriented_edges  # two facets with opposite windings
+        self.flipped_normals    = flipped_normals    # normals against the winding
+
+    @property
+    def watertight(self):
+        return self.boundary_edges == 0 and self.non_manifold_edges == 0
+
+    def transformed(self, matrix):
+        """
+        Return the metrics of the mesh with the rotation and uniform scaling
+        of a 4x4 matrix applied.
+        """
+        determinant = numpy.linalg.det(matrix[:3, :3])
+        scaled = MeshMetrics(**self.__dict__)
+        scaled.volume = self.volume * determinant
+        scaled.area   = self.area * abs(determinant) ** (2 / 3)
+        return scaled
+
+
+def analyze(vertices, indices=None, normals=None):
+    """
+    Measure a mesh given by vertices, three per facet, or by vertices and
+    indices into them, three per facet. With normals given, one per facet,
+    count those pointing against the winding of their facets.
+    """
+    vertices = numpy.asarray(vertices, 'f')
+    if indices is None:
+        # -0.0 + 0.0 is 0.0, so that both zeros have the same bits
+        corners = mesh.hash_rows((vertices + 0.0).view(numpy.uint32))
+    else:
+        corners = numpy.asarray(indices, numpy.int64)
+    corners = corners.reshape(-1, 3)
+
+    # volumes of the tetrahedra between the facets and a point close to the
+    # mesh, which keeps rounding errors small
+    origin = (vertices.min(0) + vertices.max(0)) / 2 if len(vertices) else 0
+    volume = area = 0.0
+    degenerate = flipped = 0
+    for start in xrange(0, len(corners), mesh.TRANSFORM_CHUNK):
+        if indices is None:
+            facets = vertices[start * 3:(start + mesh.TRANSFORM_CHUNK) * 3].reshape(-1, 3, 3)
+        else:
+            facets = vertices[indices[start * 3:(start + mesh.TRANSFORM_CHUNK) * 3]].reshape(-1, 3, 3)
+        a, b, c = [(facets[:, i] - origin).astype('d') for i in range(3)]
+        cross = numpy.cross(b - a, c - a)
+        doubled_areas = numpy.sqrt((cross * cross).sum(1))
+
+        volume += (cross * a).sum() / 6
+        area += doubled_areas.sum() / 2
+        degenerate += (doubled_areas == 0).sum()
+        if normals is not None:
+            chunk_normals = normals[start:start + mesh.TRANSFORM_CHUNK]
+            flipped += ((chunk_normals * cross).sum(1) < 0).sum()
+
+    boundary, non_manifold, misoriented = count_edges(corners)
+    return MeshMetrics(
+        facet_count        = len(corners),
+        volume             = float(volume),
+        area               = float(area),
+        degenerate_facets  = int(degenerate),
+        boundary_edges     = boundary,
+        non_manifold_edges = non_manifold,
+        misoriented_edges  = misoriented,
+        flipped_normals    = int(flipped),
+    )
+
+def count_edges(corners):
+    """
+    Return the numbers of boundary, non-manifold and misoriented edges of
+    facets given by the keys of their corners.
+    """
+    starts = corners.ravel()
+    ends = corners[:, [1, 2, 0]].ravel()
+
+    # the key of an edge is the same in both directions except for the
+    # lowest bit, which tells which one it is
+    keys = mesh.hash_rows(numpy.column_stack([numpy.minimum(starts, ends),
+                                              numpy.maximum(starts, ends)]))
+    keys = (keys & ~1) | (starts > ends)
+    keys.sort()
+
+    edges = keys >> 1
+    first = numpy.flatnonzero(numpy.concatenate([[True], edges[1:] != edges[:-1]]))
+    uses = numpy.diff(numpy.concatenate([first, [len(edges)]]))
+
+    # edges of two facets are misoriented if both run the same way
+    pairs = first[uses == 2]
+    misoriented = int(((keys[pairs] & 1) == (keys[pairs + 1] & 1)).sum())
+    return int((uses == 1).sum()), int((uses > 2).sum()), misoriented
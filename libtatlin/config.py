@@ -14,10 +14,26 @@ class Config(object):
             'machine.platform_offset_x': None,
             'machine.platform_offset_y': None,
             'machine.platform_offset_z': None,
+            # full power of the laser in watts, reached at the 'laser high'
+            # spindle speed
+            'machine.laser_watts': 5.0,
+            # energy density in J/mm^2 above which the material scorches
+            'laser.overburn_threshold': 5.0,
             'ui.recent_files': None,
             'ui.window_w': 640,
             'ui.window_h': 700,
             'ui.gcode_2d': False,
+            # 'fixed' for the fixed-function pipeline or 'shaders' for GLSL
+            'ui.renderer': 'fixed',
+            'ui.frame_stats': False,
+            # millimetres below the top layer over which Gcode fades out
+            # when drawn with shaders; no fading when zero
+            'ui.layer_fade': 0.0,
+            'ui.frame_stats_log': None,
+            # merge STL vertices closer than this many millimetres, indexing
+            # facets instead of storing three vertices each
+            'stl.weld_tolerance': None,
+            'stl.smooth_normals': False,
         }
 
         self.fname = fname
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 Denis Kobozev
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Spatial chunking of geometry for skipping what is outside of the view.
+
+Primitives (line segments or triangles) are reordered so that every node of a
+quadtree over their X, Y positions covers a contiguous range of primitives.
+This way a visible part of the model can still be drawn with a few calls
+covering long ranges of a single vertex buffer.
+"""
+
+from __future__ import division
+
+import numpy
+
+
+# number of times the bounding square of the primitives is subdivided at most
+MAX_DEPTH = 10
+
+# nodes with at most this many primitives are not subdivided further
+LEAF_SIZE = 4096
+
+
+class Frustum(object):
+    """
+    Clipping planes of a view in model coordinates.
+    """
+    def __init__(self, planes):
+        self.planes = numpy.asarray(planes, 'd')
+
+    @classmethod
+    def from_matrices(cls, modelview, projection, depth=True):
+        """
+        Extract planes from matrices in the column-major layout returned by
+        glGetDoublev. With depth set to false, near and far planes are left
+        out, which is useful when depth is flattened away.
+        """
+        clip = numpy.dot(numpy.asarray(projection).T, numpy.asarray(modelview).T)
+        planes = [
+            clip[3] + clip[0], clip[3] - clip[0], # left, right
+            clip[3] + clip[1], clip[3] - clip[1], # bottom, top
+        ]
+        if depth:
+            planes.extend([clip[3] + clip[2], clip[3] - clip[2]]) # near, far
+        return cls(planes)
+
+    def test(self, lower, upper):
+        """
+        Classify boxes given by their lower and upper corners. Return a pair
+        of boolean arrays: boxes that are at least partially visible and
+        boxes that are entirely visible.
+        """
+        normals = self.planes[:, :3]
+        distances = self.planes[:, 3]
+        positive = normals >= 0
+
+        # corners of every box farthest along and against each plane normal
+        far_corners  = numpy.where(positive, upper[:, None, :], lower[:, None, :])
+        near_corners = numpy.where(positive, lower[:, None, :], upper[:, None, :])
+
+        visible   = ((far_corners * normals).sum(2) + distances >= 0).all(1)
+        contained = ((near_corners * normals).sum(2) + distances >= 0).all(1)
+        return visible, contained
+
+
+class ChunkTree(object):
+    """
+    Quadtree over primitives with bounding boxes given by lower and upper
+    corners.
+
+    Primitives need to be reordered by `order` before the node ranges are
+    valid. Ranges are offset by `first`, so that trees of consecutive parts of
+    a buffer can use indices into the whole buffer.
+    """
+    def __init__(self, lower, upper, first=0, leaf_size=LEAF_SIZE):
+        lower = numpy.asarray(lower, 'f')
+        upper = numpy.asarray(upper, 'f')
+        self.leaf_size = leaf_size
+
+        codes = _morton_codes((lower[:, :2] + upper[:, :2]) / 2)
+        self.order = numpy.argsort(codes, kind='mergesort')
+        codes  = codes[self.order]
+        lower  = lower[self.order]
+        upper  = upper[self.order]
+
+        self._lower    = []
+        self._upper    = []
+        self.starts    = []
+        self.ends      = []
+        self.children  = []
+        if len(codes) > 0:
+            self._build(codes, lower, upper, 0, 0, 0, len(codes))
+
+        self.lower  = numpy.array(self._lower, 'f').reshape(-1, 3)
+        self.upper  = numpy.array(self._upper, 'f').reshape(-1, 3)
+        self.starts = numpy.array(self.starts, numpy.int64) + first
+        self.ends   = numpy.array(self.ends, numpy.int64) + first
+        del self._lower, self._upper
+
+    def _build(self, codes, lower, upper, depth, prefix, start, end):
+        node = len(self.starts)
+        self._lower.append(None)
+        self._upper.append(None)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.children.append([])
+
+        if end - start <= self.leaf_size or depth == MAX_DEPTH:
+            self._lower[node] = lower[start:end].min(0)
+            self._upper[node] = upper[start:end].max(0)
+            return node
+
+        shift = 2 * (MAX_DEPTH - depth - 1)
+        bounds = numpy.searchsorted(codes[start:end],
+                                    [(prefix * 4 + q) << shift for q in range(5)]) + start
+        for q in range(4):
+            if bounds[q + 1] > bounds[q]:
+                child = self._build(codes, lower, upper, depth + 1, prefix * 4 + q,
+                                    bounds[q], bounds[q + 1])
+                self.children[node].append(child)
+
+        children = self.children[node]
+        self._lower[node] = numpy.min([self._lower[c] for c in children], 0)
+        self._upper[node] = numpy.max([self._upper[c] for c in children], 0)
+        return node
+
+    @property
+    def leaves(self):
+        return numpy.array([idx for idx, c in enumerate(self.children) if not c], numpy.int64)
+
+    def visible_ranges(self, frustum):
+        """
+        Return arrays of starts and ends of ranges of primitives within the
+        frustum.
+        """
+        if len(self.starts) == 0:
+            return self.starts, self.ends
+
+        visible, contained = frustum.test(self.lower, self.upper)
+        ranges = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if not visible[node]:
+                continue
+
+            if contained[node] or not self.children[node]:
+                start, end = self.starts[node], self.ends[node]
+                if ranges and ranges[-1][1] == start:
+                    ranges[-1] = (ranges[-1][0], end)
+                else:
+                    ranges.append((start, end))
+            else:
+                # visit children in order so that adjacent ranges can be joined
+                stack.extend(reversed(self.children[node]))
+
+        ranges = numpy.array(ranges, numpy.int64).reshape(-1, 2)
+        return ranges[:, 0], ranges[:, 1]
+
+
+class LayerChunks(object):
+    """
+    Quadtrees for every layer of a toolpath, plus the leaves of all of them
+    combined for culling many layers at once.
+    """
+    def __init__(self, trees):
+        self.trees = trees
+
+        leaves = [tree.leaves for tree in trees]
+        self.leaf_stops = numpy.zeros(len(trees) + 1, numpy.int64)
+        numpy.cumsum([len(l) for l in leaves], out=self.leaf_stops[1:])
+        self.leaf_layers = numpy.arange(len(trees)).repeat(numpy.diff(self.leaf_stops))
+
+        def gather(attr):
+            parts = [getattr(tree, attr)[l] for tree, l in zip(trees, leaves) if len(l)]
+            return numpy.concatenate(parts) if parts else numpy.zeros((0,))
+
+        self.lower  = gather('lower').reshape(-1, 3)
+        self.upper  = gather('upper').reshape(-1, 3)
+        self.starts = gather('starts').astype(numpy.int64)
+        self.ends   = gather('ends').astype(numpy.int64)
+
+    def visible_leaves(self, frustum):
+        """
+        Return a boolean array of leaves within the frustum.
+        """
+        return frustum.test(self.lower, self.upper)[0]
+
+    def layer_ranges(self, visible, first_layer, last_layer, reverse=False):
+        """
+        Return arrays of starts and ends of ranges of visible primitives of
+        layers in range [first_layer, last_layer), given the result of
+        visible_leaves(). With reverse set, layers go from top to bottom.
+        """
+        lo = self.leaf_stops[first_layer]
+        hi = self.leaf_stops[last_layer]
+        shown = numpy.flatnonzero(visible[lo:hi]) + lo
+
+        if reverse:
+            # layers from top to bottom, but chunks of a layer still in order
+            shown = shown[numpy.lexsort((shown, -self.leaf_layers[shown]))]
+
+        return join_ranges(self.starts[shown], self.ends[shown])
+
+
+def join_ranges(starts, ends):
+    """
+    Join ranges that follow each other in a buffer into single ranges.
+    """
+    if len(starts) == 0:
+        return starts, ends
+
+    breaks = numpy.flatnonzero(starts[1:] != ends[:-1]) + 1
+    return starts[numpy.r_[0, breaks]], ends[numpy.r_[breaks - 1, len(ends) - 1]]
+
+
+def build_layer_chunks(vertices, layer_stops, leaf_size=LEAF_SIZE):
+    """
+    Build chunks for a toolpath stored as vertex pairs with layer stops given
+    as vertex indices. Return the order of segments that makes every chunk
+    contiguous and the chunks themselves; layers keep their place.
+    """
+    starts = vertices[0::2]
+    ends   = vertices[1::2]
+    lower  = numpy.minimum(starts, ends)
+    upper  = numpy.maximum(starts, ends)
+
+    order = numpy.arange(len(starts))
+    trees = []
+    for idx in range(len(layer_stops) - 1):
+        lo = layer_stops[idx] // 2
+        hi = layer_stops[idx + 1] // 2
+        tree = ChunkTree(lower[lo:hi], upper[lo:hi], lo, leaf_size)
+        order[lo:hi] = tree.order + lo
+        trees.append(tree)
+    return order, LayerChunks(trees)
+
+
+def _morton_codes(points):
+    """
+    Return Z-order curve codes of points on a grid of 2**MAX_DEPTH cells
+    across their bounding square.
+    """
+    if len(points) == 0:
+        return numpy.zeros(0, numpy.int64)
+
+    lower = points.min(0)
+    size = max((points.max(0) - lower).max(), 1e-6)
+    cells = 2 ** MAX_DEPTH
+    scaled = numpy.clip(((points - lower) / size * cells).astype(numpy.int64), 0, cells - 1)
+
+    codes = numpy.zeros(len(points), numpy.int64)
+    for bit in range(MAX_DEPTH):
+        codes |= ((scaled[:, 0] >> bit) & 1) << (2 * bit)
+        codes |= ((scaled[:, 1] >> bit) & 1) << (2 * bit + 1)
+    return codes
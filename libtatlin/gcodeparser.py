@@ -50,6 +50,7 @@ class GcodeLexer(object):
         self.line_no = None
         self.current_line = None
         self.line_count = 0
+        self.line_offsets = None
 
     def load(self, gcode):
         if isinstance(gcode, str):
@@ -62,7 +63,13 @@ class GcodeLexer(object):
 
             self.getlines = _getlines
         else:
+            # remember where each line starts so that individual lines can be
+            # read back later without keeping the whole file in memory
+            self.line_offsets = array.array('l')
+            offset = 0
             for line in gcode:
+                self.line_offsets.append(offset)
+                offset += len(line)
                 self.line_count += 1
 
             gcode.seek(0)
@@ -140,6 +147,32 @@ class GcodeLexer(object):
         return tokens == ('', ArgsDict(), '')
 
 
+class LineIndex(object):
+    """
+    Index of byte offsets of lines in a Gcode file.
+
+    Lines are read from the file on request, which is a lot cheaper than
+    holding on to the text of every line of a large file.
+    """
+    def __init__(self, path, offsets):
+        self.path = path
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def line(self, line_no):
+        """
+        Return the text of a line, numbered starting with 1.
+        """
+        if not 0 < line_no <= len(self.offsets):
+            return None
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.offsets[line_no - 1])
+            return f.readline().rstrip('\r\n')
+
+
 class Movement(object):
     """
     Movement represents travel between two points and machine state during
@@ -153,15 +186,16 @@ class Movement(object):
     FLAG_INCHES          = 32
 
     # tell the python interpreter to only allocate memory for the following attributes
-    __slots__ = ['v', 'delta_e', 'feedrate', 'flags', 'spindle_speed']
+    __slots__ = ['v', 'delta_e', 'feedrate', 'flags', 'spindle_speed', 'line_no']
 
-    def __init__(self, v, delta_e, feedrate, flags=0, spindle_speed=0):
+    def __init__(self, v, delta_e, feedrate, flags=0, spindle_speed=0, line_no=0):
         self.v = v
 
         self.delta_e  = delta_e
         self.feedrate = feedrate
         self.flags    = flags
         self.spindle_speed = spindle_speed
+        self.line_no  = line_no
 
     def angle(self, start, precision=0):
         x = self.v[0] - start[0]
@@ -188,6 +222,13 @@ class GcodeParser(object):
     marker_surrounding_loop_start = '<surroundingLoop>'
     marker_surrounding_loop_end   = '</surroundingLoop>'
 
+    # number of movements handed to the preview callback
+    PREVIEW_MOVEMENTS = 50000
+
+    # most lines parsed between two progress callbacks, so that a load that
+    # is cancelled through the callback stops promptly
+    CALLBACK_LINES = 10000
+
     def __init__(self):
         self.lexer = GcodeLexer()
 
@@ -201,14 +242,21 @@ class GcodeParser(object):
     def load(self, src):
         self.lexer.load(src)
 
-    def parse(self, callback=None):
+    def parse(self, callback=None, preview=None):
+        """
+        Return a list of layers, each a list of movements. If given, preview
+        is called once with a copy of the layers parsed so far as soon as
+        PREVIEW_MOVEMENTS movements are parsed, so that they can be shown
+        before the whole file is.
+        """
         t_start = time.time()
 
         layers = []
         movements = []
+        movement_count = 0
         line_count = self.lexer.line_count
         command_idx = None
-        callback_every = max(1, int(math.floor(line_count / 100)))
+        callback_every = max(1, min(int(math.floor(line_count / 100)), self.CALLBACK_LINES))
         mm_in_inch = 25.4
         new_layer = False
         current_layer_z = 0
@@ -244,10 +292,15 @@ class GcodeParser(object):
                 if self.flags & Movement.FLAG_INCHES:
                     dst = (dst[0] * mm_in_inch, dst[1] * mm_in_inch, dst[2] * mm_in_inch)
 
-                move = Movement(array.array('f', dst), delta_e, args['F'], self.flags, int(spindle_speed))
+                move = Movement(array.array('f', dst), delta_e, args['F'], self.flags,
+                                int(spindle_speed), self.lexer.line_no)
                 #print "BLAH" + str(args)
                 movements.append(move)
 
+                movement_count += 1
+                if preview and movement_count == self.PREVIEW_MOVEMENTS:
+                    preview([list(layer) for layer in layers + [movements]])
+
             # if gcode contains a valid coordinate, update the previous point
             # with the new coordinate
             if dst is not None:
@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 Denis Kobozev
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Loading and analyzing models in a background thread or process.
+"""
+
+from __future__ import division
+
+import time
+import Queue
+import logging
+import threading
+import subprocess
+import multiprocessing
+
+from .actors import Model, GcodeModel, StlModel
+from .storage import ModelFile
+from . import sharedarrays
+
+
+class LoadCancelled(Exception):
+    pass
+
+
+class LoaderProcessError(Exception):
+    pass
+
+
+def _load_in_process(path, ftype, stl_options, model_path, preview_path, queue):
+    """
+    Read and load a model in a worker process, passing it back through
+    shared memory and messages about progress through a queue.
+    """
+    def progress(text):
+        def callback(count, limit):
+            queue.put(('progress', text, count, limit))
+        return callback
+
+    def preview(model_data):
+        model = GcodeModel()
+        model.load_data(model_data)
+        sharedarrays.dump(model, preview_path)
+        queue.put(('preview',))
+
+    try:
+        model_file = ModelFile(path, ftype, *stl_options)
+        model, model_data = model_file.read(progress('Reading file...'), preview)
+        model.load_data(model_data, progress('Loading model...'))
+        sharedarrays.dump(model, model_path)
+        queue.put(('done',))
+    except Exception, e:
+        queue.put(('error', e))
+        return
+
+    if isinstance(model, StlModel):
+        queue.put(('analyzed', _analyze(model)))
+
+
+def _analyze(model):
+    """
+    Return the metrics of a loaded STL model, or None if it could not be
+    analyzed, which is no reason to fail a load that is already done.
+    """
+    try:
+        return model.analyze()
+    except Exception:
+        logging.warning('Failed to analyze the model', exc_info=True)
+        return None
+
+
+class ModelLoader(object):
+    """
+    Reads a model file and loads the model in a worker thread, optionally
+    running a command that generates the file first.
+
+    With use_process, reading and loading are done in a separate process,
+    so that the UI does not have to share the interpreter with the parser.
+    The model's arrays are then handed back in shared memory, which is
+    freed when the model is deleted.
+
+    Results are passed to methods of a listener on the UI thread through the
+    post function, e.g. wx.CallAfter:
+
+        on_load_progress(text, count, limit) - limit is None if unknown
+        on_load_preview(model)               - first part of a Gcode model
+        on_load_done(model)
+        on_load_analyzed(model)              - STL model metrics found, after done
+        on_load_failed(error)
+
+    Nothing is passed on once the load is cancelled.
+    """
+    # seconds between checks whether the generating command has finished
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, model_file, listener, post, command=None, cwd=None, use_process=False):
+        self.model_file  = model_file
+        self.listener    = listener
+        self.post        = post
+        self.command     = command
+        self.cwd         = cwd
+        self.use_process = use_process
+
+        self._cancelled = threading.Event()
+        self._thread    = threading.Thread(target=self._run, name='ModelLoader')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def cancel(self):
+        """
+        Stop loading at the next progress step. Call from the UI thread.
+        """
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def wait(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _run(self):
+        try:
+            if self.command:
+                self._generate()
+
+            if self.use_process:
+                self._load_in_process()
+            else:
+                model, model_data = self.model_file.read(self._progress('Reading file...'),
+                                                         self._preview)
+                model.load_data(model_data, self._progress('Loading model...'))
+                self._notify('on_load_done', model)
+                if isinstance(model, StlModel) and _analyze(model) is not None:
+                    self._notify('on_load_analyzed', model)
+        except LoadCancelled:
+            logging.info('Loading %s cancelled' % self.model_file.basename)
+        except Exception, e:
+            logging.debug('Failed to load %s' % self.model_file.path, exc_info=True)
+            self._notify('on_load_failed', e)
+
+    def _generate(self):
+        process = subprocess.Popen(self.command, cwd=self.cwd)
+        while process.poll() is None:
+            if self.cancelled:
+                process.kill()
+                process.wait()
+                raise LoadCancelled()
+            self._notify('on_load_progress', 'Generating Gcode...', 0, None)
+            time.sleep(self.POLL_INTERVAL)
+
+        if process.returncode != 0:
+            logging.warning('%s exited with status %d' % (self.command[0], process.returncode))
+
+    def _load_in_process(self):
+        model_path   = sharedarrays.create_path()
+        preview_path = sharedarrays.create_path()
+        attached     = set()
+
+        def attach(path):
+            model, shared = sharedarrays.load(path)
+            model.shared_arrays = shared
+            attached.add(path)
+            return model
+
+        model = None
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_load_in_process, name='ModelLoader',
+                                          args=(self.model_file.path, self.model_file.filetype,
+                                                (self.model_file.weld_tolerance,
+                                                 self.model_file.smooth_normals),
+                                                model_path, preview_path, queue))
+        process.daemon = True
+        process.start()
+        try:
+            while True:
+                if self.cancelled:
+                    raise LoadCancelled()
+
+                try:
+                    message = queue.get(timeout=self.POLL_INTERVAL)
+                except Queue.Empty:
+                    if not process.is_alive() and queue.empty():
+                        if model is not None:
+                            # loaded, just not analyzed
+                            logging.warning('Loader process exited with status %s' %
+                                            process.exitcode)
+                            return
+                        raise LoaderProcessError('Loader process exited with status %s' %
+                                                 process.exitcode)
+                    continue
+
+                kind = message[0]
+                if kind == 'progress':
+                    self._notify('on_load_progress', *message[1:])
+                elif kind == 'preview':
+                    self._notify('on_load_preview', attach(preview_path))
+                elif kind == 'done':
+                    model = attach(model_path)
+                    self._notify('on_load_done', model)
+                    if not isinstance(model, StlModel):
+                        return
+                elif kind == 'analyzed':
+                    # metrics are found in the worker after the model is sent
+                    if message[1] is not None:
+                        model.local_metrics = message[1]
+                        self._notify('on_load_analyzed', model)
+                    return
+                elif kind == 'error':
+                    raise message[1]
+        finally:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+            for path in (model_path, preview_path):
+                if path not in attached:
+                    sharedarrays.remove(path)
+
+    def _progress(self, text):
+        def callback(count, limit):
+            if self.cancelled:
+                raise LoadCancelled()
+            self._notify('on_load_progress', text, count, limit)
+        return callback
+
+    def _preview(self, model_data):
+        if self.cancelled:
+            raise LoadCancelled()
+
+        model = GcodeModel()
+        model.load_data(model_data)
+        self._notify('on_load_preview', model)
+
+    def _notify(self, method, *args):
+        self.post(self._deliver, method, args)
+
+    def _deliver(self, method, args):
+        # runs on the UI thread, where the load may have been cancelled after
+        # this call was posted
+        if not self.cancelled:
+            getattr(self.listener, method)(*args)
+        else:
+            # models nobody is going to see may still hold shared memory
+            for arg in args:
+                if isinstance(arg, Model):
+                    arg.delete()
+
+
+class HotspotFinder(object):
+    """
+    Looks for overburnt areas of Gcode layers in a worker thread.
+
+    Only the latest request counts: one made while another is being worked
+    on replaces any that is still waiting, and the results of the others are
+    dropped. Results are passed to methods of a listener on the UI thread
+    through the post function, e.g. wx.CallAfter:
+
+        on_hotspots_found(model, layer_idx, hotspots)
+        on_hotspots_failed(error)
+    """
+    def __init__(self, listener, post):
+        self.listener = listener
+        self.post     = post
+
+        self._condition = threading.Condition()
+        self._request   = None
+        self._serial    = 0 # of the latest request
+        self._busy      = False
+        self._thread    = None
+
+    def find(self, model, layer_idx, watts, power_scale, threshold):
+        """
+        Look for the hotspots of a layer of model. Call from the UI thread.
+        """
+        with self._condition:
+            self._serial += 1
+            self._request = (self._serial, model, layer_idx, watts, power_scale, threshold)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='HotspotFinder')
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify_all()
+
+    def cancel(self):
+        """
+        Drop the latest request. Call from the UI thread.
+        """
+        with self._condition:
+            self._serial += 1
+            self._request = None
+
+    def wait(self, timeout=None):
+        """
+        Wait until the requests made so far are done.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._condition:
+            while self._request is not None or self._busy:
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._request is None:
+                    self._condition.wait()
+                serial, model, layer_idx, watts, power_scale, threshold = self._request
+                self._request = None
+                self._busy = True
+
+            try:
+                hotspots = model.layer_hotspots(layer_idx, watts, power_scale, threshold)
+            except Exception, e:
+                logging.warning('Failed to check layer %d for overburn' % layer_idx,
+                                exc_info=True)
+                self.post(self._deliver, serial, 'on_hotspots_failed', (e,))
+            else:
+                self.post(self._deliver, serial, 'on_hotspots_found',
+                          (model, layer_idx, hotspots))
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+    def _deliver(self, serial, method, args):
+        # runs on the UI thread, where another request may have been made
+        # after this call was posted
+        if serial == self._serial:
+            getattr(self.listener, method)(*args)
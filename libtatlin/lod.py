@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 Denis Kobozev
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Level-of-detail reduction for toolpaths.
+
+Toolpaths are stored the same way GcodeModel stores them: an array of vertex
+pairs (one pair per movement), an array of colors (one per movement) and a
+list of layer stops, i.e. vertex indices where each layer begins.
+"""
+
+from __future__ import division
+
+import numpy
+
+
+# screen-space tolerances in millimetres, from finest to coarsest
+DETAIL_TOLERANCES = (0.25, 1.0, 4.0, 16.0)
+
+# a level is only kept if it has at most this fraction of the vertices of the
+# previous level, otherwise it would cost memory without saving any time
+MIN_REDUCTION = 0.75
+
+# number of steps per color channel in simplified levels; rounding lets
+# neighbouring segments of nearly the same color merge together
+COLOR_STEPS = 32
+
+
+class DetailLevel(object):
+    """
+    A toolpath simplified so that no vertex moves more than `tolerance`
+    millimetres from the original path.
+    """
+    def __init__(self, tolerance, vertices, colors, layer_stops):
+        self.tolerance   = tolerance
+        self.vertices    = vertices
+        self.colors      = colors
+        self.layer_stops = layer_stops
+
+    @property
+    def vertex_count(self):
+        return len(self.vertices)
+
+
+def segment_layers(layer_stops):
+    """
+    Return an array with the index of the layer of every segment.
+    """
+    stops = numpy.asarray(layer_stops)
+    counts = numpy.diff(stops) // 2
+    return numpy.arange(len(counts)).repeat(counts)
+
+
+def simplify(vertices, colors, layer_stops, tolerance):
+    """
+    Simplify a toolpath to the given tolerance.
+
+    Connected segments are clustered by the tolerance-sized grid cell their
+    end points fall into: a run of segments that does not leave a cell is
+    replaced by a single segment with the length-weighted average color.
+    Afterwards, consecutive collinear segments of the same color are merged.
+    """
+    starts = vertices[0::2]
+    ends   = vertices[1::2]
+    layers = segment_layers(layer_stops)
+    num_layers = len(layer_stops) - 1
+
+    if len(starts) == 0:
+        return DetailLevel(tolerance, vertices, colors, list(layer_stops))
+
+    # a segment continues a polyline if it starts where the previous one
+    # ended, within the same layer
+    connected = numpy.zeros(len(starts), bool)
+    connected[1:] = ((starts[1:] == ends[:-1]).all(1) &
+                     (layers[1:] == layers[:-1]))
+    polyline_end = numpy.ones(len(starts), bool)
+    polyline_end[:-1] = ~connected[1:]
+
+    cells_start = numpy.floor(starts / tolerance).astype(numpy.int64)
+    cells_end   = numpy.floor(ends / tolerance).astype(numpy.int64)
+
+    # cell of the vertex each segment starts from
+    prev_cells = cells_start.copy()
+    prev_cells[1:][connected[1:]] = cells_end[:-1][connected[1:]]
+
+    # a cluster of segments is closed when the path leaves the cell of the
+    # previous vertex or when the polyline ends
+    closing = (cells_end != prev_cells).any(1) | polyline_end
+    last = numpy.flatnonzero(closing)
+    first = numpy.empty_like(last)
+    first[0] = 0
+    first[1:] = last[:-1] + 1
+
+    new_starts = starts[first]
+    new_ends   = ends[last]
+    new_layers = layers[first]
+
+    lengths = numpy.sqrt(((ends - starts) ** 2).sum(1)) + 1e-9
+    weighted = numpy.add.reduceat(colors * lengths[:, None], first)
+    new_colors = weighted / numpy.add.reduceat(lengths, first)[:, None]
+    new_colors = numpy.round(new_colors * COLOR_STEPS) / COLOR_STEPS
+
+    new_starts, new_ends, new_colors, new_layers = _merge_collinear(
+        new_starts, new_ends, new_colors, new_layers)
+
+    new_vertices = numpy.empty((len(new_starts) * 2, 3), 'f')
+    new_vertices[0::2] = new_starts
+    new_vertices[1::2] = new_ends
+
+    stops = numpy.searchsorted(new_layers, numpy.arange(num_layers + 1)) * 2
+    return DetailLevel(tolerance, new_vertices, new_colors.astype('f'),
+                       [int(stop) for stop in stops])
+
+
+def _merge_collinear(starts, ends, colors, layers):
+    """
+    Merge runs of connected segments that share color and direction.
+    """
+    directions = ends - starts
+    norms = numpy.sqrt((directions ** 2).sum(1))
+    directions = directions / numpy.maximum(norms, 1e-9)[:, None]
+
+    mergeable = numpy.zeros(len(starts), bool)
+    mergeable[1:] = ((starts[1:] == ends[:-1]).all(1) &
+                     (layers[1:] == layers[:-1]) &
+                     (colors[1:] == colors[:-1]).all(1) &
+                     ((directions[1:] * directions[:-1]).sum(1) > 1 - 1e-6))
+
+    first = numpy.flatnonzero(~mergeable)
+    last = numpy.empty_like(first)
+    last[:-1] = first[1:] - 1
+    last[-1] = len(starts) - 1
+
+    return starts[first], ends[last], colors[first], layers[first]
+
+
+def build_detail_levels(vertices, colors, layer_stops,
+                        tolerances=DETAIL_TOLERANCES):
+    """
+    Return a list of progressively simplified detail levels, not including
+    the full-detail toolpath itself.
+    """
+    levels = []
+    prev_count = len(vertices)
+    prev_vertices, prev_colors, prev_stops = vertices, colors, layer_stops
+
+    for tolerance in tolerances:
+        level = simplify(prev_vertices, prev_colors, prev_stops, tolerance)
+        if level.vertex_count > prev_count * MIN_REDUCTION:
+            continue
+
+        levels.append(level)
+        prev_count = level.vertex_count
+        prev_vertices, prev_colors, prev_stops = (level.vertices, level.colors,
+                                                  level.layer_stops)
+    return levels
+
+
+def choose_level(levels, pixel_size):
+    """
+    Return the index of the coarsest level whose tolerance fits within one
+    pixel, or -1 when only the full-detail toolpath will do.
+    """
+    chosen = -1
+    for idx, level in enumerate(levels):
+        if level.tolerance <= pixel_size:
+            chosen = idx
+    return chosen
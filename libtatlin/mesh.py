@@ -0,0 +1,492 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 Denis Kobozev
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Indexed triangle meshes built from the triangle soup of STL files.
+
+STL stores every facet with its own three vertices, so a vertex shared by
+six facets is stored six times. Welding finds the copies and replaces them
+with indices into a single array of distinct vertices.
+"""
+
+from __future__ import division
+
+import numpy
+
+
+# normals are told apart at about this precision when welding flat-shaded
+# vertices
+NORMAL_TOLERANCE = 1e-4
+
+# odd 64-bit constants for mixing key columns into a hash
+HASH_MULTIPLIERS = [numpy.uint64(m) for m in (
+    0x9e3779b97f4a7c15, 0xbf58476d1ce4e5b9, 0x94d049bb133111eb,
+    0xd6e8feb86659fd93, 0xa0761d6478bd642f, 0xe7037ed1a0b428db,
+)]
+
+
+def weld(vertices, tolerance, normals=None):
+    """
+    Merge vertices that round to the same point on a grid with tolerance
+    spacing. With normals given, vertices are only merged if their normals
+    match too, which keeps flat shading intact.
+
+    Returns the indices of the kept vertices, in the order they first appear,
+    and for each input vertex the index of its kept vertex among them.
+    """
+    keys = numpy.floor(numpy.asarray(vertices, 'd') / tolerance + 0.5).astype(numpy.int64)
+    if normals is not None:
+        normal_keys = numpy.floor(numpy.asarray(normals, 'd') / NORMAL_TOLERANCE + 0.5)
+        keys = numpy.column_stack([keys, normal_keys.astype(numpy.int64)])
+
+    # sort by a hash of the keys, so that equal keys end up next to each
+    # other, then start a new vertex wherever the keys change; a collision
+    # can at worst leave two copies of a vertex unmerged
+    order = numpy.argsort(hash_rows(keys))
+    sorted_keys = keys[order]
+
+    starts = numpy.ones(len(keys), bool)
+    starts[1:] = (sorted_keys[1:] != sorted_keys[:-1]).any(1)
+    inverse = numpy.empty(len(keys), numpy.int64)
+    inverse[order] = numpy.cumsum(starts) - 1
+    if len(keys) > 0:
+        first = numpy.minimum.reduceat(order, numpy.flatnonzero(starts))
+    else:
+        first = numpy.zeros(0, numpy.int64)
+
+    # number kept vertices in order of appearance rather than of their keys,
+    # so that facets next to each other in the file use nearby vertices
+    is_first = numpy.zeros(len(keys), bool)
+    is_first[first] = True
+    renumber = (numpy.cumsum(is_first) - 1)[first]
+    return numpy.flatnonzero(is_first), renumber[inverse].astype(numpy.uint32)
+
+
+def hash_rows(keys):
+    """
+    Return a 64-bit hash of each row of an integer array of up to six
+    columns.
+    """
+    hashes = numpy.zeros(len(keys), numpy.uint64)
+    for column, multiplier in zip(keys.T, HASH_MULTIPLIERS):
+        hashes ^= column.astype(numpy.int64).view(numpy.uint64)
+        hashes *= multiplier
+        # fold the high bits back in, which multiplying never moves down
+        hashes ^= hashes >> numpy.uint64(32)
+    return hashes.view(numpy.int64)
+
+def facet_normals(facets):
+    """
+    Return unit normals of facets given as an array of shape (n, 3, 3).
+    Degenerate facets get zero normals.
+    """
+    cross = numpy.cross(facets[:, 1] - facets[:, 0], facets[:, 2] - facets[:, 0])
+    lengths = numpy.sqrt((cross * cross).sum(1))[:, None]
+    return numpy.where(lengths > 0, cross / numpy.maximum(lengths, 1e-30), 0).astype('f')
+
+
+def pack_normals(normals):
+    """
+    Pack unit normals into four signed bytes each, the last one unused, to
+    be drawn as normalized GL_BYTE attributes: a third of the size of float
+    normals.
+    """
+    packed = numpy.zeros((len(normals), 4), numpy.int8)
+    packed[:, :3] = numpy.round(numpy.clip(normals, -1.0, 1.0) * 127)
+    return packed
+
+def vertex_normals(vertices, indices):
+    """
+    Return smooth normals of indexed vertices: the average of the normals
+    of the facets around each vertex, weighted by facet area.
+    """
+    facets = vertices[indices.reshape(-1, 3)].astype('d')
+    # the cross product is twice the facet area long
+    cross = numpy.cross(facets[:, 1] - facets[:, 0], facets[:, 2] - facets[:, 0])
+
+    sums = numpy.empty((len(vertices), 3))
+    corners = indices.reshape(-1, 3)
+    for axis in range(3):
+        weights = numpy.repeat(cross[:, axis], 3)
+        sums[:, axis] = numpy.bincount(corners.ravel(), weights, len(vertices))
+
+    lengths = numpy.sqrt((sums * sums).sum(1))[:, None]
+    return numpy.where(lengths > 0, sums / numpy.maximum(lengths, 1e-30), 0).astype('f')
+
+
+# points transformed at a time when only a summary of them is needed
+TRANSFORM_CHUNK = 1 << 20
+
+def transform_points(points, matrix):
+    """
+    Apply a 4x4 matrix, meant for column vectors, to an array of points.
+    """
+    return (numpy.dot(points, matrix[:3, :3].T) + matrix[:3, 3]).astype('f')
+
+def transform_normals(normals, matrix):
+    """
+    Apply the rotation and scaling of a 4x4 matrix to an array of unit
+    normals, keeping them perpendicular to the surface and of unit length.
+    """
+    transformed = numpy.dot(normals, numpy.linalg.inv(matrix[:3, :3]))
+    lengths = numpy.sqrt((transformed * transformed).sum(-1))[..., None]
+    return numpy.where(lengths > 0, transformed / numpy.maximum(lengths, 1e-30), 0).astype('f')
+
+def transformed_bounds(points, matrix):
+    """
+    Return the lower and upper corners of the box around points after
+    applying matrix to them, without transforming them all at once.
+    """
+    lower, upper = [], []
+    for start in xrange(0, len(points), TRANSFORM_CHUNK):
+        chunk = transform_points(points[start:start + TRANSFORM_CHUNK], matrix)
+        lower.append(chunk.min(0))
+        upper.append(chunk.max(0))
+    return numpy.min(lower, 0), numpy.max(upper, 0)
+
+def box_corners(lower, upper):
+    """
+    Return the eight corners of an axis-aligned box.
+    """
+    return numpy.array([(x, y, z) for x in (lower[0], upper[0])
+                                  for y in (lower[1], upper[1])
+                                  for z in (lower[2], upper[2])])
+
+
+# points closer than this to a face of a convex hull, relative to the size
+# of the point set, count as lying on it
+HULL_TOLERANCE = 1e-7
+
+# directions in which extreme points are looked for before computing a hull:
+# the axes, face diagonals and space diagonals of a cube
+FILTER_DIRECTIONS = numpy.array([(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1)
+                                 for z in (-1, 0, 1) if (x, y, z) != (0, 0, 0)], 'd')
+
+# hulls are not computed for more candidate points than this, as every hull
+# vertex costs a step in Python; a few hundred take a fraction of a second
+MAX_HULL_POINTS = 500
+
+def _spiral_directions(count):
+    # points spread evenly over the unit sphere along a golden-angle spiral
+    z = (numpy.arange(count) + 0.5) / count * 2 - 1
+    radius = numpy.sqrt(1 - z * z)
+    angle = numpy.arange(count) * numpy.pi * (3 - numpy.sqrt(5))
+    return numpy.column_stack([radius * numpy.cos(angle), radius * numpy.sin(angle), z])
+
+# directions in which points are bounded when there are too many of them to
+# compute their hull: boxes around the polytope bounded in these directions
+# are exact along the axes and at most a few percent too large otherwise
+ENCLOSING_DIRECTIONS = numpy.concatenate([
+    FILTER_DIRECTIONS / numpy.sqrt((FILTER_DIRECTIONS ** 2).sum(1))[:, None],
+    _spiral_directions(100)])
+
+# hulls that only need to be about right, e.g. for finding the faces a body
+# can rest on, are computed from a sample of this many points
+HULL_SAMPLE_SIZE = 1000
+
+
+def convex_hull(points):
+    """
+    Return the convex hull of points as the array of its vertices and an
+    array of shape (n, 3) of indices into it, three per face, ordered
+    counter-clockwise seen from outside.
+
+    Raises ValueError if the points do not span a volume.
+    """
+    points = numpy.asarray(points, 'd')
+    if len(points) < 4:
+        raise ValueError('A hull needs at least four points')
+    eps = (points.max(0) - points.min(0)).max() * HULL_TOLERANCE
+
+    faces   = [] # corner indices, normal and offset of each face
+    alive   = []
+    outside = [] # indices of the points above each face
+    edge_faces = {} # directed edge -> face it belongs to
+
+    def add_face(a, b, c):
+        normal = numpy.cross(points[b] - points[a], points[c] - points[a])
+        length = numpy.sqrt(normal.dot(normal))
+        normal = normal / length if length > 0 else normal
+        faces.append(((a, b, c), normal, normal.dot(points[a])))
+        alive.append(True)
+        outside.append(None)
+        for edge in ((a, b), (b, c), (c, a)):
+            edge_faces[edge] = len(faces) - 1
+        return len(faces) - 1
+
+    def distribute(candidates, new_faces):
+        # give each point to the new face it is farthest above
+        if len(candidates) == 0:
+            return
+        normals = numpy.array([faces[f][1] for f in new_faces])
+        offsets = numpy.array([faces[f][2] for f in new_faces])
+        distances = numpy.dot(points[candidates], normals.T) - offsets
+        best = distances.argmax(1)
+        above = distances[numpy.arange(len(candidates)), best] > eps
+        for i, f in enumerate(new_faces):
+            mine = candidates[above & (best == i)]
+            if len(mine) > 0:
+                outside[f] = mine
+
+    # start from a tetrahedron of far apart points
+    simplex = _initial_simplex(points, eps)
+    center = points[simplex].mean(0)
+    initial = []
+    for a, b, c in ((0, 1, 2), (0, 3, 1), (1, 3, 2), (0, 2, 3)):
+        a, b, c = simplex[[a, b, c]]
+        if numpy.cross(points[b] - points[a], points[c] - points[a]).dot(points[a] - center) < 0:
+            b, c = c, b
+        initial.append(add_face(a, b, c))
+    distribute(numpy.arange(len(points)), initial)
+
+    stack = [f for f in initial if outside[f] is not None]
+    while stack:
+        f = stack.pop()
+        if not alive[f] or outside[f] is None:
+            continue
+        corners, normal, offset = faces[f]
+        candidates = outside[f]
+        eye = candidates[numpy.dot(points[candidates], normal).argmax()]
+        eye_point = points[eye]
+
+        # faces the eye point sees form a patch bounded by the horizon
+        visible, seen, horizon = [f], set([f]), []
+        hidden = set()
+        for g in visible:
+            a, b, c = faces[g][0]
+            for edge in ((a, b), (b, c), (c, a)):
+                h = edge_faces[edge[::-1]]
+                if h in seen:
+                    continue
+                if h not in hidden and faces[h][1].dot(eye_point) - faces[h][2] > eps:
+                    visible.append(h)
+                    seen.add(h)
+                else:
+                    hidden.add(h)
+                    horizon.append(edge)
+
+        candidates = []
+        for g in visible:
+            alive[g] = False
+            if outside[g] is not None:
+                candidates.append(outside[g])
+            a, b, c = faces[g][0]
+            for edge in ((a, b), (b, c), (c, a)):
+                if edge_faces.get(edge) == g:
+                    del edge_faces[edge]
+
+        new_faces = [add_face(a, b, eye) for a, b in horizon]
+        candidates = numpy.concatenate(candidates)
+        distribute(candidates[candidates != eye], new_faces)
+        stack.extend(g for g in new_faces if outside[g] is not None)
+
+    corners = numpy.array([faces[f][0] for f in xrange(len(faces)) if alive[f]])
+    used, corners = numpy.unique(corners, return_inverse=True)
+    return points[used], corners.reshape(-1, 3)
+
+def _initial_simplex(points, eps):
+    """
+    Return indices of four points spanning a tetrahedron.
+    """
+    extremes = numpy.concatenate([points.argmin(0), points.argmax(0)])
+    pairs = [(i, j) for i in extremes for j in extremes]
+    i, j = max(pairs, key=lambda pair: numpy.sum((points[pair[0]] - points[pair[1]]) ** 2))
+    direction = points[j] - points[i]
+    if direction.dot(direction) <= eps * eps:
+        raise ValueError('Points do not span a volume')
+
+    offsets = points - points[i]
+    across = numpy.cross(offsets, direction / numpy.sqrt(direction.dot(direction)))
+    k = (across * across).sum(1).argmax()
+    if across[k].dot(across[k]) <= eps * eps:
+        raise ValueError('Points do not span a volume')
+
+    normal = numpy.cross(direction, points[k] - points[i])
+    heights = numpy.abs(offsets.dot(normal / numpy.sqrt(normal.dot(normal))))
+    l = heights.argmax()
+    if heights[l] <= eps:
+        raise ValueError('Points do not span a volume')
+    return numpy.array([i, j, k, l])
+
+def extreme_points(points):
+    """
+    Return points whose convex hull contains all of points, so that the box
+    around them under any transformation contains the box around all of
+    them. These are the vertices of the hull of points, which give the exact
+    box, unless the hull is too large to compute quickly, in which case they
+    are the corners of a polytope around it, see enclosing_points().
+    """
+    points = numpy.asarray(points, 'f')
+
+    # points inside the hull of the points extreme in a few directions
+    # cannot be vertices of the hull of all of them
+    extremes = directional_extremes(points)
+    try:
+        inner_points, inner_faces = convex_hull(extremes)
+    except ValueError:
+        # flat, no interior to discard
+        if len(points) > MAX_HULL_POINTS:
+            return enclosing_points(points)
+        return points
+
+    inner_facets = inner_points[inner_faces]
+    normals = numpy.cross(inner_facets[:, 1] - inner_facets[:, 0],
+                          inner_facets[:, 2] - inner_facets[:, 0])
+    offsets = (normals * inner_facets[:, 0]).sum(1)[:, None].astype('f')
+    normals = normals.astype('f')
+
+    candidates = [extremes]
+    for start in xrange(0, len(points), TRANSFORM_CHUNK):
+        chunk = points[start:start + TRANSFORM_CHUNK]
+        candidates.append(chunk[(numpy.dot(normals, chunk.T) > offsets).any(0)])
+    candidates = numpy.concatenate(candidates)
+
+    # vertices of unwelded meshes are repeated by every facet around them,
+    # sorting out the copies is only worth it if a hull might follow
+    if len(candidates) > MAX_HULL_POINTS * 8:
+        return enclosing_points(candidates)
+    candidates = unique_rows(candidates)
+    if len(candidates) > MAX_HULL_POINTS:
+        return enclosing_points(candidates)
+    try:
+        return convex_hull(candidates)[0].astype('f')
+    except ValueError:
+        return candidates
+
+def enclosing_points(points, directions=ENCLOSING_DIRECTIONS):
+    """
+    Return the corners of the polytope that bounds points in each of
+    directions, given as unit vectors. Its hull contains all of points, but
+    has only a few hundred corners however many points there are.
+    """
+    points = numpy.asarray(points, 'f')
+    directions = numpy.asarray(directions, 'd')
+    single = directions.astype('f')
+    support = numpy.empty(len(directions))
+    support.fill(-numpy.inf)
+    for start in xrange(0, len(points), TRANSFORM_CHUNK):
+        chunk = points[start:start + TRANSFORM_CHUNK]
+        support = numpy.maximum(support, numpy.dot(single, chunk.T).max(1))
+
+    # the planes are moved out a little, so that flat points are bounded by
+    # a thin polytope and the center is inside all of them
+    center = (points.min(0) + points.max(0)) / 2.0
+    size = float((points.max(0) - points.min(0)).max())
+    distances = support - directions.dot(center) + max(size, 1.0) * 1e-4
+
+    # corners of the polytope are the faces of the hull of the planes in
+    # dual space, found in a few steps since there are few of them
+    dual_points, dual_faces = convex_hull(directions / distances[:, None])
+    dual_facets = dual_points[dual_faces]
+    normals = numpy.cross(dual_facets[:, 1] - dual_facets[:, 0],
+                          dual_facets[:, 2] - dual_facets[:, 0])
+    offsets = (normals * dual_facets[:, 0]).sum(1)
+    return (center + normals / offsets[:, None]).astype('f')
+
+def directional_extremes(points):
+    """
+    Return the points extreme in each of FILTER_DIRECTIONS.
+    """
+    directions = FILTER_DIRECTIONS.astype('f')
+    extremes = []
+    for start in xrange(0, len(points), TRANSFORM_CHUNK):
+        chunk = points[start:start + TRANSFORM_CHUNK]
+        extremes.append(chunk[numpy.dot(directions, chunk.T).argmax(1)])
+    extremes = numpy.concatenate(extremes)
+    return extremes[numpy.dot(directions, extremes.T).argmax(1)]
+
+def sample_points(points, count):
+    """
+    Return about count of points, picked evenly from them, and the ones
+    extreme in FILTER_DIRECTIONS, so that their hull spans about as far.
+    """
+    points = numpy.asarray(points, 'f')
+    if len(points) <= count:
+        return points
+    step = -(-len(points) // count)
+    return unique_rows(numpy.concatenate([directional_extremes(points), points[::step]]))
+
+def unique_rows(points):
+    """
+    Return the distinct rows of an array of points.
+    """
+    points = numpy.ascontiguousarray(points)
+    rows = points.view(numpy.dtype((numpy.void, points.dtype.itemsize * points.shape[1])))
+    _, first = numpy.unique(rows.ravel(), return_index=True)
+    return points[numpy.sort(first)]
+
+
+# faces of a convex hull whose normals and offsets differ by less than this,
+# relative to the size of the hull, lie in the same plane
+PLANE_TOLERANCE = 1e-4
+
+def hull_centroid(points, faces):
+    """
+    Return the center of the volume of a convex hull given as by
+    convex_hull().
+    """
+    points = numpy.asarray(points, 'd')
+    origin = points.mean(0)
+    a, b, c = [points[faces[:, i]] - origin for i in range(3)]
+    # tetrahedra between the faces and the origin
+    volumes = (numpy.cross(b - a, c - a) * a).sum(1)
+    return origin + numpy.dot(volumes, a + b + c) / (4 * volumes.sum())
+
+def resting_normal(points, faces, down=(0, 0, -1)):
+    """
+    Return the outward normal of the face of a convex hull, given as by
+    convex_hull(), that the body inside is best laid down on: the one with
+    the largest contact area that the body does not tip over from, because
+    its center lies above the contact. Of planes that are as good, the one
+    facing closest to down wins, so that a body already resting on one is
+    left alone.
+    """
+    points = numpy.asarray(points, 'd')
+    corners = [points[faces[:, i]] for i in range(3)]
+    cross = numpy.cross(corners[1] - corners[0], corners[2] - corners[0])
+    doubled_areas = numpy.sqrt((cross * cross).sum(1))
+    keep = doubled_areas > 0
+    corners = [corner[keep] for corner in corners]
+    normals = cross[keep] / doubled_areas[keep][:, None]
+    offsets = (normals * corners[0]).sum(1)
+
+    # coplanar faces, e.g. the two triangles of a square, form one contact
+    size = (points.max(0) - points.min(0)).max()
+    keys = numpy.round(numpy.column_stack([normals, offsets / size]) / PLANE_TOLERANCE)
+    keys = numpy.ascontiguousarray(keys.astype(numpy.int64))
+    rows = keys.view(numpy.dtype((numpy.void, keys.itemsize * keys.shape[1]))).ravel()
+    _, first, plane = numpy.unique(rows, return_index=True, return_inverse=True)
+    areas = numpy.bincount(plane, doubled_areas[keep] / 2)
+
+    # the body rests stably on a plane if its center, dropped onto the
+    # plane, lands inside one of the faces in it
+    center = hull_centroid(points, faces)
+    heights = (normals * center).sum(1) - offsets
+    dropped = center - heights[:, None] * normals
+    inside = numpy.ones(len(normals), bool)
+    for i in range(3):
+        start, end = corners[i], corners[(i + 1) % 3]
+        edge_cross = numpy.cross(end - start, dropped - start)
+        inside &= (edge_cross * normals).sum(1) >= -PLANE_TOLERANCE * size ** 2
+    stable = numpy.bincount(plane, inside) > 0
+
+    # largest stable area first, then lowest center, then closest to down
+    rank = lambda values: numpy.round(values / PLANE_TOLERANCE)
+    best = numpy.lexsort((numpy.dot(normals[first], down),
+                          rank(heights[first] / size),
+                          rank(areas / areas.max()),
+                          stable))[-1]
+    return normals[first[best]]
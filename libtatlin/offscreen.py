@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 Denis Kobozev
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Rendering scenes without a window, e.g. thumbnails on a server.
+
+PyOpenGL picks its platform when it is first imported, so the environment
+variable PYOPENGL_PLATFORM has to be set to 'egl' before importing this
+module. On Mesa without a display server, EGL_PLATFORM=surfaceless selects
+the software renderer.
+"""
+
+from __future__ import division
+
+import os
+import ctypes
+import logging
+import multiprocessing
+import numpy
+
+from OpenGL import EGL
+from OpenGL.GL import *
+
+from .scene import SceneRenderer
+from .actors import Platform
+from .storage import ModelFile
+from .config import Config
+
+
+class OffscreenError(Exception):
+    pass
+
+
+class OffscreenContext(object):
+    """
+    OpenGL context without a window, drawing into a framebuffer object.
+    """
+    def __init__(self, width, height, samples=4):
+        if os.environ.get('PYOPENGL_PLATFORM') != 'egl':
+            raise OffscreenError('Offscreen rendering requires PYOPENGL_PLATFORM=egl')
+
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        if not self.display or not EGL.eglInitialize(self.display, None, None):
+            raise OffscreenError('Could not initialize an EGL display')
+
+        attributes = (EGL.EGLint * 5)(EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+                                      EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+                                      EGL.EGL_NONE)
+        config = EGL.EGLConfig()
+        num_configs = EGL.EGLint()
+        EGL.eglChooseConfig(self.display, attributes, ctypes.pointer(config), 1,
+                            ctypes.pointer(num_configs))
+        if num_configs.value < 1:
+            raise OffscreenError('No EGL configuration supports desktop OpenGL')
+
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT, None)
+        if not self.context:
+            raise OffscreenError('Could not create an EGL context')
+        self.make_current()
+
+        # multisampled buffers are drawn into, then resolved into the plain
+        # ones for reading back
+        self.samples = min(samples, glGetIntegerv(GL_MAX_SAMPLES))
+        self.framebuffers = glGenFramebuffers(2)
+        self.renderbuffers = glGenRenderbuffers(3)
+        self.width, self.height = None, None
+        self.resize(width, height)
+
+    def make_current(self):
+        EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, self.context)
+
+    def resize(self, width, height):
+        if (width, height) == (self.width, self.height):
+            return
+        self.width, self.height = width, height
+
+        draw_fbo, read_fbo = self.framebuffers
+        color, depth, resolved = self.renderbuffers
+
+        glBindFramebuffer(GL_FRAMEBUFFER, draw_fbo)
+        for buf, fmt, attachment in [(color, GL_RGBA8, GL_COLOR_ATTACHMENT0),
+                                     (depth, GL_DEPTH_COMPONENT24, GL_DEPTH_ATTACHMENT)]:
+            glBindRenderbuffer(GL_RENDERBUFFER, buf)
+            glRenderbufferStorageMultisample(GL_RENDERBUFFER, self.samples, fmt, width, height)
+            glFramebufferRenderbuffer(GL_FRAMEBUFFER, attachment, GL_RENDERBUFFER, buf)
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise OffscreenError('Framebuffer of %dx%d is incomplete' % (width, height))
+
+        glBindFramebuffer(GL_FRAMEBUFFER, read_fbo)
+        glBindRenderbuffer(GL_RENDERBUFFER, resolved)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, width, height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, resolved)
+
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+        glBindFramebuffer(GL_FRAMEBUFFER, draw_fbo)
+
+    def read_pixels(self):
+        """
+        Return the rendered image as an array of RGBA rows from top to bottom.
+        """
+        draw_fbo, read_fbo = self.framebuffers
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, draw_fbo)
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, read_fbo)
+        glBlitFramebuffer(0, 0, self.width, self.height, 0, 0, self.width, self.height,
+                          GL_COLOR_BUFFER_BIT, GL_NEAREST)
+
+        glBindFramebuffer(GL_FRAMEBUFFER, read_fbo)
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        data = glReadPixels(0, 0, self.width, self.height, GL_RGBA, GL_UNSIGNED_BYTE)
+        glBindFramebuffer(GL_FRAMEBUFFER, draw_fbo)
+
+        pixels = numpy.frombuffer(data, numpy.uint8).reshape(self.height, self.width, 4)
+        # OpenGL rows go from bottom to top
+        return pixels[::-1]
+
+    def destroy(self):
+        glDeleteFramebuffers(2, self.framebuffers)
+        glDeleteRenderbuffers(3, self.renderbuffers)
+        EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE,
+                           EGL.EGL_NO_CONTEXT)
+        EGL.eglDestroyContext(self.display, self.context)
+
+
+class OffscreenScene(SceneRenderer):
+    """
+    Scene that is drawn on demand into an offscreen context.
+    """
+    # fraction of the image the model spans when zoomed to fit
+    FIT_MARGIN = 0.9
+
+    def __init__(self, context):
+        super(OffscreenScene, self).__init__()
+        self.context = context
+        self.show_axes = False
+        self.view_perspective.show_rotation_center = False
+
+    def invalidate(self):
+        pass # nothing is drawn until render() is called
+
+    @property
+    def fit_box(self):
+        """
+        Box the image is fitted to: what Gcode burns or extrudes, without the
+        travel moves, or the whole of other models.
+        """
+        return getattr(self.model, 'drawn_bounding_box', self.model.bounding_box)
+
+    def view_model_center(self):
+        """
+        Center the view on the fitted box without modifying the vertices.
+        """
+        lower_corner = self.fit_box.lower_corner
+        upper_corner = self.fit_box.upper_corner
+        self.model.offset_x = -(upper_corner[0] + lower_corner[0]) / 2
+        self.model.offset_y = -(upper_corner[1] + lower_corner[1]) / 2
+        self.model.offset_z = -lower_corner[2]
+
+    def zoom_to_fit(self):
+        """
+        Zoom the current view so that the model fills the image.
+        """
+        bounding_box = self.fit_box
+        w, h = self.context.width, self.context.height
+        if self.mode_2d:
+            size = max(bounding_box.width, bounding_box.depth)
+        else:
+            size = numpy.linalg.norm(numpy.subtract(bounding_box.upper_corner,
+                                                    bounding_box.lower_corner))
+            # look at the middle of the model rather than at its base
+            self.current_view.z = -bounding_box.height / 2
+        self.current_view.zoom_to_fit(max(size, 1e-3) / self.FIT_MARGIN, w, h)
+
+    def render(self):
+        """
+        Draw the scene and return the image as an array of RGBA rows.
+        """
+        self.context.make_current()
+        if not self.initialized:
+            self.init()
+        self.init_actors()
+        # an image is taken from a single frame, so it needs all the data
+        self.finish_uploads()
+
+        self.reshape(self.context.width, self.context.height)
+        self.display(self.context.width, self.context.height)
+        glFinish()
+        return self.context.read_pixels()
+
+
+def load_scene(path, context, config, mode_2d=None, platform=True):
+    """
+    Load a Gcode or STL file into a new offscreen scene, centered and zoomed
+    to fit. Without mode_2d given, Gcode is shown the way the viewer
+    shows it by default and STL in 3D.
+    """
+    model_file = ModelFile(path, weld_tolerance=config.read('stl.weld_tolerance', float),
+                           smooth_normals=bool(config.read('stl.smooth_normals', int)))
+    model, model_data = model_file.read()
+    model.load_data(model_data)
+
+    context.make_current()
+    scene = OffscreenScene(context)
+    scene.use_shaders = (config.read('ui.renderer') == 'shaders')
+    scene.add_model(model)
+
+    if model_file.filetype == 'gcode':
+        scene.view_model_center()
+        if mode_2d is None:
+            mode_2d = bool(config.read('ui.gcode_2d', int))
+        # the 2D view shows the top layer, which should have the part on it
+        model.num_layers_to_draw = model.drawn_layers
+    else:
+        scene.center_model()
+        mode_2d = bool(mode_2d)
+
+    if platform:
+        # platform needs to be added last to be translucent
+        scene.add_supporting_actor(Platform(config.read('machine.platform_w', float),
+                                            config.read('machine.platform_d', float)))
+
+    scene.reset_view(True)
+    scene.mode_2d = mode_2d
+    scene.zoom_to_fit()
+    return scene
+
+
+def save_image(pixels, path):
+    import PIL.Image
+
+    image = PIL.Image.fromarray(numpy.ascontiguousarray(pixels), 'RGBA')
+    image.convert('RGB').save(path)
+
+
+# ----------------------------------------------------------------------------
+# BATCH RENDERING
+# ----------------------------------------------------------------------------
+
+# context of a worker process, created once and reused for all of its jobs
+_worker_context = None
+
+def _init_worker(width, height, samples):
+    global _worker_context
+    _worker_context = OffscreenContext(width, height, samples)
+
+def _render_job(job):
+    path, out_path, config_path, options = job
+    try:
+        scene = load_scene(path, _worker_context, Config(config_path), **options)
+        try:
+            save_image(scene.render(), out_path)
+        finally:
+            scene.close()
+        return path, out_path, None
+    except Exception, e:
+        # one broken file should not stop the whole batch
+        logging.debug('Failed to render %s' % path, exc_info=True)
+        return path, out_path, str(e) or e.__class__.__name__
+
+
+def render_thumbnails(jobs, width, height, config_path, processes=None, samples=4,
+                      **options):
+    """
+    Render (model path, image path) pairs in a pool of worker processes, each
+    with its own offscreen context. Yield (model path, image path, error)
+    tuples as jobs finish, where error is None on success.
+    """
+    tasks = [(path, out_path, config_path, options) for path, out_path in jobs]
+    if processes == 1:
+        _init_worker(width, height, samples)
+        for task in tasks:
+            yield _render_job(task)
+        return
+
+    pool = multiprocessing.Pool(processes, _init_worker, (width, height, samples))
+    try:
+        for result in pool.imap_unordered(_render_job, tasks):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
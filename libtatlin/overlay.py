@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 Denis Kobozev
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Static decorations drawn over or around the model: axes, text and the
+rotation center bead.
+
+Their geometry is built once into buffers and textures when first drawn, so
+drawing them takes a few calls per frame.
+"""
+
+from __future__ import division
+
+import math
+import numpy
+
+from OpenGL.GL import *
+from OpenGL.GLU import *
+from OpenGL.arrays.vbo import VBO
+
+from .actors import upload_texture
+from .stats import count_draw
+
+
+class TextRenderer(object):
+    """
+    Draws text in window coordinates with glyphs of a bitmap font rendered
+    into a texture once.
+    """
+    FIRST_CHAR = 32
+    LAST_CHAR  = 126
+
+    def __init__(self):
+        import PIL.Image, PIL.ImageDraw, PIL.ImageFont
+
+        font = PIL.ImageFont.load_default()
+        chars = [chr(c) for c in range(self.FIRST_CHAR, self.LAST_CHAR + 1)]
+        sizes = [font.getsize(c) for c in chars]
+        self.char_w = max(w for w, h in sizes)
+        self.char_h = max(h for w, h in sizes)
+
+        image = PIL.Image.new('L', (self.char_w * len(chars), self.char_h), 0)
+        draw = PIL.ImageDraw.Draw(image)
+        for idx, char in enumerate(chars):
+            draw.text((idx * self.char_w, 0), char, fill=255, font=font)
+
+        # white glyphs tinted by vertex colors, coverage in the alpha channel
+        pixels = numpy.empty((self.char_h, image.size[0], 4), numpy.uint8)
+        pixels[..., :3] = 255
+        pixels[..., 3] = numpy.asarray(image)
+        self.texture = upload_texture(None, pixels)
+        self.num_chars = len(chars)
+
+    @property
+    def line_height(self):
+        return self.char_h + 2
+
+    def draw(self, strings):
+        """
+        Draw a list of (text, x, y, color) tuples with a single call, where
+        x, y are window coordinates of the bottom left corner of the text.
+        """
+        quads = []
+        for text, x, y, color in strings:
+            codes = numpy.array([ord(c) for c in text], int)
+            if len(codes) == 0:
+                continue
+            glyphs = numpy.clip(codes, self.FIRST_CHAR, self.LAST_CHAR) - self.FIRST_CHAR
+            left = x + numpy.arange(len(codes)) * self.char_w
+            quads.append((left, y, glyphs, color))
+        if not quads:
+            return
+
+        corners = numpy.array([[0, 0], [1, 0], [1, 1], [0, 1]], 'f')
+        vertices, tex_coords, colors = [], [], []
+        for left, y, glyphs, color in quads:
+            n = len(glyphs)
+            v = numpy.empty((n, 4, 2), 'f')
+            v[..., 0] = left[:, None] + corners[:, 0] * self.char_w
+            v[..., 1] = y + corners[:, 1] * self.char_h
+            vertices.append(v.reshape(-1, 2))
+
+            # image rows go from top to bottom, so the top of a glyph is at t=0
+            t = numpy.empty((n, 4, 2), 'f')
+            t[..., 0] = (glyphs[:, None] + corners[:, 0]) / self.num_chars
+            t[..., 1] = 1.0 - corners[:, 1]
+            tex_coords.append(t.reshape(-1, 2))
+
+            colors.append(numpy.tile(numpy.asarray(color, 'f'), (n * 4, 1)))
+
+        vertices   = numpy.concatenate(vertices)
+        tex_coords = numpy.concatenate(tex_coords)
+        colors     = numpy.concatenate(colors)
+
+        glEnable(GL_TEXTURE_2D)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glTexEnvi(GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_MODULATE)
+
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glVertexPointer(2, GL_FLOAT, 0, vertices)
+        glTexCoordPointer(2, GL_FLOAT, 0, tex_coords)
+        glColorPointer(colors.shape[1], GL_FLOAT, 0, colors)
+
+        glDrawArrays(GL_QUADS, 0, len(vertices))
+        count_draw(1, len(vertices))
+
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glDisable(GL_TEXTURE_2D)
+
+
+class Axes(object):
+    """
+    Lines along the X, Y and Z axes with labels at their ends.
+    """
+    def __init__(self, length, colors, labels=('x', 'y', 'z')):
+        self.length = length
+        self.ends   = numpy.array([
+            (-length, 0.0, 0.0),
+            (0.0, -length, 0.0),
+            (0.0, 0.0, length),
+        ], 'f')
+        self.colors = [tuple(color) for color in colors]
+        self.labels = labels
+
+        self.vertex_buffer = None
+        self.color_buffer  = None
+
+    def draw(self, text):
+        """
+        Draw the axes with the current transformation and their labels with
+        a text renderer. The projection has to map window coordinates, as
+        View2D.begin() sets it up.
+        """
+        if self.vertex_buffer is None:
+            vertices = numpy.zeros((6, 3), 'f')
+            vertices[1::2] = self.ends
+            colors = numpy.array(self.colors, 'f').repeat(2, 0)
+            self.vertex_buffer = VBO(vertices, 'GL_STATIC_DRAW')
+            self.color_buffer  = VBO(colors, 'GL_STATIC_DRAW')
+
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        self.vertex_buffer.bind()
+        glVertexPointer(3, GL_FLOAT, 0, None)
+        self.color_buffer.bind()
+        glColorPointer(len(self.colors[0]), GL_FLOAT, 0, None)
+        glDrawArrays(GL_LINES, 0, 6)
+        count_draw(1, 6)
+        self.color_buffer.unbind()
+        self.vertex_buffer.unbind()
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+
+        # labels are drawn upright in window coordinates, next to the ends
+        # of the axes padded a bit outwards
+        modelview = numpy.array(glGetDoublev(GL_MODELVIEW_MATRIX)).T
+        padded = numpy.column_stack([self.ends + 2.0, numpy.ones(3)])
+        positions = numpy.dot(padded, modelview.T)
+
+        glPushMatrix()
+        glLoadIdentity()
+        glDisable(GL_DEPTH_TEST)
+        text.draw([(label, position[0], position[1], color) for label, position, color
+                   in zip(self.labels, positions, self.colors)])
+        glEnable(GL_DEPTH_TEST)
+        glPopMatrix()
+
+
+def sphere_mesh(radius, slices, stacks):
+    """
+    Return vertices and normals of triangles approximating a sphere.
+    """
+    theta = numpy.linspace(0, math.pi, stacks + 1)       # from the north pole
+    phi   = numpy.linspace(0, 2 * math.pi, slices + 1)   # around the Z axis
+    t, p = numpy.meshgrid(theta, phi, indexing='ij')
+    points = numpy.dstack([numpy.sin(t) * numpy.cos(p),
+                           numpy.sin(t) * numpy.sin(p),
+                           numpy.cos(t)])
+
+    # two counter-clockwise triangles per grid cell, seen from outside
+    a = points[:-1, :-1]
+    b = points[1:, :-1]
+    c = points[1:, 1:]
+    d = points[:-1, 1:]
+    normals = numpy.stack([a, b, c, a, c, d], 2).reshape(-1, 3).astype('f')
+    return normals * radius, normals
+
+
+class RotationCenterBead(object):
+    """
+    A small lit sphere marking the point the 3D view rotates around.
+    """
+    def __init__(self, radius=0.8, slices=24, stacks=16):
+        self.radius = radius
+        self.slices = slices
+        self.stacks = stacks
+
+        self.vertex_buffer = None
+        self.normal_buffer = None
+        self.vertex_count  = 0
+        self.state_list    = None # display list setting up lights and material
+
+    def draw(self):
+        if self.vertex_buffer is None:
+            vertices, normals = sphere_mesh(self.radius, self.slices, self.stacks)
+            self.vertex_buffer = VBO(vertices, 'GL_STATIC_DRAW')
+            self.normal_buffer = VBO(normals, 'GL_STATIC_DRAW')
+            self.vertex_count = len(vertices)
+
+        if self.state_list is None:
+            self.state_list = glGenLists(1)
+            glNewList(self.state_list, GL_COMPILE)
+            self._set_up_lighting()
+            glEndList()
+        glCallList(self.state_list)
+
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        self.vertex_buffer.bind()
+        glVertexPointer(3, GL_FLOAT, 0, None)
+        self.normal_buffer.bind()
+        glNormalPointer(GL_FLOAT, 0, None)
+        glDrawArrays(GL_TRIANGLES, 0, self.vertex_count)
+        count_draw(1, self.vertex_count)
+        self.normal_buffer.unbind()
+        self.vertex_buffer.unbind()
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+
+        glDisable(GL_LIGHT1)
+        glDisable(GL_LIGHT0)
+        glDisable(GL_LIGHTING)
+
+    def _set_up_lighting(self):
+        glEnable(GL_LIGHTING)
+        glEnable(GL_LIGHT0)
+        glEnable(GL_LIGHT1)
+        glShadeModel(GL_SMOOTH)
+
+        # material properties (white plastic)
+        glMaterial(GL_FRONT, GL_AMBIENT, (0.0, 0.0, 0.0, 1.0))
+        glMaterial(GL_FRONT, GL_DIFFUSE, (0.55, 0.55, 0.55, 1.0))
+        glMaterial(GL_FRONT, GL_SPECULAR, (0.7, 0.7, 0.7, 1.0))
+        glMaterial(GL_FRONT, GL_SHININESS, 32.0)
+
+        # lights properties
+        glLight(GL_LIGHT0, GL_AMBIENT, (0.3, 0.3, 0.3, 1.0))
+        glLight(GL_LIGHT0, GL_DIFFUSE, (0.3, 0.3, 0.3, 1.0))
+        glLight(GL_LIGHT1, GL_DIFFUSE, (0.3, 0.3, 0.3, 1.0))
+
+        # lights position, transformed by the modelview matrix current when
+        # the list is called
+        glLightfv(GL_LIGHT0, GL_POSITION, (20.0, 20.0, 20.0))
+        glLightfv(GL_LIGHT1, GL_POSITION, (-20.0, -20.0, 20.0))
+
+        glColor(1.0, 0.0, 0.0)
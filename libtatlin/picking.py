@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 Denis Kobozev
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Finding toolpath segments under the mouse cursor.
+"""
+
+from __future__ import division
+
+import math
+import numpy
+
+
+def unproject(x, y, modelview, projection, viewport):
+    """
+    Return the points on the near and far clipping planes under window
+    coordinates x, y.
+
+    Matrices are expected in the column-major layout returned by
+    glGetDoublev.
+    """
+    matrix = numpy.dot(numpy.asarray(projection).T, numpy.asarray(modelview).T)
+    inverse = numpy.linalg.inv(matrix)
+
+    vx, vy, vw, vh = viewport
+    ndc_x = (x - vx) / vw * 2 - 1
+    ndc_y = (y - vy) / vh * 2 - 1
+
+    points = []
+    for ndc_z in (-1.0, 1.0):
+        point = numpy.dot(inverse, [ndc_x, ndc_y, ndc_z, 1.0])
+        points.append(point[:3] / point[3])
+    return points
+
+
+def intersect_plane(near, far, z):
+    """
+    Return the X, Y coordinates where the line through near and far crosses
+    the horizontal plane at height z, or None if the line is parallel to it.
+    """
+    dz = far[2] - near[2]
+    if abs(dz) < 1e-12:
+        return None
+
+    t = (z - near[2]) / dz
+    return near[:2] + (far[:2] - near[:2]) * t
+
+
+class SegmentGrid(object):
+    """
+    Uniform grids over segments in the XY plane.
+
+    Short segments are bucketed by their midpoints in a compressed sparse row
+    layout: segment indices sorted by cell plus the offset where each cell
+    begins. Segments that are long compared to the cell size (travel moves,
+    mostly) are added to every cell they cross of a grid of their own, with
+    cells large enough to keep the number of entries in proportion to the
+    number of segments.
+    """
+    SEGMENTS_PER_CELL = 4
+    LONG_SEGMENT_CELLS = 2
+    # entries of long segments per segment in the grid, at most
+    LONG_ENTRIES_PER_SEGMENT = 4
+
+    def __init__(self, starts, ends, cell_size=None):
+        self.starts = numpy.asarray(starts, 'f')[:, :2]
+        self.ends   = numpy.asarray(ends, 'f')[:, :2]
+        count = len(self.starts)
+
+        if count > 0:
+            lower = numpy.minimum(self.starts.min(0), self.ends.min(0))
+            upper = numpy.maximum(self.starts.max(0), self.ends.max(0))
+        else:
+            lower = upper = numpy.zeros(2, 'f')
+
+        if cell_size is None:
+            area = max((upper[0] - lower[0]) * (upper[1] - lower[1]), 1e-6)
+            cell_size = numpy.sqrt(area * self.SEGMENTS_PER_CELL / max(count, 1))
+        self.cell_size = max(float(cell_size), 1e-3)
+
+        lengths = numpy.hypot(*(self.ends - self.starts).T)
+        is_long = lengths > self.cell_size * self.LONG_SEGMENT_CELLS
+        short = numpy.flatnonzero(~is_long)
+        long_segments = numpy.flatnonzero(is_long)
+
+        short_grid = _CellIndex(self.cell_size, lower, upper)
+        midpoints = (self.starts[short] + self.ends[short]) / 2
+        short_grid.fill(short, short_grid.cells(midpoints))
+        # a short segment can reach this far out of the cell of its midpoint
+        short_grid.margin = lengths[short].max() / 2 if len(short) else 0.0
+
+        # a segment crosses about two cells per cell size of its length
+        long_cell_size = max(self.cell_size, 2 * lengths[long_segments].sum() /
+                             (self.LONG_ENTRIES_PER_SEGMENT * max(count, 1)))
+        long_grid = _CellIndex(long_cell_size, lower, upper)
+        segments, cells = long_grid.crossed_cells(long_segments, self.starts[long_segments],
+                                                  self.ends[long_segments])
+        long_grid.fill(segments, cells)
+
+        self.grids = [short_grid, long_grid]
+
+    def candidates(self, points, radius):
+        """
+        Return indices of segments that might lie within radius of any of
+        points, given as an array of shape (n, 2); there may be repeats.
+        """
+        points = numpy.asarray(points, 'd').reshape(-1, 2)
+        return numpy.concatenate([grid.candidates(points, radius) for grid in self.grids
+                                  if len(grid.segments) > 0] or [numpy.zeros(0, numpy.int32)])
+
+    def nearest(self, x, y, radius, lo=0, hi=None):
+        """
+        Return the index of the segment closest to a point within radius, or
+        None. Only segments with indices in range [lo, hi) are considered.
+        """
+        candidates = self.candidates((x, y), radius)
+        if hi is not None:
+            candidates = candidates[(candidates >= lo) & (candidates < hi)]
+        elif lo > 0:
+            candidates = candidates[candidates >= lo]
+
+        if len(candidates) == 0:
+            return None
+
+        distances = point_segment_distance((x, y), self.starts[candidates],
+                                           self.ends[candidates])
+        best = distances.argmin()
+        if distances[best] > radius:
+            return None
+        return int(candidates[best])
+
+    def nearest_per_range(self, points, radius, stops):
+        """
+        Look for segments within radius of a different point for each range
+        of indices: segments in [stops[i], stops[i + 1]) are measured
+        against points[i]. Return the index of the closest segment of the
+        last range with any, or None.
+        """
+        points = numpy.asarray(points, 'd').reshape(-1, 2)
+        stops = numpy.asarray(stops)
+        candidates = self.candidates(points, radius)
+        candidates = candidates[(candidates >= stops[0]) & (candidates < stops[-1])]
+        if len(candidates) == 0:
+            return None
+
+        ranges = numpy.searchsorted(stops, candidates, 'right') - 1
+        distances = point_segment_distance(points[ranges], self.starts[candidates],
+                                           self.ends[candidates])
+        within = distances <= radius
+        if not within.any():
+            return None
+
+        last = ranges[within].max()
+        distances[~within | (ranges != last)] = numpy.inf
+        return int(candidates[distances.argmin()])
+
+
+class _CellIndex(object):
+    """
+    Segment indices listed per cell of a uniform grid, see SegmentGrid.
+    """
+    def __init__(self, cell_size, lower, upper):
+        self.cell_size = cell_size
+        self.origin = lower
+        self.nx = int((upper[0] - lower[0]) / cell_size) + 1
+        self.ny = int((upper[1] - lower[1]) / cell_size) + 1
+        self.margin = 0.0
+        self.fill(numpy.zeros(0, numpy.int64), numpy.zeros(0, numpy.int64))
+
+    def cells(self, points):
+        ix = ((points[:, 0] - self.origin[0]) / self.cell_size).astype(numpy.int64)
+        iy = ((points[:, 1] - self.origin[1]) / self.cell_size).astype(numpy.int64)
+        ix = numpy.clip(ix, 0, self.nx - 1)
+        iy = numpy.clip(iy, 0, self.ny - 1)
+        return iy * self.nx + ix
+
+    def fill(self, segments, cells):
+        order = numpy.argsort(cells, kind='mergesort')
+        self.segments = segments[order].astype(numpy.int32)
+        self.cell_starts = numpy.zeros(self.nx * self.ny + 1, numpy.int64)
+        numpy.cumsum(numpy.bincount(cells, minlength=self.nx * self.ny),
+                     out=self.cell_starts[1:])
+
+    def crossed_cells(self, segments, starts, ends):
+        """
+        Return segment indices and the cells they cross, one pair per cell.
+        """
+        # in cell units, left to right
+        a = (numpy.asarray(starts, 'd') - self.origin) / self.cell_size
+        b = (numpy.asarray(ends, 'd') - self.origin) / self.cell_size
+        swap = a[:, 0] > b[:, 0]
+        a[swap], b[swap] = b[swap], a[swap].copy()
+
+        # every column crossed, with the rows the segment spans within it
+        first_column = numpy.floor(a[:, 0]).astype(numpy.int64)
+        columns = numpy.floor(b[:, 0]).astype(numpy.int64) - first_column + 1
+        owner = numpy.repeat(numpy.arange(len(a)), columns)
+        column = numpy.arange(len(owner)) - numpy.repeat(numpy.cumsum(columns) - columns, columns)
+        column += first_column[owner]
+
+        dx = b[:, 0] - a[:, 0]
+        slope = (b[:, 1] - a[:, 1]) / numpy.where(dx > 0, dx, 1.0)
+        x0 = numpy.maximum(a[owner, 0], column)
+        x1 = numpy.minimum(b[owner, 0], column + 1)
+        y0 = a[owner, 1] + (x0 - a[owner, 0]) * slope[owner]
+        y1 = a[owner, 1] + (x1 - a[owner, 0]) * slope[owner]
+        vertical = dx[owner] <= 0
+        y0[vertical] = a[owner[vertical], 1]
+        y1[vertical] = b[owner[vertical], 1]
+        first_row = numpy.floor(numpy.minimum(y0, y1)).astype(numpy.int64)
+        rows = numpy.floor(numpy.maximum(y0, y1)).astype(numpy.int64) - first_row + 1
+
+        entry = numpy.repeat(numpy.arange(len(owner)), rows)
+        row = numpy.arange(len(entry)) - numpy.repeat(numpy.cumsum(rows) - rows, rows)
+        row += first_row[entry]
+        column = numpy.clip(column[entry], 0, self.nx - 1)
+        row = numpy.clip(row, 0, self.ny - 1)
+        return numpy.asarray(segments)[owner[entry]], row * self.nx + column
+
+    def candidates(self, points, radius):
+        """
+        Return indices of segments listed in the cells around points that
+        segments within radius of them may be listed in; there may be
+        repeats.
+        """
+        reach = radius + self.margin
+        if len(points) == 1:
+            return self._point_candidates(points[0, 0], points[0, 1], reach)
+
+        lower = numpy.floor((points - reach - self.origin) / self.cell_size).astype(numpy.int64)
+        upper = numpy.floor((points + reach - self.origin) / self.cell_size).astype(numpy.int64)
+        offsets = numpy.arange((upper - lower).max() + 1)
+        ix = lower[:, 0, None] + offsets
+        iy = lower[:, 1, None] + offsets
+        inside = (((iy >= 0) & (iy < self.ny) & (iy <= upper[:, 1, None]))[:, :, None] &
+                  ((ix >= 0) & (ix < self.nx) & (ix <= upper[:, 0, None]))[:, None, :])
+        cells = (iy[:, :, None] * self.nx + ix[:, None, :])[inside]
+        if len(points) > 1:
+            cells = numpy.unique(cells)
+
+        # concatenate the runs of segments of all the cells
+        firsts = self.cell_starts[cells]
+        counts = self.cell_starts[cells + 1] - firsts
+        total = int(counts.sum())
+        if total == 0:
+            return numpy.zeros(0, numpy.int32)
+        shifts = numpy.repeat(firsts - (numpy.cumsum(counts) - counts), counts)
+        return self.segments[numpy.arange(total) + shifts]
+
+    def _point_candidates(self, x, y, reach):
+        # the same for a single point, with fewer and smaller steps
+        x0 = max(int(math.floor((x - reach - self.origin[0]) / self.cell_size)), 0)
+        x1 = min(int(math.floor((x + reach - self.origin[0]) / self.cell_size)), self.nx - 1)
+        y0 = max(int(math.floor((y - reach - self.origin[1]) / self.cell_size)), 0)
+        y1 = min(int(math.floor((y + reach - self.origin[1]) / self.cell_size)), self.ny - 1)
+        if x0 > x1 or y0 > y1:
+            return numpy.zeros(0, numpy.int32)
+
+        found = []
+        for iy in range(y0, y1 + 1):
+            # cells of a grid row are contiguous
+            first = self.cell_starts[iy * self.nx + x0]
+            last  = self.cell_starts[iy * self.nx + x1 + 1]
+            if last > first:
+                found.append(self.segments[first:last])
+        return numpy.concatenate(found) if found else numpy.zeros(0, numpy.int32)
+
+
+def point_segment_distance(point, starts, ends):
+    """
+    Return distances from a point to each of the segments.
+    """
+    point = numpy.asarray(point, 'd')
+    starts = numpy.asarray(starts, 'd')
+    d = numpy.asarray(ends, 'd') - starts
+    length_sq = (d ** 2).sum(1)
+    t = ((point - starts) * d).sum(1) / numpy.maximum(length_sq, 1e-12)
+    t = numpy.clip(t, 0.0, 1.0)
+    closest = starts + d * t[:, None]
+    return numpy.sqrt(((closest - point) ** 2).sum(1))
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 Denis Kobozev
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Rasterization of laser toolpaths into images.
+"""
+
+from __future__ import division
+
+import numpy
+
+
+# upper limit on the number of steps along segments processed at once to
+# bound memory use
+STEPS_PER_BATCH = 2 ** 20
+
+# images at full resolution are computed in tiles of at most this many
+# pixels along each axis, so that large jobs need not fit in memory at once
+TILE_SIZE = 2048
+
+
+class RasterImage(object):
+    """
+    A float image covering a rectangle of the platform.
+
+    Row 0 of the image data is the row with the lowest Y coordinate.
+    """
+    def __init__(self, data, origin, mm_per_pixel):
+        self.data         = data
+        self.origin       = origin
+        self.mm_per_pixel = mm_per_pixel
+
+    @property
+    def width(self):
+        return self.data.shape[1]
+
+    @property
+    def height(self):
+        return self.data.shape[0]
+
+    @property
+    def extent(self):
+        """
+        Return the (x0, y0, x1, y1) rectangle covered by the image in mm.
+        """
+        x0, y0 = self.origin
+        return (x0, y0,
+                x0 + self.width * self.mm_per_pixel,
+                y0 + self.height * self.mm_per_pixel)
+
+
+class Hotspots(object):
+    """
+    Cells of an energy density image that exceed a threshold.
+
+    The mask of overburnt cells may be coarser than the image, with a cell
+    set where any of the cells of the image it covers is overburnt, while
+    the count and the peak are those of the image itself.
+    """
+    def __init__(self, mask, count, peak, mm_per_pixel, threshold):
+        self.mask         = mask
+        self.count        = count
+        self.peak         = peak
+        self.mm_per_pixel = mm_per_pixel
+        self.threshold    = threshold
+
+    @property
+    def area(self):
+        """
+        Overburnt area in square millimetres.
+        """
+        return self.count * self.mm_per_pixel ** 2
+
+
+def segment_durations(starts, ends, feedrates):
+    """
+    Return time in seconds spent travelling each segment.
+
+    Feedrates are in mm/min. Segments without a feedrate are treated as
+    instantaneous.
+    """
+    lengths = numpy.hypot(ends[:, 0] - starts[:, 0], ends[:, 1] - starts[:, 1])
+    feedrates = numpy.asarray(feedrates, 'd')
+    durations = numpy.zeros(len(lengths))
+    moving = feedrates > 0
+    durations[moving] = lengths[moving] / (feedrates[moving] / 60)
+    return durations
+
+
+def bounds(starts, ends):
+    """
+    Return lower and upper X, Y corners of a rectangle enclosing segments.
+    """
+    lower = numpy.array([min(starts[:, axis].min(), ends[:, axis].min()) for axis in (0, 1)])
+    upper = numpy.array([max(starts[:, axis].max(), ends[:, axis].max()) for axis in (0, 1)])
+    return lower, upper
+
+
+def fit_resolution(starts, ends, mm_per_pixel, max_size):
+    """
+    Return a resolution no finer than mm_per_pixel such that the image of the
+    segments fits in max_size pixels along both axes.
+    """
+    if len(starts) == 0:
+        return mm_per_pixel
+
+    lower, upper = bounds(starts, ends)
+    span = (upper - lower).max()
+    return max(mm_per_pixel, span / (max_size - 1))
+
+
+def image_grid(starts, ends, mm_per_pixel):
+    """
+    Return the origin and the shape of an image of segments fitted to them.
+    """
+    if len(starts) > 0:
+        lower, upper = bounds(starts, ends)
+    else:
+        lower = upper = numpy.zeros(2)
+    # center pixels on the grid of the toolpath, which is usually spaced by
+    # the resolution it was generated at
+    origin = (lower[0] - mm_per_pixel / 2, lower[1] - mm_per_pixel / 2)
+    shape = (int(round((upper[1] - lower[1]) / mm_per_pixel)) + 1,
+             int(round((upper[0] - lower[0]) / mm_per_pixel)) + 1)
+    return origin, shape
+
+
+def accumulate(starts, ends, values, mm_per_pixel, origin=None, shape=None):
+    """
+    Spread per-segment values over a grid of mm_per_pixel sized cells.
+
+    Each segment is split at the cell boundaries it crosses, so that a cell
+    receives the share of a segment proportional to the length of the
+    segment inside the cell. Only X and Y coordinates are used.
+
+    When origin and shape are not given, the image is fitted to the segments.
+    """
+    starts = numpy.asarray(starts)[:, :2]
+    ends   = numpy.asarray(ends)[:, :2]
+    values = numpy.asarray(values, 'd')
+
+    if origin is None:
+        origin, shape = image_grid(starts, ends, mm_per_pixel)
+
+    h, w = shape
+    image = numpy.zeros(h * w)
+    if len(starts) == 0:
+        return RasterImage(image.reshape(h, w), origin, mm_per_pixel)
+
+    # work in pixel units, stepping along the axis with fewer cell boundaries
+    # crossed and spreading each step over cells along the other axis
+    start = (starts - origin) / mm_per_pixel
+    end   = (ends - origin) / mm_per_pixel
+    steep = numpy.abs(end[:, 1] - start[:, 1]) > numpy.abs(end[:, 0] - start[:, 0])
+    u0 = numpy.where(steep, start[:, 0], start[:, 1])
+    u1 = numpy.where(steep, end[:, 0], end[:, 1])
+    v0 = numpy.where(steep, start[:, 1], start[:, 0])
+    v1 = numpy.where(steep, end[:, 1], end[:, 0])
+    # steps go in the direction of increasing u
+    backwards = u1 < u0
+    u0, u1 = numpy.where(backwards, u1, u0), numpy.where(backwards, u0, u1)
+    v0, v1 = numpy.where(backwards, v1, v0), numpy.where(backwards, v0, v1)
+    k0, k1 = _cell_range(u0, u1, numpy.where(steep, w, h))
+    counts = numpy.maximum(k1 - k0 + 1, 0)
+
+    # the cells a step covers in full get equal shares, which are added to
+    # the first of them and taken away after the last, to be summed up along
+    # rows or columns, depending on the direction of the steps
+    runs = {}
+    largest = 0.0
+
+    # process segments in batches so that the step arrays stay small
+    cumulative = numpy.cumsum(counts)
+    batch_start = 0
+    while batch_start < len(counts):
+        offset = cumulative[batch_start - 1] if batch_start > 0 else 0
+        batch_end = numpy.searchsorted(cumulative, offset + STEPS_PER_BATCH, 'right')
+        batch_end = max(batch_end, batch_start + 1)
+
+        batch = slice(batch_start, batch_end)
+        largest = max(largest, _accumulate_batch(
+            image, runs, u0[batch], u1[batch], v0[batch], v1[batch], k0[batch], k1[batch],
+            values[batch], steep[batch], w, h))
+        batch_start = batch_end
+
+    for axis, run in runs.iteritems():
+        sums = run.reshape(h, w).cumsum(axis)
+        # where runs have ended, leave zero rather than rounding errors
+        sums[numpy.abs(sums) < largest * 1e-9] = 0.0
+        image += sums.ravel()
+
+    return RasterImage(image.reshape(h, w), origin, mm_per_pixel)
+
+
+def _cell_range(lower, upper, size):
+    """
+    Return the first and the last cell inside the image that an interval of
+    pixel coordinates covers, ignoring a cell it only touches at the end.
+    """
+    first = numpy.floor(lower).astype(numpy.int64)
+    last = numpy.maximum(numpy.ceil(upper).astype(numpy.int64) - 1, first)
+    return numpy.maximum(first, 0), numpy.minimum(last, size - 1)
+
+
+def _accumulate_batch(image, runs, u0, u1, v0, v1, k0, k1, values, steep, w, h):
+    """
+    Add the steps of segments to the image, and the runs of cells they cover
+    in full to the running sums along rows (axis 1) and columns (axis 0) of
+    runs. Return the largest share of a cell in a run.
+    """
+    # a step for every cell along u, with the span of the segment inside it
+    counts = numpy.maximum(k1 - k0 + 1, 0)
+    idx = numpy.arange(len(counts)).repeat(counts)
+    k = numpy.arange(int(counts.sum()), dtype=numpy.int64)
+    k -= (numpy.cumsum(counts) - counts - k0)[idx]
+
+    du = u1 - u0
+    flat = du <= 0
+    du[flat] = 1.0
+    slope = (v1 - v0) / du
+    # a segment with no extent in u is a single step along v
+    slope[flat] = 0.0
+    ua = numpy.maximum(u0[idx], k)
+    ub = numpy.minimum(u1[idx], k + 1)
+    share = numpy.where(flat[idx], 1.0, (ub - ua) / du[idx])
+    va = v0[idx] + (ua - u0[idx]) * slope[idx]
+    vb = numpy.where(flat[idx], v1[idx], v0[idx] + (ub - u0[idx]) * slope[idx])
+    lo, hi = numpy.minimum(va, vb), numpy.maximum(va, vb)
+
+    # cells along v of every step, with the share of the step inside each
+    steep = steep[idx]
+    j0, j1 = _cell_range(lo, hi, numpy.where(steep, h, w))
+    span = hi - lo
+    point = span <= 0
+    span[point] = 1.0
+    amount = values[idx] * share
+
+    def cell(j):
+        return numpy.where(steep, j * w + k, k * w + j)
+
+    def fraction(j):
+        return numpy.where(point, 1.0, (numpy.minimum(hi, j + 1) - numpy.maximum(lo, j)) / span)
+
+    inside = j1 >= j0
+    image += numpy.bincount(cell(j0)[inside], (amount * fraction(j0))[inside],
+                            minlength=len(image))
+    last = j1 > j0
+    image += numpy.bincount(cell(j1)[last], (amount * fraction(j1))[last],
+                            minlength=len(image))
+
+    # full cells in between, through running sums along v
+    middle = j1 > j0 + 1
+    largest = 0.0
+    for axis, along in ((1, ~steep), (0, steep)):
+        mine = middle & along
+        if not mine.any():
+            continue
+        if axis not in runs:
+            runs[axis] = numpy.zeros(len(image))
+        per_cell = amount[mine] / span[mine]
+        runs[axis] += numpy.bincount(cell(j0 + 1)[mine], per_cell, minlength=len(image))
+        runs[axis] -= numpy.bincount(cell(j1)[mine], per_cell, minlength=len(image))
+        largest = max(largest, float(numpy.abs(per_cell).max()))
+    return largest
+
+
+def burn_segments(vertices, powers, feedrates):
+    """
+    Return the start and end points of the burning segments of a toolpath
+    stored as vertex pairs, and power multiplied by dwell time for each.
+    """
+    powers = numpy.asarray(powers, 'd')
+    burning = powers > 0
+    starts = vertices[0::2, :2][burning]
+    ends   = vertices[1::2, :2][burning]
+    durations = segment_durations(starts, ends, numpy.asarray(feedrates)[burning])
+    return starts, ends, powers[burning] * durations
+
+
+def burn_image(vertices, powers, feedrates, mm_per_pixel, max_size=None):
+    """
+    Return an image of power multiplied by dwell time for the burning
+    segments of a toolpath stored as vertex pairs.
+    """
+    starts, ends, values = burn_segments(vertices, powers, feedrates)
+    if max_size is not None:
+        mm_per_pixel = fit_resolution(starts, ends, mm_per_pixel, max_size)
+    return accumulate(starts, ends, values, mm_per_pixel)
+
+
+def burn_tiles(vertices, powers, feedrates, mm_per_pixel, tile_size=TILE_SIZE):
+    """
+    Yield the image burn_image() returns without max_size in tiles of at
+    most tile_size pixels along each axis, together with the row and column
+    of the image where each tile starts.
+    """
+    starts, ends, values = burn_segments(vertices, powers, feedrates)
+    origin, (h, w) = image_grid(starts, ends, mm_per_pixel)
+    lower = numpy.minimum(starts, ends)
+    upper = numpy.maximum(starts, ends)
+
+    for row in xrange(0, h, tile_size):
+        for column in xrange(0, w, tile_size):
+            tile_origin = (origin[0] + column * mm_per_pixel, origin[1] + row * mm_per_pixel)
+            shape = (min(tile_size, h - row), min(tile_size, w - column))
+            # only segments reaching into the tile leave samples in it
+            near = ((upper[:, 0] >= tile_origin[0]) &
+                    (lower[:, 0] <= tile_origin[0] + shape[1] * mm_per_pixel) &
+                    (upper[:, 1] >= tile_origin[1]) &
+                    (lower[:, 1] <= tile_origin[1] + shape[0] * mm_per_pixel))
+            tile = accumulate(starts[near], ends[near], values[near], mm_per_pixel,
+                              tile_origin, shape)
+            yield row, column, tile
+
+
+def energy_density(raster, watts, power_scale):
+    """
+    Convert a burn image of spindle speed multiplied by seconds to energy
+    density in J/mm^2, where a spindle speed of power_scale stands for the
+    full laser power of watts.
+    """
+    scale = watts / power_scale / raster.mm_per_pixel ** 2
+    return RasterImage(raster.data * scale, raster.origin, raster.mm_per_pixel)
+
+
+def find_hotspots(vertices, powers, feedrates, mm_per_pixel, watts, power_scale,
+                  threshold, max_size):
+    """
+    Return the Hotspots of a toolpath stored as vertex pairs, with energy
+    density computed at mm_per_pixel however large the toolpath, and the
+    mask reduced to at most max_size pixels along each axis.
+    """
+    starts, ends, _ = burn_segments(vertices, powers, feedrates)
+    origin, (h, w) = image_grid(starts, ends, mm_per_pixel)
+
+    # tiles hold whole cells of the mask, so that each is reduced on its own
+    factor = -(-max(h, w) // max_size)
+    tile_size = factor * max(TILE_SIZE // factor, 1)
+    mask = numpy.zeros((-(-h // factor), -(-w // factor)), bool)
+    count = 0
+    peak = 0.0
+
+    for row, column, tile in burn_tiles(vertices, powers, feedrates, mm_per_pixel, tile_size):
+        density = energy_density(tile, watts, power_scale).data
+        if density.size == 0:
+            continue
+        peak = max(peak, float(density.max()))
+        over = density > threshold
+        count += int(over.sum())
+
+        th, tw = over.shape
+        padded = numpy.zeros((-(-th // factor) * factor, -(-tw // factor) * factor), bool)
+        padded[:th, :tw] = over
+        cells = padded.reshape(padded.shape[0] // factor, factor,
+                               padded.shape[1] // factor, factor).any(3).any(1)
+        top, left = row // factor, column // factor
+        mask[top:top + cells.shape[0], left:left + cells.shape[1]] = cells
+
+    return Hotspots(RasterImage(mask, origin, mm_per_pixel * factor),
+                    count, peak, mm_per_pixel, threshold)
+
+
+def to_intensity(data, percentile=99.5):
+    """
+    Scale image data to 0..255, saturating at the given percentile of the
+    non-zero values so that a few hot pixels don't wash out the image.
+    """
+    nonzero = data[data > 0]
+    if len(nonzero) == 0:
+        return numpy.zeros(data.shape, numpy.uint8)
+
+    ceiling = numpy.percentile(nonzero, percentile)
+    scaled = numpy.clip(data / ceiling, 0.0, 1.0) * 255
+    return scaled.astype(numpy.uint8)
+
+
+def save_png(raster, path):
+    """
+    Write a burn image to a PNG file as dark marks on a white background.
+    """
+    import PIL.Image
+
+    pixels = 255 - to_intensity(raster.data)
+    # PNG rows go from top to bottom, while our rows go from bottom to top
+    image = PIL.Image.fromarray(numpy.ascontiguousarray(pixels[::-1]), 'L')
+    image.save(path)
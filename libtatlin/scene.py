@@ -20,13 +20,20 @@ from __future__ import division
 
 from OpenGL.GL import *
 from OpenGL.GLU import *
-from OpenGL.GLUT import *
 
 import math
+import time
+import numpy
+import logging
 
-from .ui import BaseScene
 from .actors import Model
+from .picking import unproject
 from .views import View2D, View3D
+from .shaders import ShaderRenderer, ShaderError
+from .stats import FrameStats
+from .overlay import TextRenderer, Axes
+from .storage import atomic_write
+from .slicer import write_gcode
 
 
 def paginate(sequence, n):
@@ -43,25 +50,64 @@ def html_color(color):
     return parsed
 
 
-class Scene(BaseScene):
+class SceneRenderer(object):
     """
     A scene is responsible for displaying a model and accompanying objects (actors).
 
     In addition to calling display functions on its actors, the scene is also
     responsible for viewing transformations such as zooming, panning and
     rotation, as well as being the interface for the actors.
+
+    This class does not depend on a GUI toolkit; subclasses provide the
+    OpenGL context and the invalidate() method that requests a redraw.
     """
     PAN_SPEED    = 25
     ROTATE_SPEED = 25
 
-    def __init__(self, parent):
-        super(Scene, self).__init__(parent)
+    # distance in pixels within which a movement counts as being under the cursor
+    PICK_RADIUS  = 5
+
+    # most bytes of vertex data copied to the graphics card per frame
+    UPLOAD_BYTES = 8 * 2**20
+
+    def __init__(self):
+        self.initialized = False
 
         self.model    = None
         self.actors   = []
+        self._retired_actors = []
         self.cursor_x = 0
         self.cursor_y = 0
 
+        # draw the axes in the corner of the view
+        self.show_axes = True
+        self.axes = Axes(50.0, [(1.0, 0.0, 0.0), (0.0, 1.0, 0.0), html_color('008aff')])
+
+        # created once the OpenGL context exists
+        self.text = None
+
+        # set while the view is being dragged or zoomed, so that actors can
+        # trade detail for speed
+        self.interacting = False
+
+        # timings and counts of drawn frames; recorded when enabled or when
+        # shown in an overlay
+        self.frame_stats      = FrameStats()
+        self.show_frame_stats = False
+
+        # draw models with GLSL shaders instead of the fixed-function
+        # pipeline; falls back to the latter if shaders are unsupported
+        self.use_shaders = False
+        self.shading     = None
+        # with shaders, layers below the top one fade out over this many
+        # millimetres; no fading when zero
+        self.layer_fade  = 0.0
+
+        self._modelview  = None
+        self._projection = None
+        self._viewport   = None
+        self._pixel_size = 0
+
         self.view_ortho = View2D()
         self.view_perspective = View3D()
         self.current_view = self.view_perspective
@@ -76,25 +122,70 @@ class Scene(BaseScene):
             'rotation-x':     lambda: self.model.rotation_angle[self.model.AXIS_X],
             'rotation-y':     lambda: self.model.rotation_angle[self.model.AXIS_Y],
             'rotation-z':     lambda: self.model.rotation_angle[self.model.AXIS_Z],
+            'metrics':        lambda: self.model.metrics(),
+            'analyzed':       lambda: self.model.local_metrics is not None,
         }
 
     def add_model(self, model):
         self.model = model
         self.actors.append(self.model)
 
-    def export_to_file(self, model_file):
+    def export_to_file(self, model_file, binary=None):
         """
-        Write model to file.
+        Write model to file, see ModelFile.write_stl.
         """
-        model_file.write_stl(self.model)
+        model_file.write_stl(self.model, binary)
         self.model.modified = False
 
+    def export_contours(self, fpath, layer_height, platform_offset=(0, 0), **settings):
+        """
+        Slice the model into layers of layer_height and write the contours
+        of each to fpath as G-code, see slicer.write_gcode(). Machine
+        coordinates are those of the scene less platform_offset, by which
+        G-code is shifted when shown.
+        """
+        box = self.model.bounding_box
+        # cut through the middle of each layer
+        heights = numpy.arange(box.lower_corner[2] + layer_height / 2,
+                               box.upper_corner[2], layer_height)
+        offset = numpy.asarray(platform_offset, 'f')
+        layers = [[polyline - offset for polyline in polylines]
+                  for polylines in self.model.slice(heights)]
+        with atomic_write(fpath) as f:
+            write_gcode(f, heights, layers, **settings)
+
     def add_supporting_actor(self, actor):
         self.actors.append(actor)
 
+    def replace_model(self, model):
+        """
+        Show model in place of the current one, e.g. when a partially loaded
+        model has been loaded in full. The old model is freed on the next
+        redraw, when the OpenGL context is current.
+        """
+        self.actors[self.actors.index(self.model)] = model
+        self._retired_actors.append(self.model)
+        self.model = model
+
     def clear(self):
+        self._retired_actors.extend(self.actors)
         self.actors = []
 
+    def free_retired_actors(self):
+        """
+        Free actors that have been removed. Call with the OpenGL context
+        current.
+        """
+        while self._retired_actors:
+            self._retired_actors.pop().delete()
+
+    def close(self):
+        """
+        Free all actors of a scene that is no longer needed.
+        """
+        self.clear()
+        self.free_retired_actors()
+
     # ------------------------------------------------------------------------
     # DRAWING
     # ------------------------------------------------------------------------
@@ -111,6 +202,15 @@ class Scene(BaseScene):
         glEnable(GL_BLEND)
         glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
 
+        if self.use_shaders:
+            try:
+                self.shading = ShaderRenderer()
+                self.shading.fade_distance = self.layer_fade
+            except ShaderError, e:
+                logging.warning('Falling back to fixed-function rendering: %s' % e)
+                self.use_shaders = False
+
+        self.text = TextRenderer()
         self.init_actors()
 
         self.initialized = True
@@ -120,7 +220,49 @@ class Scene(BaseScene):
             if not actor.initialized:
                 actor.init()
 
+    def upload_buffers(self, max_bytes=None):
+        """
+        Copy the next chunk of vertex data of actors whose buffers are being
+        filled.
+        """
+        budget = max_bytes if max_bytes is not None else self.UPLOAD_BYTES
+        for queue in self._upload_queues():
+            if budget <= 0:
+                break
+            if queue.pending:
+                budget -= queue.step(budget)
+
+    def _upload_queues(self):
+        queues = [getattr(actor, 'uploads', None) for actor in self.actors]
+        return [queue for queue in queues if queue is not None]
+
+    def finish_uploads(self):
+        for queue in self._upload_queues():
+            queue.finish()
+
+    @property
+    def uploading(self):
+        return any(queue.pending for queue in self._upload_queues())
+
+    def upload_progress(self):
+        """
+        Return bytes uploaded and total bytes of the buffers being filled.
+        """
+        queues = self._upload_queues()
+        return (sum(queue.done_bytes for queue in queues),
+                sum(queue.total_bytes for queue in queues))
+
     def display(self, w, h):
+        stats = self.frame_stats
+        record_stats = stats.enabled or self.show_frame_stats or stats.logging
+        if record_stats:
+            stats.begin_frame()
+
+        # actors may have been replaced since the last frame
+        self.free_retired_actors()
+        self.init_actors()
+        self.upload_buffers()
+
         # clear the color and depth buffers from any leftover junk
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 
@@ -131,18 +273,30 @@ class Scene(BaseScene):
         # see: http://www.opengl.org/resources/faq/technical/lights.htm#ligh0090
         glEnable(GL_RESCALE_NORMAL)
 
-        self.view_ortho.begin(w, h)
-        self.draw_axes()
-        self.view_ortho.end()
+        if self.show_axes:
+            self.view_ortho.begin(w, h)
+            self.draw_axes()
+            self.view_ortho.end()
 
         self.current_view.begin(w, h)
         self.current_view.display_transform()
 
+        # actors with level-of-detail support use pixel size to decide how
+        # much detail is worth drawing
+        pixel_size = self.current_view.pixel_size()
+
+        # remember the transformation to map mouse positions back to the model
+        self._modelview  = glGetDoublev(GL_MODELVIEW_MATRIX)
+        self._projection = glGetDoublev(GL_PROJECTION_MATRIX)
+        self._viewport   = glGetIntegerv(GL_VIEWPORT)
+        self._pixel_size = pixel_size
+
+        shading = self.shading if self.use_shaders else None
+        if shading is not None:
+            shading.begin_frame(self.current_view)
+
         if self.mode_ortho:
-            for actor in self.actors:
-                actor.display(elevation=-self.current_view.elevation,
-                              mode_ortho=self.mode_ortho,
-                              mode_2d=self.mode_2d)
+            view_args = {'elevation': -self.current_view.elevation}
         else:
             # actors may use eye height to perform rendering optimizations; in
             # the simplest terms, in the most convenient definitions, eye
@@ -170,50 +324,53 @@ class Scene(BaseScene):
             #glVertex(-plane_size/2, plane_size/2, eye_height)
             #glEnd()
 
-            for actor in self.actors:
-                actor.display(eye_height=eye_height,
-                              mode_ortho=self.mode_ortho,
-                              mode_2d=self.mode_2d)
+            view_args = {'eye_height': eye_height}
+
+        for actor in self.actors:
+            start = time.time()
+            actor.display(mode_ortho=self.mode_ortho,
+                          mode_2d=self.mode_2d,
+                          pixel_size=pixel_size,
+                          shading=shading,
+                          interactive=self.interacting,
+                          **view_args)
+            if record_stats:
+                stats.add_actor_time(actor, time.time() - start)
 
         self.current_view.end()
 
+        if self.show_frame_stats:
+            self.view_ortho.begin(w, h)
+            self.draw_frame_stats(h)
+            self.view_ortho.end()
+
+        if record_stats:
+            stats.end_frame(self.buffer_memory())
+
     def reshape(self, w, h):
         glViewport(0, 0, w, h)
 
-    def draw_axes(self, length=50.0):
-        glPushMatrix()
-        self.current_view.ui_transform(length)
-
-        axes = [
-            (-length, 0.0, 0.0),
-            (0.0, -length, 0.0),
-            (0.0, 0.0, length),
-        ]
-        colors = [
-            (1.0, 0.0, 0.0),
-            (0.0, 1.0, 0.0),
-            html_color('008aff')
-        ]
-        labels = ['x', 'y', 'z']
-
-        glBegin(GL_LINES)
-
-        for axis, color in zip(axes, colors):
-            glColor(*color)
-            glVertex(0.0, 0.0, 0.0)
-            glVertex(*axis)
-
-        glEnd()
-
-        # draw axis labels
-        glutInit()
-
-        for label, axis, color in zip(labels, axes, colors):
-            glColor(*color)
-            # add padding to labels
-            glRasterPos(axis[0] + 2, axis[1] + 2, axis[2] + 2)
-            glutBitmapCharacter(GLUT_BITMAP_8_BY_13, ord(label));
+    def buffer_memory(self):
+        """
+        Return the number of bytes in vertex buffer objects of all actors.
+        """
+        return sum(buf.size for actor in self.actors if hasattr(actor, 'buffers')
+                   for buf in actor.buffers())
 
+    def draw_frame_stats(self, h):
+        """
+        Draw statistics of recent frames in the top left corner.
+        """
+        glDisable(GL_DEPTH_TEST)
+        lines = self.frame_stats.overlay_lines()
+        self.text.draw([(line, 10, h - 20 - idx * self.text.line_height, (0.2, 0.2, 0.2))
+                        for idx, line in enumerate(lines)])
+        glEnable(GL_DEPTH_TEST)
+
+    def draw_axes(self):
+        glPushMatrix()
+        self.current_view.ui_transform(self.axes.length)
+        self.axes.draw(self.text)
         glPopMatrix()
 
     # ------------------------------------------------------------------------
@@ -242,7 +399,46 @@ class Scene(BaseScene):
         self.cursor_x = x
         self.cursor_y = y
 
-        self.invalidate()
+        # plain mouse movement does not change the view
+        if left or middle or right:
+            self.invalidate()
+
+    def hover(self, x, y):
+        """
+        Return a description of the Gcode movement under the mouse cursor,
+        or None if there is nothing there.
+        """
+        if (self.model is None or not hasattr(self.model, 'pick') or
+                self._modelview is None or self.model.num_layers_to_draw < 1):
+            return None
+
+        # window coordinates start at the top, OpenGL ones at the bottom
+        win_y = self._viewport[1] + self._viewport[3] - y
+        near, far = unproject(x, win_y, self._modelview, self._projection, self._viewport)
+        radius = self.PICK_RADIUS * self._pixel_size
+
+        offset_z = self.model.offset_z if not self.mode_2d else 0
+        offset = numpy.array([self.model.offset_x, self.model.offset_y, offset_z])
+        near = near - offset
+        far  = far - offset
+
+        if self.mode_2d:
+            # only the current layer is visible
+            idx = self.model.pick(near[0], near[1], radius, self.model.num_layers_to_draw - 1)
+        else:
+            # the cursor is over a different point of every layer; the
+            # topmost visible layer with a movement there wins
+            dz = far[2] - near[2]
+            if abs(dz) < 1e-12:
+                return None
+            heights = numpy.asarray(self.model.layer_heights[:self.model.num_layers_to_draw], 'd')
+            t = (heights - near[2]) / dz
+            points = near[:2] + (far[:2] - near[:2]) * t[:, None]
+            idx = self.model.pick_layers(points, radius)
+
+        if idx is None:
+            return None
+        return self.model.segment_info(idx)
 
     def wheel_scroll(self, direction):
         delta_y = 30.0
@@ -309,7 +505,6 @@ class Scene(BaseScene):
     def scale_model(self, factor):
         print '--- scaling model by factor of:', factor
         self.model.scale(factor)
-        self.model.init()
 
     def center_model(self):
         """
@@ -322,7 +517,14 @@ class Scene(BaseScene):
         offset_y = -(upper_corner[1] + lower_corner[1]) / 2
         offset_z = -lower_corner[2]
         self.model.translate(offset_x, offset_y, offset_z)
-        self.model.init()
+
+    def lay_flat_model(self):
+        """
+        Turn the model onto the face it rests on best and lower it onto the
+        platform.
+        """
+        if self.model.lay_flat():
+            self.model.translate(0, 0, -self.model.bounding_box.lower_corner[2])
 
     def change_model_dimension(self, dimension, value):
         current_value = getattr(self.model, dimension)
@@ -334,7 +536,6 @@ class Scene(BaseScene):
     def rotate_model(self, angle, axis_name):
         axis = Model.letter_axis_map[axis_name]
         self.model.rotate_abs(angle, axis)
-        self.model.init()
 
     def get_property(self, name):
         """
@@ -346,6 +547,30 @@ class Scene(BaseScene):
         self.model.arrows_enabled = show
         self.model.init()
 
+    def show_burn_preview(self, show):
+        """
+        Show Gcode burn segments as an accumulated image in 2D mode.
+        """
+        self.model.burn_preview_enabled = show
+
+    def export_burn_preview(self, fpath):
+        self.model.export_burn_preview(fpath)
+
+    def find_hotspots(self, watts, power_scale, threshold):
+        """
+        Highlight areas of the displayed layer that receive too much energy.
+        """
+        return self.model.find_hotspots(watts, power_scale, threshold)
+
+    def set_hotspots(self, hotspots, layer_idx):
+        """
+        Highlight hotspots of a layer found in the background.
+        """
+        self.model.set_hotspots(hotspots, layer_idx)
+
+    def show_hotspots(self, show):
+        self.model.hotspots_enabled = show
+
     @property
     def model_modified(self):
         """
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 Denis Kobozev
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Shader-based rendering of models.
+
+This is an alternative to the fixed-function pipeline for the bulk of the
+geometry: Gcode movements and arrows, and STL facets. Camera matrices are
+computed with numpy from the state of the view instead of being read back
+from OpenGL.
+"""
+
+from __future__ import division
+
+import logging
+import numpy
+
+from OpenGL.GL import *
+
+from . import vector
+
+
+# vertex attribute locations shared by all programs
+ATTRIB_POSITION = 0
+ATTRIB_COLOR    = 1
+ATTRIB_NORMAL   = 2
+
+LINES_VERTEX_SHADER = """
+#version 130
+
+uniform mat4 mvp;
+uniform bool flatten;
+uniform float top_z;
+uniform float fade_distance;
+uniform float fade_min;
+
+in vec3 position;
+in vec4 color;
+
+out vec4 frag_color;
+
+void main()
+{
+    vec3 p = position;
+    if (flatten) {
+        p.z = 0.0;
+    }
+    gl_Position = mvp * vec4(p, 1.0);
+
+    // layers further below the top layer get more transparent
+    float fade = 1.0;
+    if (fade_distance > 0.0) {
+        fade = mix(1.0, fade_min, clamp((top_z - position.z) / fade_distance, 0.0, 1.0));
+    }
+    frag_color = vec4(color.rgb, color.a * fade);
+}
+"""
+
+LINES_FRAGMENT_SHADER = """
+#version 130
+
+in vec4 frag_color;
+out vec4 out_color;
+
+void main()
+{
+    out_color = frag_color;
+}
+"""
+
+FACETS_VERTEX_SHADER = """
+#version 130
+
+uniform mat4 mvp;
+uniform mat4 modelview;
+uniform mat3 normal_matrix;
+
+in vec3 position;
+in vec3 normal;
+
+out vec3 eye_position;
+out vec3 eye_normal;
+
+void main()
+{
+    gl_Position = mvp * vec4(position, 1.0);
+    eye_position = (modelview * vec4(position, 1.0)).xyz;
+    eye_normal = normal_matrix * normal;
+}
+"""
+
+# white material lit by two lights, like the fixed-function STL renderer
+# with color material enabled; only the first light has a specular component
+FACETS_FRAGMENT_SHADER = """
+#version 130
+
+uniform vec3 light_positions[2];
+
+in vec3 eye_position;
+in vec3 eye_normal;
+out vec4 out_color;
+
+const vec3 ambient = vec3(0.5);
+const vec3 diffuse = vec3(0.3);
+const vec3 specular = vec3(0.7);
+const float shininess = 32.0;
+
+void main()
+{
+    vec3 n = normalize(eye_normal);
+    vec3 color = ambient;
+    for (int i = 0; i < 2; i++) {
+        vec3 l = normalize(light_positions[i] - eye_position);
+        float lambert = max(dot(n, l), 0.0);
+        color += diffuse * lambert;
+        if (i == 0 && lambert > 0.0) {
+            vec3 h = normalize(l + vec3(0.0, 0.0, 1.0));
+            color += specular * pow(max(dot(n, h), 0.0), shininess);
+        }
+    }
+    out_color = vec4(min(color, 1.0), 1.0);
+}
+"""
+
+
+class ShaderError(Exception):
+    pass
+
+
+def shaders_supported():
+    """
+    Return true if the current context supports GLSL 1.30 and vertex array
+    objects, i.e. OpenGL 3.0 or later.
+    """
+    version = glGetString(GL_VERSION)
+    if not version:
+        return False
+
+    try:
+        major, minor = [int(part) for part in version.split()[0].split('.')[:2]]
+    except ValueError:
+        return False
+    return (major, minor) >= (3, 0)
+
+
+def compile_shader(source, shader_type):
+    shader = glCreateShader(shader_type)
+    glShaderSource(shader, source)
+    glCompileShader(shader)
+    if not glGetShaderiv(shader, GL_COMPILE_STATUS):
+        log = glGetShaderInfoLog(shader)
+        glDeleteShader(shader)
+        raise ShaderError('Shader compilation failed: %s' % log)
+    return shader
+
+
+class ShaderProgram(object):
+    """
+    A linked vertex and fragment shader pair.
+    """
+    def __init__(self, vertex_source, fragment_source, attributes):
+        shaders = [compile_shader(vertex_source, GL_VERTEX_SHADER),
+                   compile_shader(fragment_source, GL_FRAGMENT_SHADER)]
+
+        self.program = glCreateProgram()
+        for shader in shaders:
+            glAttachShader(self.program, shader)
+        for name, location in attributes.items():
+            glBindAttribLocation(self.program, location, name)
+        glLinkProgram(self.program)
+
+        for shader in shaders:
+            glDetachShader(self.program, shader)
+            glDeleteShader(shader)
+
+        if not glGetProgramiv(self.program, GL_LINK_STATUS):
+            log = glGetProgramInfoLog(self.program)
+            glDeleteProgram(self.program)
+            raise ShaderError('Shader linking failed: %s' % log)
+
+        self._locations = {}
+
+    def location(self, name):
+        if name not in self._locations:
+            self._locations[name] = glGetUniformLocation(self.program, name)
+        return self._locations[name]
+
+    def use(self):
+        glUseProgram(self.program)
+
+    def set_matrix4(self, name, matrix):
+        # numpy matrices are row-major, hence the transpose flag
+        glUniformMatrix4fv(self.location(name), 1, GL_TRUE, numpy.require(matrix, 'f'))
+
+    def set_matrix3(self, name, matrix):
+        glUniformMatrix3fv(self.location(name), 1, GL_TRUE, numpy.require(matrix, 'f'))
+
+    def set_float(self, name, value):
+        glUniform1f(self.location(name), value)
+
+    def set_bool(self, name, value):
+        glUniform1i(self.location(name), int(bool(value)))
+
+    def set_vec3_array(self, name, values):
+        values = numpy.require(values, 'f')
+        glUniform3fv(self.location(name), len(values), values)
+
+
+class VertexArray(object):
+    """
+    A vertex array object (VAO) binding VBOs to attribute locations.
+    """
+    def __init__(self, attributes):
+        """
+        Attributes is a list of (location, VBO, number of components) tuples
+        for float attributes, or (location, VBO, number of components, type)
+        for integer ones, which are normalized to [-1, 1] or [0, 1].
+        """
+        self.buffers = tuple(attribute[1] for attribute in attributes)
+
+        self.vao = glGenVertexArrays(1)
+        glBindVertexArray(self.vao)
+        for attribute in attributes:
+            location, buffer, size = attribute[:3]
+            gl_type = attribute[3] if len(attribute) > 3 else GL_FLOAT
+            buffer.bind()
+            glEnableVertexAttribArray(location)
+            normalized = GL_FALSE if gl_type == GL_FLOAT else GL_TRUE
+            glVertexAttribPointer(location, size, gl_type, normalized, 0, None)
+            buffer.unbind()
+        glBindVertexArray(0)
+
+    def bind(self):
+        glBindVertexArray(self.vao)
+
+    def unbind(self):
+        glBindVertexArray(0)
+
+    def delete(self):
+        glDeleteVertexArrays(1, [self.vao])
+
+
+class ShaderRenderer(object):
+    """
+    Programs and per-frame camera state for shader-based rendering.
+
+    Actors that support it draw through the renderer when the scene passes it
+    to their display method; others keep using the fixed-function pipeline.
+    """
+    # light positions in scene coordinates, same as the fixed-function ones
+    LIGHT_POSITIONS = [(20.0, 20.0, 20.0), (-20.0, -20.0, 20.0)]
+
+    def __init__(self):
+        if not shaders_supported():
+            raise ShaderError('OpenGL 3.0 is required, found %s' % glGetString(GL_VERSION))
+
+        self.lines = ShaderProgram(LINES_VERTEX_SHADER, LINES_FRAGMENT_SHADER, {
+            'position': ATTRIB_POSITION,
+            'color':    ATTRIB_COLOR,
+        })
+        self.facets = ShaderProgram(FACETS_VERTEX_SHADER, FACETS_FRAGMENT_SHADER, {
+            'position': ATTRIB_POSITION,
+            'normal':   ATTRIB_NORMAL,
+        })
+
+        # fade layers below the top one over this many millimetres, down to
+        # fade_min of their opacity; no fading when zero
+        self.fade_distance = 0.0
+        self.fade_min      = 0.25
+
+        self.projection = numpy.identity(4)
+        self.view       = numpy.identity(4)
+        self.set_model(self.view)
+
+        logging.info('Using shader renderer')
+
+    def begin_frame(self, view_mode):
+        """
+        Take camera matrices from the view. Call after view_mode.begin().
+        """
+        self.projection = view_mode.projection_matrix()
+        self.view       = view_mode.view_matrix()
+
+    def modelview(self, x=0.0, y=0.0, z=0.0):
+        """
+        Return the modelview matrix for a model offset by x, y, z.
+        """
+        return numpy.dot(self.view, vector.gl_translate(x, y, z))
+
+    def set_model(self, modelview, flatten=False, top_z=0.0):
+        """
+        Set the transformation of the model drawn next, whether to flatten it
+        onto the z=0 plane and the height of its top layer.
+        """
+        self.model_modelview = modelview
+        self.flatten         = flatten
+        self.top_z           = top_z
+
+    def use_lines(self):
+        program = self.lines
+        program.use()
+        program.set_matrix4('mvp', numpy.dot(self.projection, self.model_modelview))
+        program.set_bool('flatten', self.flatten)
+        program.set_float('top_z', self.top_z)
+        program.set_float('fade_distance', 0.0 if self.flatten else self.fade_distance)
+        program.set_float('fade_min', self.fade_min)
+
+    def use_facets(self):
+        modelview = self.model_modelview
+
+        program = self.facets
+        program.use()
+        program.set_matrix4('mvp', numpy.dot(self.projection, modelview))
+        program.set_matrix4('modelview', modelview)
+        program.set_matrix3('normal_matrix', numpy.linalg.inv(modelview[:3, :3]).T)
+
+        # lights are placed in the scene, not moved with the model
+        lights = [numpy.dot(self.view, position + (1.0,))[:3]
+                  for position in self.LIGHT_POSITIONS]
+        program.set_vec3_array('light_positions', lights)
+
+    def done(self):
+        glUseProgram(0)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 Denis Kobozev
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Passing objects holding large arrays between processes through shared
+memory.
+
+The sending process dumps an object into a file, in /dev/shm where there is
+one: large NumPy arrays are written out raw and the rest of the object is
+pickled. The receiving process maps the file and gets the arrays back as
+views of the mapping, so they are not pickled, sent through a pipe or
+copied again.
+"""
+
+from __future__ import division
+
+import os
+import mmap
+import array
+import atexit
+import struct
+import logging
+import tempfile
+import cPickle
+import cStringIO
+import numpy
+
+
+MAGIC = 'TATLNSHM'
+HEADER = struct.Struct('<8sQ') # magic, offset of the pickle
+
+# arrays are aligned for the benefit of SIMD code reading them
+ALIGNMENT = 64
+
+# arrays smaller than this are simply pickled
+MIN_SHARED_BYTES = 64 * 1024
+
+
+def shared_dir():
+    """
+    Directory for shared files: tmpfs if available, so that they never hit
+    the disk.
+    """
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+def create_path():
+    """
+    Return the path of a new empty file for dump().
+    """
+    fd, path = tempfile.mkstemp(prefix='tatlin-', suffix='.shm', dir=shared_dir())
+    os.close(fd)
+    _open_paths.add(path)
+    return path
+
+def remove(path):
+    """
+    Remove a shared file. Arrays already mapped from it stay valid on
+    POSIX systems; their memory is returned when they are gone.
+    """
+    _open_paths.discard(path)
+    try:
+        os.remove(path)
+    except OSError, e:
+        logging.warning('Could not remove shared file %s: %s' % (path, e))
+
+# files created by this process and not removed yet, removed at exit in case
+# their owners were never closed
+_open_paths = set()
+
+@atexit.register
+def _remove_open_paths():
+    for path in list(_open_paths):
+        if os.path.exists(path):
+            remove(path)
+
+
+def dump(obj, path):
+    """
+    Write obj to a file created with create_path().
+    """
+    written = {} # id -> persistent id, so that shared arrays are written once
+    keep = []    # keeps the ids of written objects from being reused
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, 0))
+
+        def write_raw(data):
+            padding = -f.tell() % ALIGNMENT
+            f.write('\0' * padding)
+            offset = f.tell()
+            data.tofile(f)
+            return offset
+
+        def persistent_id(o):
+            if id(o) in written:
+                return written[id(o)]
+
+            if (isinstance(o, numpy.ndarray) and o.nbytes >= MIN_SHARED_BYTES and
+                    not o.dtype.hasobject):
+                offset = write_raw(numpy.ascontiguousarray(o))
+                pid = ('ndarray', offset, o.dtype.str, o.shape)
+            elif isinstance(o, array.array) and len(o) * o.itemsize >= MIN_SHARED_BYTES:
+                offset = write_raw(o)
+                pid = ('array', offset, o.typecode, len(o))
+            else:
+                return None
+
+            written[id(o)] = pid
+            keep.append(o)
+            return pid
+
+        data = cStringIO.StringIO()
+        pickler = cPickle.Pickler(data, cPickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = persistent_id
+        pickler.dump(obj)
+
+        pickle_offset = f.tell()
+        f.write(data.getvalue())
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, pickle_offset))
+
+
+class SharedArrays(object):
+    """
+    Mapping of a file written by dump().
+
+    Arrays loaded from it are copy-on-write views of the mapping: changing
+    them does not affect the file or other processes. Call close() when the
+    loaded object is no longer needed.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        magic, self._pickle_offset = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a shared array file' % path)
+
+    @property
+    def nbytes(self):
+        return len(self._map) if self._map is not None else 0
+
+    def load(self):
+        loaded = {} # persistent id -> object, as these are not memoized
+
+        def persistent_load(pid):
+            if pid not in loaded:
+                loaded[pid] = self._load_shared(pid)
+            return loaded[pid]
+
+        unpickler = cPickle.Unpickler(cStringIO.StringIO(self._map[self._pickle_offset:]))
+        unpickler.persistent_load = persistent_load
+        return unpickler.load()
+
+    def _load_shared(self, pid):
+        kind, offset = pid[:2]
+        if kind == 'ndarray':
+            dtype, shape = numpy.dtype(pid[2]), pid[3]
+            count = int(numpy.prod(shape))
+            return numpy.frombuffer(self._map, dtype, count, offset).reshape(shape)
+        elif kind == 'array':
+            typecode, count = pid[2:]
+            # the array module cannot wrap memory it does not own
+            result = array.array(typecode)
+            result.fromstring(self._map[offset:offset + count * result.itemsize])
+            return result
+        raise cPickle.UnpicklingError('Unknown shared object: %r' % (kind,))
+
+    def close(self):
+        """
+        Remove the file. The mapping itself is not closed, as loaded arrays
+        may still refer to it; it goes away with the last of them.
+        """
+        if self._map is not None:
+            self._map = None
+            remove(self.path)
+
+
+def load(path):
+    """
+    Return the object stored in path by dump() and the SharedArrays it is
+    mapped from.
+    """
+    shared = SharedArrays(path)
+    return shared.load(), shared
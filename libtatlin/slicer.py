@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 Denis Kobozev
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Cutting triangle meshes with horizontal planes into 2D contours, and
+writing the contours out as G-code for a laser.
+
+Each facet that crosses a plane contributes one segment, running so that
+the inside of the mesh is on its left when seen from above. Segments meet
+where facets share an edge, and are chained into polylines by welding their
+endpoints: outlines come out counter-clockwise and holes clockwise.
+"""
+
+from __future__ import division
+
+import time
+import logging
+import multiprocessing
+import numpy
+
+from . import mesh
+from . import sharedarrays
+
+
+# segment endpoints closer than this, in mm, are the same point
+WELD_TOLERANCE = 1e-4
+
+# heights per task when slicing in parallel, few enough for the work to be
+# spread evenly over the processes
+HEIGHTS_PER_TASK = 8
+
+
+def slice_facets(facets, height, z_range=None):
+    """
+    Return the segments where facets, given as an array of shape (n, 3, 3),
+    cross the plane at height, as two arrays of start and end points of
+    shape (m, 2). z_range, the lowest and highest z of each facet, saves
+    finding them again when slicing at many heights.
+    """
+    if z_range is None:
+        z_range = facets[:, :, 2].min(1), facets[:, :, 2].max(1)
+    lowest, highest = z_range
+    facets = facets[(lowest <= height) & (highest > height)]
+
+    # vertices on the plane count as below it, so that every crossing
+    # facet has exactly one edge going up through it and one coming down
+    above = facets[:, :, 2] > height
+    above_next = numpy.roll(above, -1, 1)
+    up = (~above & above_next).argmax(1)
+    down = (above & ~above_next).argmax(1)
+
+    def crossing(edge):
+        # both facets along an edge find the same point, from the lower end
+        rows = numpy.arange(len(facets))
+        start, end = facets[rows, edge], facets[rows, (edge + 1) % 3]
+        end_above = (end[:, 2] > height)[:, None]
+        lower, upper = numpy.where(end_above, start, end), numpy.where(end_above, end, start)
+        t = ((height - lower[:, 2]) / (upper[:, 2] - lower[:, 2]))[:, None]
+        return lower[:, :2] + t * (upper[:, :2] - lower[:, :2])
+
+    return crossing(down), crossing(up)
+
+def chain_segments(starts, ends):
+    """
+    Join segments end to start into polylines. Returns a list of arrays of
+    points of shape (k, 2), with the first point repeated at the end of the
+    closed ones.
+    """
+    kept, ids = mesh.weld(numpy.concatenate([starts, ends]), WELD_TOLERANCE)
+    points = numpy.concatenate([starts, ends])[kept]
+    start_ids, end_ids = ids[:len(starts)].astype(numpy.int64), ids[len(starts):].astype(numpy.int64)
+
+    # segments too short to have a direction are dropped
+    longer = start_ids != end_ids
+    start_ids, end_ids = start_ids[longer], end_ids[longer]
+    count = len(start_ids)
+
+    # the segment that starts where each one ends, -1 if there is none
+    starting_at = numpy.empty(len(kept), numpy.int64)
+    starting_at.fill(-1)
+    starting_at[start_ids] = numpy.arange(count)
+    following = starting_at[end_ids]
+
+    # open polylines are followed from their first segments, closed ones
+    # from anywhere
+    has_previous = numpy.zeros(count, bool)
+    has_previous[following[following >= 0]] = True
+    firsts = numpy.concatenate([numpy.flatnonzero(~has_previous),
+                                numpy.flatnonzero(has_previous)])
+
+    following = following.tolist()
+    visited = numpy.zeros(count, bool)
+    polylines = []
+    for first in firsts.tolist():
+        if visited[first]:
+            continue
+        chain = []
+        segment = first
+        while segment >= 0 and not visited[segment]:
+            chain.append(segment)
+            visited[segment] = True
+            segment = following[segment]
+        polylines.append(points[numpy.append(start_ids[chain], end_ids[chain[-1]])])
+    return polylines
+
+def slice_contours(facets, height, z_range=None):
+    """
+    Return the polylines where facets cross the plane at height, see
+    slice_facets() and chain_segments().
+    """
+    return chain_segments(*slice_facets(facets, height, z_range))
+
+def slice_heights(facets, heights, processes=None):
+    """
+    Return the polylines where facets cross the plane at each of heights,
+    see slice_contours(). The heights are divided among a pool of processes,
+    which read the facets from shared memory.
+    """
+    t_start = time.time()
+    facets = numpy.require(facets, 'f', 'C').reshape(-1, 3, 3)
+    heights = list(heights)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    if (processes == 1 or len(heights) <= 1 or
+            multiprocessing.current_process().daemon): # daemons cannot have children
+        z_range = facets[:, :, 2].min(1), facets[:, :, 2].max(1)
+        layers = [slice_contours(facets, height, z_range) for height in heights]
+    else:
+        path = sharedarrays.create_path()
+        try:
+            sharedarrays.dump(facets, path)
+            pool = multiprocessing.Pool(processes, _init_worker, (path,))
+            try:
+                tasks = [heights[i:i + HEIGHTS_PER_TASK]
+                         for i in xrange(0, len(heights), HEIGHTS_PER_TASK)]
+                layers = [layer for result in pool.imap(_slice_task, tasks) for layer in result]
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        finally:
+            sharedarrays.remove(path)
+
+    logging.info('Sliced %d facets at %d heights in %.2f seconds' % (
+        len(facets), len(heights), time.time() - t_start))
+    return layers
+
+# facets mapped from shared memory by each worker process, and the lowest
+# and highest z of each
+_worker_facets  = None
+_worker_shared  = None
+_worker_z_range = None
+
+def _init_worker(path):
+    global _worker_facets, _worker_shared, _worker_z_range
+    _worker_facets, _worker_shared = sharedarrays.load(path)
+    _worker_z_range = _worker_facets[:, :, 2].min(1), _worker_facets[:, :, 2].max(1)
+
+def _slice_task(heights):
+    return [slice_contours(_worker_facets, height, _worker_z_range) for height in heights]
+
+
+def signed_area(polyline):
+    """
+    Return the area enclosed by a closed polyline, positive if it runs
+    counter-clockwise.
+    """
+    x, y = polyline[:-1, 0], polyline[:-1, 1]
+    x_next, y_next = polyline[1:, 0], polyline[1:, 1]
+    return float((x * y_next - x_next * y).sum()) / 2
+
+def is_outline(polyline):
+    """
+    Return True if polyline is closed and runs counter-clockwise, around
+    the inside of a mesh rather than a hole in it.
+    """
+    return numpy.array_equal(polyline[0], polyline[-1]) and signed_area(polyline) > 0
+
+def write_gcode(f, heights, layers, laseron='M3', laseroff='M5', burnrate=800,
+                skiprate=3000, power=None, lasermod='S'):
+    """
+    Write polylines, given for each of heights as by slice_heights(), as
+    G-code tracing each with the laser on at burnrate and moving between
+    them with it off at skiprate. Every height ends a layer.
+    """
+    laser_on = laseron if power is None else '%s %s%s' % (laseron, lasermod, power)
+    f.write('G21 ; millimeters\nG90 ; absolute coordinates\n')
+    for height, polylines in zip(heights, layers):
+        f.write('; contours at z = %.3f\n' % height)
+        # holes are cut before the outlines around them, so that the part
+        # does not drop out of the sheet first
+        for polyline in sorted(polylines, key=is_outline):
+            f.write('G0 X%.3f Y%.3f F%g\n' % (polyline[0, 0], polyline[0, 1], float(skiprate)))
+            f.write('%s\n' % laser_on)
+            f.write('G1 X%.3f Y%.3f F%g\n' % (polyline[1, 0], polyline[1, 1], float(burnrate)))
+            rest = polyline[2:]
+            f.write(('G1 X%.3f Y%.3f\n' * len(rest)) % tuple(rest.ravel()))
+            f.write('%s\n' % laseroff)
+        f.write('; </layer>\n')
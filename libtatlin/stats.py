@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 Denis Kobozev
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Timings and counts of drawn frames.
+"""
+
+from __future__ import division
+
+import os
+import csv
+import time
+import ctypes
+import collections
+
+from OpenGL.GL import *
+from OpenGL.GL.ARB.timer_query import glInitTimerQueryARB
+from OpenGL.raw.GL.VERSION.GL_3_3 import glGetQueryObjectui64v
+
+
+class DrawCounter(object):
+    """
+    Number of draw calls and vertices submitted since the last reset.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls    = 0
+        self.vertices = 0
+
+    def add(self, calls, vertices):
+        self.calls    += calls
+        self.vertices += int(vertices)
+
+# drawing code reports to this counter through count_draw()
+draw_counter = DrawCounter()
+
+def count_draw(calls, vertices):
+    draw_counter.add(calls, vertices)
+
+
+class Frame(object):
+    """
+    Statistics of a single frame. Times are in seconds; GPU time is None
+    until the result of its timer query is available, and stays None if
+    timer queries are not supported.
+    """
+    def __init__(self, start):
+        self.start        = start
+        self.cpu_time     = 0.0
+        self.gpu_time     = None
+        self.actor_times  = []
+        self.draw_calls   = 0
+        self.vertices     = 0
+        self.buffer_bytes = 0
+
+
+class FrameStats(object):
+    """
+    Statistics of recently drawn frames, optionally written to a CSV log.
+
+    Call begin_frame() and end_frame() around drawing a frame with its
+    OpenGL context current. GPU times are measured with GL_TIME_ELAPSED
+    queries, which are read back a few frames later to avoid stalling.
+    """
+    HISTORY = 120 # number of frames to keep
+
+    LOG_FIELDS = ['time', 'cpu_ms', 'gpu_ms', 'draw_calls', 'vertices', 'buffer_bytes',
+                  'actors']
+
+    def __init__(self, timer_queries=None):
+        """
+        Timer queries are used if supported unless timer_queries is False.
+        """
+        self.enabled = False
+        self.frames  = collections.deque(maxlen=self.HISTORY)
+
+        self._frame        = None
+        self._timer_query  = timer_queries
+        self._free_queries = []
+        self._pending      = collections.deque() # (query, frame) pairs
+
+        self._log_path     = None
+        self._log_file     = None
+        self._log_writer   = None
+        self._log_rows     = 0
+        self._log_max_rows = 0
+
+    # ------------------------------------------------------------------------
+    # RECORDING
+    # ------------------------------------------------------------------------
+
+    def begin_frame(self):
+        if self._timer_query is None:
+            self._timer_query = bool(glInitTimerQueryARB())
+
+        draw_counter.reset()
+        self._frame = Frame(time.time())
+
+        if self._timer_query:
+            if not self._free_queries:
+                self._free_queries.extend(glGenQueries(4))
+            query = self._free_queries.pop()
+            glBeginQuery(GL_TIME_ELAPSED, query)
+            self._pending.append((query, self._frame))
+
+    def add_actor_time(self, actor, seconds):
+        self._frame.actor_times.append((actor.__class__.__name__, seconds))
+
+    def end_frame(self, buffer_bytes=0):
+        frame = self._frame
+        self._frame = None
+
+        if self._timer_query:
+            glEndQuery(GL_TIME_ELAPSED)
+
+        frame.cpu_time     = time.time() - frame.start
+        frame.draw_calls   = draw_counter.calls
+        frame.vertices     = draw_counter.vertices
+        frame.buffer_bytes = buffer_bytes
+        self.frames.append(frame)
+
+        if not self._timer_query:
+            self._write_log(frame)
+        self._collect_queries()
+
+    def _collect_queries(self):
+        # results become available in the order the queries were issued
+        while self._pending:
+            query, frame = self._pending[0]
+            if not glGetQueryObjectiv(query, GL_QUERY_RESULT_AVAILABLE):
+                break
+
+            elapsed = ctypes.c_uint64()
+            glGetQueryObjectui64v(query, GL_QUERY_RESULT, ctypes.byref(elapsed))
+            frame.gpu_time = elapsed.value / 1e9
+
+            self._pending.popleft()
+            self._free_queries.append(query)
+            self._write_log(frame)
+
+    # ------------------------------------------------------------------------
+    # RESULTS
+    # ------------------------------------------------------------------------
+
+    @property
+    def last(self):
+        """
+        The most recently drawn frame, or None.
+        """
+        return self.frames[-1] if self.frames else None
+
+    def fps(self, period=1.0):
+        """
+        Number of frames per second drawn over the last period seconds.
+        """
+        now = time.time()
+        return sum(1 for frame in self.frames if frame.start >= now - period) / period
+
+    def summary(self):
+        """
+        Return a dict of average statistics over the recorded frames. Times
+        are in milliseconds.
+        """
+        frames = list(self.frames)
+        if not frames:
+            return None
+
+        def average(values):
+            values = [v for v in values if v is not None]
+            return sum(values) / len(values) if values else None
+
+        actor_times = collections.OrderedDict()
+        for frame in frames:
+            for name, seconds in frame.actor_times:
+                actor_times.setdefault(name, []).append(seconds * 1000)
+
+        gpu_ms = average(f.gpu_time for f in frames)
+        return {
+            'fps':          self.fps(),
+            'cpu_ms':       average(f.cpu_time for f in frames) * 1000,
+            'gpu_ms':       gpu_ms * 1000 if gpu_ms is not None else None,
+            'actor_ms':     [(name, average(t)) for name, t in actor_times.items()],
+            'draw_calls':   frames[-1].draw_calls,
+            'vertices':     frames[-1].vertices,
+            'buffer_bytes': frames[-1].buffer_bytes,
+        }
+
+    def overlay_lines(self):
+        """
+        Return lines of text describing recent frames for an overlay.
+        """
+        summary = self.summary()
+        if summary is None:
+            return []
+
+        gpu = ('%.1f ms' % summary['gpu_ms']) if summary['gpu_ms'] is not None else 'n/a'
+        lines = [
+            'FPS %.0f  CPU %.1f ms  GPU %s' % (summary['fps'], summary['cpu_ms'], gpu),
+            'draw calls %d  vertices %d  VBO %.1f MB' % (
+                summary['draw_calls'], summary['vertices'], summary['buffer_bytes'] / 2**20),
+        ]
+        for name, ms in summary['actor_ms']:
+            lines.append('  %s %.2f ms' % (name, ms))
+        return lines
+
+    # ------------------------------------------------------------------------
+    # LOGGING
+    # ------------------------------------------------------------------------
+
+    def start_log(self, path, max_rows=100000):
+        """
+        Write a row for every frame to a CSV file. When the file reaches
+        max_rows rows, it is moved to path + '.1' and a new one is started.
+        """
+        self.stop_log()
+        self._log_path = path
+        self._log_max_rows = max_rows
+        self._open_log()
+
+    def stop_log(self):
+        if self._log_file is not None:
+            self._log_file.close()
+        self._log_path = self._log_file = self._log_writer = None
+
+    @property
+    def logging(self):
+        return self._log_writer is not None
+
+    def _open_log(self):
+        self._log_file = open(self._log_path, 'wb')
+        self._log_writer = csv.writer(self._log_file)
+        self._log_writer.writerow(self.LOG_FIELDS)
+        self._log_rows = 0
+
+    def _write_log(self, frame):
+        if self._log_writer is None:
+            return
+
+        if self._log_rows >= self._log_max_rows:
+            self._log_file.close()
+            if os.path.exists(self._log_path + '.1'):
+                os.remove(self._log_path + '.1')
+            os.rename(self._log_path, self._log_path + '.1')
+            self._open_log()
+
+        gpu_ms = '%.3f' % (frame.gpu_time * 1000) if frame.gpu_time is not None else ''
+        actors = ' '.join('%s:%.3f' % (name, seconds * 1000)
+                          for name, seconds in frame.actor_times)
+        self._log_writer.writerow(['%.3f' % frame.start, '%.3f' % (frame.cpu_time * 1000),
+                                   gpu_ms, frame.draw_calls, frame.vertices,
+                                   frame.buffer_bytes, actors])
+        self._log_rows += 1
+        self._log_file.flush()
@@ -19,10 +19,12 @@
 """
 Parser for STL (stereolithography) files.
 """
+import mmap
 import struct
 import time
 import logging
-import math
+import multiprocessing
+import numpy
 from cStringIO import StringIO
 
 
@@ -38,32 +40,145 @@ class ParseEOF(StlParseError):
     pass
 
 
+# first characters of the tokens of a facet, with '#' standing for numbers
+FACET_TOKENS = numpy.frombuffer('fn###olv###v###v###ee', numpy.uint8)
+
+# keywords of a facet and how many times each appears in it
+FACET_KEYWORDS = [
+    ('facet normal', 1),
+    ('outer loop',   1),
+    ('vertex',       3),
+    ('endloop',      1),
+    ('endfacet',     1),
+]
+
+WHITESPACE = numpy.zeros(256, bool)
+WHITESPACE[[ord(c) for c in ' \t\n\v\f\r']] = True
+
+
+def parse_facets_bulk(text):
+    """
+    Parse a string of whole ASCII STL facets into vertex and normal arrays,
+    checking its structure with array operations instead of token by token.
+    Returns None if the facets are not laid out as expected.
+    """
+    # classify tokens by their first character: keyword letters or numbers
+    chars = numpy.frombuffer(text, numpy.uint8)
+    space = WHITESPACE[chars]
+    token_starts = numpy.flatnonzero(~space & numpy.concatenate([[True], space[:-1]]))
+    first_chars = chars[token_starts]
+    codes = numpy.where((first_chars >= ord('a')) & (first_chars <= ord('z')),
+                        first_chars, ord('#'))
+
+    if len(codes) % len(FACET_TOKENS) != 0:
+        return None
+    count = len(codes) // len(FACET_TOKENS)
+    if (codes.reshape(count, -1) != FACET_TOKENS).any():
+        return None
+
+    # the keywords have to be spelled right, too; leave only the numbers
+    for keyword, per_facet in FACET_KEYWORDS:
+        if text.count(keyword) != count * per_facet:
+            return None
+        text = text.replace(keyword, ' ')
+
+    # reading stops at the first malformed number
+    numbers = numpy.fromstring(text, 'f', sep=' ')
+    if len(numbers) != count * 12:
+        return None
+
+    numbers = numbers.reshape(count, 12)
+    vertices = numbers[:, 3:].reshape(-1, 3)
+    normals  = numbers[:, :3]
+    return vertices, normals
+
+
+def solid_body(text):
+    """
+    Return start and end offsets of the facets between the solid and
+    endsolid lines of ASCII STL text, or None if they are not found.
+    """
+    start = text.find('\n') + 1
+    end   = text.rfind('endsolid')
+    if start == 0 or end < start:
+        return None
+    if not text[:start].lstrip().startswith('solid'):
+        return None
+    if len(text[end:].strip().splitlines()) != 1:
+        return None
+    return start, end
+
+
+def facet_chunks(text, start, end, size):
+    """
+    Split text between start and end into pieces of about size bytes that
+    end after a facet. Returns a list of start and end offsets.
+    """
+    bounds = []
+    while start < end:
+        stop = text.find('endfacet', min(start + size, end), end)
+        stop = end if stop < 0 else stop + len('endfacet')
+        bounds.append((start, stop))
+        start = stop
+    return bounds
+
+
+def _parse_file_chunk(args):
+    """
+    Parse facets between offsets of a file in a worker process.
+    """
+    path, start, end = args
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return parse_facets_bulk(f.read(end - start))
+
+
 class StlAsciiParser(object):
     """
     Parse for ASCII STL files.
 
-    Points of interest are:
+    Facets are first read in bulk with parse_facets_bulk(). If the file is
+    not laid out the way it expects, it is parsed line by line, keyword by
+    keyword, which also finds where the problem is.
+
+    Points of interest of the line by line parser are:
         * create normal in _facet() method
         * create vertex in _vertex() method
         * create facet in _endfacet() method
 
     The rest is boring parser stuff.
     """
-    def __init__(self):
+    # text is parsed in pieces of about this many bytes
+    CHUNK_BYTES = 32 * 2**20
+
+    # files parsed by several processes, if enabled, need to be at least
+    # this large to be worth it
+    PARALLEL_MIN_BYTES = 256 * 2**20
+
+    def __init__(self, processes=1):
+        self.processes = processes
         self.line_count = 0
         self.line_no = 0
         self.tokenized_peek_line = None
 
     def load(self, stl):
-        if hasattr(stl, 'read'):
-            for line in stl:
-                self.line_count += 1
-            stl.seek(0)
-        else:
-            stl = stl.split('\n')
-            self.line_count = len(stl)
+        self.source = stl
+
+    def _text(self):
+        """
+        Return the text of the file, mapped into memory if possible, so
+        that only the piece being parsed is read in.
+        """
+        if not hasattr(self.source, 'read'):
+            return self.source
 
-        self.stl = iter(stl)
+        if hasattr(self.source, 'fileno'):
+            try:
+                return mmap.mmap(self.source.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                pass # e.g. an empty file
+        self.source.seek(0)
+        return self.source.read()
 
     def readline(self):
         line = self.stl.next()
@@ -95,10 +210,72 @@ class StlAsciiParser(object):
 
     def parse(self, callback=None):
         """
-        Parse the file into a tuple of normal and facet lists.
+        Parse the file into a tuple of vertex and normal arrays or lists,
+        with three vertices and one normal per facet.
         """
         t_start = time.time()
 
+        text = self._text()
+        result = self._parse_bulk(text, callback)
+        if result is None:
+            logging.info('STL ASCII file is not laid out as expected, parsing it line by line')
+            result = self._parse_strict(text, callback)
+
+        t_end = time.time()
+        logging.info('Parsed STL ASCII file in %.2f seconds' % (t_end - t_start))
+
+        return result
+
+    def _parse_bulk(self, text, callback=None):
+        body = solid_body(text)
+        if body is None:
+            return None
+
+        chunks = facet_chunks(text, body[0], body[1], self.CHUNK_BYTES)
+        path = getattr(self.source, 'name', None)
+        if (self.processes > 1 and len(chunks) > 1 and isinstance(path, str) and
+                len(text) >= self.PARALLEL_MIN_BYTES and
+                not multiprocessing.current_process().daemon): # daemons cannot have children
+            results = self._parse_parallel(path, chunks, len(text), callback)
+        else:
+            results = []
+            for start, end in chunks:
+                results.append(parse_facets_bulk(text[start:end]))
+                if results[-1] is None:
+                    return None
+                if callback:
+                    callback(end, len(text))
+
+        if results is None:
+            return None
+        if not results:
+            return numpy.zeros((0, 3), 'f'), numpy.zeros((0, 3), 'f')
+        return (numpy.concatenate([vertices for vertices, normals in results]),
+                numpy.concatenate([normals for vertices, normals in results]))
+
+    def _parse_parallel(self, path, chunks, size, callback=None):
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            results = []
+            tasks = [(path, start, end) for start, end in chunks]
+            for (start, end), result in zip(chunks, pool.imap(_parse_file_chunk, tasks)):
+                if result is None:
+                    return None
+                results.append(result)
+                if callback:
+                    callback(end, size)
+            return results
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _parse_strict(self, text, callback=None):
+        lines = text[:].splitlines(True)
+        self.stl = iter(lines)
+        self.line_count = len(lines)
+        self.line_no = 0
+        self.tokenized_peek_line = None
+
         self.callback = callback
         self.callback_every = self.line_count // 50 # every 2 percent
         self.callback_next = self.callback_every
@@ -108,9 +285,6 @@ class StlAsciiParser(object):
         if self.callback:
             self.callback(self.line_no, self.line_count)
 
-        t_end = time.time()
-        logging.info('Parsed STL ASCII file in %.2f seconds' % (t_end - t_start))
-
         return self.facet_list, self.normal_list
 
     def _solid(self):
@@ -153,7 +327,7 @@ class StlAsciiParser(object):
             raise InvalidTokenError(self.line_no, 'expected "%s", got "%s"' % ('endfacet', line[0]))
 
         self.facet_list.extend(self.vertex_list)
-        self.normal_list.extend([self.facet_normal] * len(self.vertex_list))
+        self.normal_list.append(self.facet_normal)
 
         if self.callback and self.line_no >= self.callback_next:
             self.callback_next += self.callback_every
@@ -179,6 +353,9 @@ class StlAsciiParser(object):
             self._vertex()
             peek = self.peek_line()
 
+        if len(self.vertex_list) != 3:
+            raise InvalidTokenError(self.line_no, 'expected 3 vertices, got %d' % len(self.vertex_list))
+
     def _vertex(self):
         line = self.next_line()
         if line[0] != 'vertex':
@@ -195,6 +372,13 @@ class StlBinaryParser(object):
     FACET_COUNT_LEN = 4  # one 32-bit unsigned int
     FACET_LEN       = 50 # twelve 32-bit floats + one 16-bit short unsigned int
 
+    # layout of a facet record, read for all facets at once
+    FACET_DTYPE = numpy.dtype([
+        ('normal',    '<f4', (3,)),
+        ('vertices',  '<f4', (3, 3)),
+        ('attribute', '<u2'),
+    ])
+
     def load(self, stl):
         if not hasattr(stl, 'read'):
             stl = StringIO(stl)
@@ -203,31 +387,27 @@ class StlBinaryParser(object):
 
     def parse(self, callback=None):
         """
-        Parse the file into a tuple of normal and facet lists.
+        Parse the file into a tuple of vertex and normal arrays, with three
+        vertices and one normal per facet.
         """
         t_start = time.time()
 
-        normal_list = []
-        facet_list  = []
-
         self._skip_header(self.stl)
         fcount = self._facet_count(self.stl)
-        callback_every = max(1, int(math.floor(fcount / 100)))
-        for facet_idx in xrange(fcount):
-            vertices, normal = self._parse_facet(self.stl)
-            facet_list.extend(vertices)
-            normal_list.extend([normal] * len(vertices)) # one normal per vertex
+        facets = self._read_facets(self.stl, fcount)
 
-            if callback and (facet_idx + 1) % callback_every == 0:
-                callback(facet_idx + 1, fcount)
+        # copies in native byte order, detached from the file data
+        vertices = numpy.array(facets['vertices'], 'f').reshape(-1, 3)
+        normals  = numpy.array(facets['normal'], 'f')
+        # ignore the attribute byte counts...
 
         if callback:
-            callback(facet_idx + 1, fcount)
+            callback(fcount, fcount)
 
         t_end = time.time()
         logging.info('Parsed STL binary file in %.2f seconds' % (t_end - t_start))
 
-        return facet_list, normal_list
+        return vertices, normals
 
     def _skip_header(self, fp):
         fp.seek(self.HEADER_LEN)
@@ -238,22 +418,19 @@ class StlBinaryParser(object):
             (count, ) = struct.unpack('<I', raw)
             return count
         except struct.error:
-            raise StlParseError("Error unpacking binary STL data")
-
-    def _parse_facet(self, fp):
-        raw = fp.read(self.FACET_LEN)
-        try:
-            vertex_data = struct.unpack('<ffffffffffffH', raw)
+            raise StlParseError("File is too short to be a binary STL file")
 
-            normal = [ vertex_data[0], vertex_data[1], vertex_data[2] ]
-            vertices = []
-            for i in range(3, 12, 3):
-                vertices.append([ vertex_data[i], vertex_data[i + 1], vertex_data[i + 2] ])
-            # ignore the attribute byte count...
-
-            return vertices, normal
-        except struct.error:
-            raise StlParseError("Error unpacking binary STL data")
+    def _read_facets(self, fp, fcount):
+        # the count in the header is checked against the size of the file
+        # before reading, so that a corrupt one does not exhaust memory
+        position = fp.tell()
+        fp.seek(0, 2)
+        available = (fp.tell() - position) // self.FACET_LEN
+        fp.seek(position)
+        if available < fcount:
+            raise StlParseError("File is truncated: expected %d facets, found %d" %
+                                (fcount, available))
+        return numpy.frombuffer(fp.read(fcount * self.FACET_LEN), self.FACET_DTYPE, fcount)
 
 
 def is_stl_ascii(fp):
@@ -265,12 +442,14 @@ def is_stl_ascii(fp):
     return is_ascii
 
 
-def StlParser(fp):
+def StlParser(fp, processes=1):
     """
-    STL parser that handles both ASCII and binary formats.
+    STL parser that handles both ASCII and binary formats. Large ASCII
+    files are parsed by the given number of processes.
     """
-    parser = StlAsciiParser if is_stl_ascii(fp) else StlBinaryParser
-    return parser()
+    if is_stl_ascii(fp):
+        return StlAsciiParser(processes)
+    return StlBinaryParser()
 
 
 if __name__ == '__main__':
@@ -22,9 +22,15 @@ Module for loading from and writing to files.
 from __future__ import division
 
 import os, os.path
+import shutil
+import struct
+import tempfile
+import contextlib
 
-from .gcodeparser import GcodeParser, GcodeParserError
-from .stlparser import StlParser, StlParseError
+import numpy
+
+from .gcodeparser import GcodeParser, GcodeParserError, LineIndex
+from .stlparser import StlParser, StlParseError, StlBinaryParser, is_stl_ascii
 from .actors import StlModel, GcodeModel
 
 
@@ -34,9 +40,16 @@ class ModelFileError(Exception):
 
 
 class ModelFile(object):
-    def __init__(self, path, ftype=None):
+    # processes parsing large ASCII STL files
+    stl_processes = 1
+
+    def __init__(self, path, ftype=None, weld_tolerance=None, smooth_normals=False):
         self._path = path
         self._ftype = ftype
+
+        # STL models are indexed if a weld tolerance is given, see StlModel
+        self.weld_tolerance = weld_tolerance
+        self.smooth_normals = smooth_normals
         self._reset_file_attributes()
 
         self._loaders = {
@@ -99,53 +112,136 @@ class ModelFile(object):
             self._size = os.path.getsize(self.path)
         return self._size
 
-    def read(self, callback=None):
-        return self._loaders[self.filetype](callback)
+    def read(self, callback=None, preview=None):
+        """
+        Return the model and its data. For Gcode, preview is called with the
+        first part of the data while the rest is being parsed.
+        """
+        return self._loaders[self.filetype](callback, preview)
 
-    def _load_gcode_model(self, callback=None):
+    def _load_gcode_model(self, callback=None, preview=None):
         parser = GcodeParser()
-        with open(self.path, 'r') as gcodefile:
+        # binary mode keeps line offsets true to the file on all platforms
+        with open(self.path, 'rb') as gcodefile:
             parser.load(gcodefile)
             try:
-                data = parser.parse(callback)
-                return GcodeModel(), data
+                data = parser.parse(callback, preview)
+                model = GcodeModel()
+                model.source = LineIndex(self.path, parser.lexer.line_offsets)
+                return model, data
             except GcodeParserError, e:
                 # rethrow as generic file error
                 raise ModelFileError("Parsing error: %s" % e.message)
 
-    def _load_stl_model(self, callback=None):
+    def _load_stl_model(self, callback=None, preview=None):
         with open(self.path, 'rb') as stlfile:
-            parser = StlParser(stlfile)
+            parser = StlParser(stlfile, self.stl_processes)
             parser.load(stlfile)
             try:
                 data = parser.parse(callback)
-                return StlModel(), data
+                return StlModel(self.weld_tolerance, self.smooth_normals), data
             except StlParseError, e:
                 # rethrow as generic file error
                 raise ModelFileError("Parsing error: %s" % e.message)
 
-    def write_stl(self, stl_model):
+    def write_stl(self, stl_model, binary=None):
+        """
+        Write stl_model to the file, in binary if binary is true. By default
+        the format of the file being replaced is kept, and new files are
+        ASCII.
+        """
         assert self.filetype == 'stl'
 
-        vertices, normals = stl_model.vertices, stl_model.normals
-
-        f = open(self.path, 'w')
-        print >>f, 'solid'
-        print >>f, ''.join([self._format_facet(vertices[i:i+3], normals[i])
-            for i in xrange(0, len(vertices), 3)])
-        print >>f, 'endsolid'
-        f.close()
-
-    def _format_facet(self, vertices, normal):
-        template = """facet normal %.6f %.6f %.6f
-  outer loop
-    %s
-  endloop
-endfacet
-"""
-        stl_facet = template % (normal[0], normal[1], normal[2],
-            '\n'.join(['vertex %.6f %.6f %.6f' % (v[0], v[1], v[2])
-                for v in vertices])
-        )
-        return stl_facet
+        if binary is None:
+            binary = os.path.exists(self.path) and not self._is_ascii_stl()
 
+        # transformations are applied to the vertices only now
+        facets, normals = stl_model.transformed_facets()
+        with atomic_write(self.path) as f:
+            if binary:
+                write_binary_stl(f, facets, normals)
+            else:
+                write_ascii_stl(f, facets, normals)
+        self._reset_file_attributes()
+
+    def _is_ascii_stl(self):
+        with open(self.path, 'rb') as f:
+            return is_stl_ascii(f)
+
+
+@contextlib.contextmanager
+def atomic_write(path):
+    """
+    Open a temporary file next to path for writing in binary mode. Once the
+    block completes the file replaces path, so that an error or a crash
+    midway leaves the original intact.
+    """
+    path = os.path.abspath(path)
+    fd, temp_path = tempfile.mkstemp(prefix='.%s.' % os.path.basename(path),
+                                     suffix='.tmp', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+
+        # mkstemp creates files readable by the owner only
+        if os.path.exists(path):
+            shutil.copymode(path, temp_path)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_path, 0666 & ~umask)
+
+        if os.name == 'nt' and os.path.exists(path):
+            # rename does not replace existing files on Windows
+            os.remove(path)
+        os.rename(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+# facets converted at a time when writing STL files, which bounds the memory
+# used on top of the model itself
+STL_WRITE_FACETS = 65536
+
+STL_BINARY_HEADER = 'Binary STL written by Tatlin'.ljust(80, '\0')
+
+STL_ASCII_FACET = ('facet normal %.6f %.6f %.6f\n'
+                   '  outer loop\n' +
+                   '    vertex %.6f %.6f %.6f\n' * 3 +
+                   '  endloop\n'
+                   'endfacet\n')
+
+
+def write_binary_stl(f, facets, normals):
+    """
+    Write facets given as an array of shape (n, 3, 3), and their normals, to
+    f as binary STL.
+    """
+    f.write(STL_BINARY_HEADER)
+    f.write(struct.pack('<I', len(facets)))
+
+    records = numpy.zeros(min(len(facets), STL_WRITE_FACETS), StlBinaryParser.FACET_DTYPE)
+    for start in xrange(0, len(facets), STL_WRITE_FACETS):
+        chunk = records[:len(facets[start:start + STL_WRITE_FACETS])]
+        chunk['normal']   = normals[start:start + STL_WRITE_FACETS]
+        chunk['vertices'] = facets[start:start + STL_WRITE_FACETS]
+        chunk.tofile(f)
+
+def write_ascii_stl(f, facets, normals):
+    """
+    Write facets given as an array of shape (n, 3, 3), and their normals, to
+    f as ASCII STL.
+    """
+    f.write('solid\n')
+    for start in xrange(0, len(facets), STL_WRITE_FACETS):
+        chunk = facets[start:start + STL_WRITE_FACETS]
+        values = numpy.empty((len(chunk), 12))
+        values[:, :3] = normals[start:start + STL_WRITE_FACETS]
+        values[:, 3:] = chunk.reshape(-1, 9)
+        # one formatting operation per chunk rather than per facet
+        f.write((STL_ASCII_FACET * len(chunk)) % tuple(values.ravel().tolist()))
+    f.write('endsolid\n')
@@ -18,10 +18,13 @@
 
 from __future__ import division
 
+import time
 import wx
 from wx import glcanvas
 import PIL.Image
 import PIL.ImageTk
+
+from .scene import SceneRenderer
 #import EmbeddedIconData as eid
 
 # this variable is set when the app is instantiated so that all the ui elements
@@ -142,8 +145,10 @@ class StlPanel(wx.Panel):
         sizer_move = wx.StaticBoxSizer(static_box_move, wx.VERTICAL)
 
         self.btn_center = wx.Button(self, label='Center model')
+        self.btn_lay_flat = wx.Button(self, label='Lay flat')
 
-        sizer_move.Add(self.btn_center, 0, wx.EXPAND | wx.ALL, border=5)
+        sizer_move.Add(self.btn_center,   0, wx.EXPAND | wx.ALL, border=5)
+        sizer_move.Add(self.btn_lay_flat, 0, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, border=5)
 
         #----------------------------------------------------------------------
         # ROTATE
@@ -184,6 +189,51 @@ class StlPanel(wx.Panel):
 
         sizer_rotate.Add(grid_rotate, 0, wx.EXPAND | wx.ALL, border=5)
 
+        #----------------------------------------------------------------------
+        # ANALYSIS
+        #----------------------------------------------------------------------
+
+        static_box_analysis = wx.StaticBox(self, label='Analysis')
+        sizer_analysis = wx.StaticBoxSizer(static_box_analysis, wx.VERTICAL)
+
+        self.analysis_labels = {}
+        grid_analysis = wx.FlexGridSizer(7, 3, 5, 5)
+        for name, label, units in [('volume',             'Volume:',       u'mm\u00b3'),
+                                   ('area',               'Area:',         u'mm\u00b2'),
+                                   ('watertight',         'Watertight:',    ''),
+                                   ('open-edges',         'Open edges:',    ''),
+                                   ('non-manifold-edges', 'Non-manifold:',  ''),
+                                   ('misoriented-edges',  'Misoriented:',   ''),
+                                   ('flipped-normals',    'Flipped:',       '')]:
+            self.analysis_labels[name] = wx.StaticText(self)
+            grid_analysis.Add(wx.StaticText(self, label=label), 0, wx.ALIGN_CENTER_VERTICAL)
+            grid_analysis.Add(self.analysis_labels[name],       0, wx.EXPAND)
+            grid_analysis.Add(wx.StaticText(self, label=units), 0, wx.ALIGN_CENTER_VERTICAL)
+        grid_analysis.AddGrowableCol(1)
+
+        sizer_analysis.Add(grid_analysis, 0, wx.EXPAND | wx.ALL, border=5)
+
+        #----------------------------------------------------------------------
+        # SLICE
+        #----------------------------------------------------------------------
+
+        static_box_slice = wx.StaticBox(self, label='Slice')
+        sizer_slice = wx.StaticBoxSizer(static_box_slice, wx.VERTICAL)
+
+        label_layer = wx.StaticText(self, label='Layer:')
+        self.entry_layer = wx.TextCtrl(self, value='3.00')
+        label_layer_units = wx.StaticText(self, label='mm')
+        self.btn_export_contours = wx.Button(self, label='Export contours...')
+
+        grid_slice = wx.FlexGridSizer(1, 3, 5, 5)
+        grid_slice.Add(label_layer,       0, wx.ALIGN_CENTER_VERTICAL)
+        grid_slice.Add(self.entry_layer,  0, wx.EXPAND)
+        grid_slice.Add(label_layer_units, 0, wx.ALIGN_CENTER_VERTICAL)
+        grid_slice.AddGrowableCol(1)
+
+        sizer_slice.Add(grid_slice,               0, wx.EXPAND | wx.ALL, border=5)
+        sizer_slice.Add(self.btn_export_contours, 0, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, border=5)
+
         #----------------------------------------------------------------------
         # DISPLAY
         #----------------------------------------------------------------------
@@ -207,6 +257,8 @@ class StlPanel(wx.Panel):
         box.Add(sizer_dimensions, 0, wx.EXPAND | wx.TOP | wx.RIGHT | wx.LEFT, border=5)
         box.Add(sizer_move,       0, wx.EXPAND | wx.TOP | wx.RIGHT | wx.LEFT, border=5)
         box.Add(sizer_rotate,     0, wx.EXPAND | wx.TOP | wx.RIGHT | wx.LEFT, border=5)
+        box.Add(sizer_analysis,   0, wx.EXPAND | wx.TOP | wx.RIGHT | wx.LEFT, border=5)
+        box.Add(sizer_slice,      0, wx.EXPAND | wx.TOP | wx.RIGHT | wx.LEFT, border=5)
         box.Add(sizer_display,    0, wx.EXPAND | wx.TOP | wx.RIGHT | wx.LEFT, border=5)
 
         self.SetSizer(box)
@@ -253,6 +305,13 @@ class StlPanel(wx.Panel):
         #----------------------------------------------------------------------
 
         self.btn_center.Bind(wx.EVT_BUTTON, self.on_center_clicked)
+        self.btn_lay_flat.Bind(wx.EVT_BUTTON, self.on_lay_flat_clicked)
+
+        #----------------------------------------------------------------------
+        # SLICE
+        #----------------------------------------------------------------------
+
+        self.btn_export_contours.Bind(wx.EVT_BUTTON, self.on_export_contours_clicked)
 
         #----------------------------------------------------------------------
         # DISPLAY
@@ -312,6 +371,7 @@ class StlPanel(wx.Panel):
     def set_initial_values(self):
         self._set_size_properties()
         self._set_rotation_properties()
+        self._set_analysis_properties()
 
     def _set_size_properties(self):
         self.entry_x.SetValue(app.get_property('width'))
@@ -324,15 +384,32 @@ class StlPanel(wx.Panel):
         self.entry_rotate_y.SetValue(app.get_property('rotation-y'))
         self.entry_rotate_z.SetValue(app.get_property('rotation-z'))
 
+    def _set_analysis_properties(self, names=None):
+        # the model is analyzed in the background, see model_analyzed()
+        analyzed = app.get_property('analyzed')
+        for name in names or self.analysis_labels:
+            self.analysis_labels[name].SetLabel(app.get_property(name) if analyzed else '...')
+
     def model_size_changed(self):
         self._set_size_properties()
+        # scaling changes the measurements, but not the defects
+        self._set_analysis_properties(['volume', 'area'])
 
     def model_angle_changed(self):
         self._set_rotation_properties()
 
+    def model_analyzed(self):
+        self._set_analysis_properties()
+
     def on_center_clicked(self, event):
         app.on_center_model()
 
+    def on_lay_flat_clicked(self, event):
+        app.on_lay_flat()
+
+    def on_export_contours_clicked(self, event):
+        app.on_export_contours(self.entry_layer.GetValue())
+
     def on_reset_clicked(self, event):
         app.on_reset_view()
 
@@ -1080,9 +1157,13 @@ class MainWindow(wx.Frame):
         item_save_as = file_menu.Append(wx.ID_SAVEAS, 'Save As...\tShift+Ctrl+S',
                 'Save under a different filename')
         item_save_as.Enable(False)
+        item_export_preview = file_menu.Append(wx.ID_ANY, 'Export &preview...',
+                'Save the burn preview as an image')
+        item_export_preview.Enable(False)
         item_quit = file_menu.Append(wx.ID_EXIT, '&Quit', 'Quit %s' % self._app_name)
 
         self.menu_items_file = [item_save, item_save_as]
+        self.menu_items_gcode = [item_export_preview]
 
         help_menu = wx.Menu()
         item_about = help_menu.Append(wx.ID_ABOUT, '&About %s' % self._app_name)
@@ -1094,6 +1175,7 @@ class MainWindow(wx.Frame):
         self.Bind(wx.EVT_MENU, app.on_file_open, item_open)
         self.Bind(wx.EVT_MENU, app.on_file_save, item_save)
         self.Bind(wx.EVT_MENU, app.on_file_save_as, item_save_as)
+        self.Bind(wx.EVT_MENU, app.on_export_preview, item_export_preview)
         self.Bind(wx.EVT_MENU, app.on_quit, item_quit)
         self.Bind(wx.EVT_MENU, app.on_about, item_about)
 
@@ -1107,6 +1189,7 @@ class MainWindow(wx.Frame):
 
         self.SetMenuBar(self.menubar)
         self.statusbar = self.CreateStatusBar()
+        self.status_text = ''
         self.SetSizer(self.box_main)
 
         # Set minimum frame size so that the widgets contained within are not squashed.
@@ -1131,12 +1214,14 @@ class MainWindow(wx.Frame):
         tb.AddLabelTool(103, "3d/2d", wx.Bitmap("icons/globe.png"))
         tb.AddLabelTool(104, "Top View", wx.Bitmap("icons/home.png"))
         tarrows = tb.AddLabelTool(105, "Show Arrows", wx.Bitmap("icons/left.png"))
+        tpreview = tb.AddLabelTool(106, "Burn Preview", wx.Bitmap("icons/burn.png"))
+        thotspots = tb.AddLabelTool(107, "Overburn", wx.Bitmap("icons/overburn.png"))
         self.Bind(wx.EVT_TOOL, app.on_file_open, topen)
         self.Bind(wx.EVT_TOOL, app.on_arrows_toggled, tarrows)
+        self.Bind(wx.EVT_TOOL, app.on_burn_preview_toggled, tpreview)
+        self.Bind(wx.EVT_TOOL, app.on_hotspots_toggled, thotspots)
         #self.Bind(wx.EVT_TOOL, app.on_file_open, topen)
         #self.
-        #tb.AddTool(106,wx.Bitmap("icons/right.png"))
-        #tb.AddTool(107,wx.Bitmap("icons/up.png"))
         #tb.AddTool(107,wx.Bitmap("icons/down.png"))
 
         tb.AddSeparator()   # Invisible spacer
@@ -1187,6 +1272,10 @@ class MainWindow(wx.Frame):
         for item in self.menu_items_file:
             item.Enable(enable)
 
+    def menu_enable_gcode_items(self, enable=True):
+        for item in self.menu_items_gcode:
+            item.Enable(enable)
+
     def update_recent_files_menu(self, recent_files):
         for menu_item in self.recent_files_menu.GetMenuItems():
             self.recent_files_menu.DeleteItem(menu_item)
@@ -1202,8 +1291,15 @@ class MainWindow(wx.Frame):
         self.recent_files_item.Enable(len(recent_files) > 0)
 
     def update_status(self, text):
+        self.status_text = text
         self.statusbar.SetStatusText(text)
 
+    def update_status_suffix(self, suffix):
+        """
+        Show suffix after the status text, e.g. to report progress.
+        """
+        self.statusbar.SetStatusText(self.status_text + suffix)
+
     def on_iconize(self, event):
         if not self.IsIconized():
             # call Layout() when the frame is unminimized; otherwise the window
@@ -1274,8 +1370,11 @@ class OpenErrorAlert(wx.MessageDialog):
 
 class SaveDialog(wx.FileDialog):
 
+    title    = 'Save As'
+    wildcard = 'STL files (*.stl)|*.stl'
+
     def __init__(self, parent, directory=None):
-        super(SaveDialog, self).__init__(parent, 'Save As', wildcard='STL files (*.stl)|*.stl',
+        super(SaveDialog, self).__init__(parent, self.title, wildcard=self.wildcard,
                 style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
 
         if directory is not None:
@@ -1287,6 +1386,18 @@ class SaveDialog(wx.FileDialog):
         return self.GetPath()
 
 
+class PreviewSaveDialog(SaveDialog):
+
+    title    = 'Export preview'
+    wildcard = 'PNG images (*.png)|*.png'
+
+
+class ContourSaveDialog(SaveDialog):
+
+    title    = 'Export contours'
+    wildcard = 'Gcode files (*.gcode)|*.gcode'
+
+
 class QuitDialog(wx.Dialog):
     RESPONSE_CANCEL  = 0
     RESPONSE_DISCARD = 1
@@ -1338,15 +1449,35 @@ class QuitDialog(wx.Dialog):
 
 
 class ProgressDialog(wx.ProgressDialog):
-
-    def __init__(self, text):
-        super(ProgressDialog, self).__init__('Loading', text, 100)
+    """
+    Progress of loading a file. Without wx.PD_APP_MODAL the rest of the
+    application stays usable; on_cancel is called when the user presses
+    the cancel button.
+    """
+    def __init__(self, text, on_cancel=None):
+        style = wx.PD_ELAPSED_TIME
+        if on_cancel is not None:
+            style |= wx.PD_CAN_ABORT
+        super(ProgressDialog, self).__init__('Loading', text, 100, style=style)
 
         self.value = 0
+        self.on_cancel = on_cancel
+
+    def step(self, count, limit, text=''):
+        """
+        Show count out of limit steps done, or activity if limit is None.
+        """
+        if limit is None:
+            result = self.Pulse(text)
+        else:
+            # stop short of the maximum, which would close the dialog or wait
+            # for the user to close it
+            self.value = max(0, min(int(count / limit * 100), 99))
+            result = self.Update(self.value, text)
 
-    def step(self, count, limit):
-        self.value = max(0, min(int(count / limit * 100), 100))
-        self.Update(self.value)
+        keep_going = result[0] if isinstance(result, tuple) else result
+        if not keep_going and self.on_cancel is not None:
+            self.on_cancel()
 
     def hide(self):
         self.Hide()
@@ -1375,14 +1506,29 @@ class AboutDialog(object):
 
 
 class BaseScene(glcanvas.GLCanvas):
+    # shortest time between two redraws in seconds, about one display refresh
+    FRAME_INTERVAL = 1 / 60
+
+    # milliseconds after the last drag or scroll event when the view is
+    # considered settled and drawn in full detail again
+    SETTLE_DELAY = 250
 
     def __init__(self, parent):
         super(BaseScene, self).__init__(parent, -1, size=(128, 128))
         self.Hide()
 
         self.initialized = False
+        self.interacting = False
         self.context = glcanvas.GLContext(self)
 
+        self._last_paint = 0.0
+        self._refresh_requested = False
+        self._uploading = False
+        self._redraw_timer = wx.Timer(self)
+        self._settle_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self._on_redraw_timer, self._redraw_timer)
+        self.Bind(wx.EVT_TIMER, self._on_settle_timer, self._settle_timer)
+
         self.Bind(wx.EVT_ERASE_BACKGROUND, self._on_erase_background)
         self.Bind(wx.EVT_SIZE,             self._on_size)
         self.Bind(wx.EVT_PAINT,            self._on_paint)
@@ -1398,14 +1544,44 @@ class BaseScene(glcanvas.GLCanvas):
         # wm would handle it for them)
         parent.Bind(wx.EVT_MOUSEWHEEL, self._on_mouse_wheel)
 
-        methods = ['init', 'display', 'reshape', 'button_press', 'button_motion', 'wheel_scroll']
+        methods = ['init', 'display', 'reshape', 'button_press', 'button_motion', 'wheel_scroll',
+                   'hover', 'upload_progress']
         for method in methods:
             if not hasattr(self, method):
                 raise Exception('Method %s() is not implemented' % method)
 
     def invalidate(self):
+        """
+        Schedule a redraw. Any number of calls before the next frame is due
+        result in a single redraw.
+        """
+        if self._refresh_requested or self._redraw_timer.IsRunning():
+            return
+
+        delay = self._last_paint + self.FRAME_INTERVAL - time.time()
+        if delay > 0:
+            self._redraw_timer.Start(int(delay * 1000) + 1, wx.TIMER_ONE_SHOT)
+        else:
+            self._refresh()
+
+    def _refresh(self):
+        self._refresh_requested = True
         self.Refresh(False)
 
+    def _on_redraw_timer(self, event):
+        self._refresh()
+
+    def begin_interaction(self):
+        """
+        Draw reduced detail until the view has not been moved for a while.
+        """
+        self.interacting = True
+        self._settle_timer.Start(self.SETTLE_DELAY, wx.TIMER_ONE_SHOT)
+
+    def _on_settle_timer(self, event):
+        self.interacting = False
+        self.invalidate()
+
     def _on_erase_background(self, event):
         pass # Do nothing, to avoid flashing on MSW. Doesn't seem to be working, though :(
 
@@ -1427,9 +1603,23 @@ class BaseScene(glcanvas.GLCanvas):
             self.initialized = True
 
         size = self.GetClientSize()
-        self.display(size.width, size.height)
-
-        self.SwapBuffers()
+        try:
+            self.display(size.width, size.height)
+            self.SwapBuffers()
+        finally:
+            # a frame that failed to draw must not keep later ones from
+            # being requested
+            self._last_paint = time.time()
+            self._refresh_requested = False
+
+        # keep drawing until vertex data has been uploaded in full, reporting
+        # progress until then and once when done
+        uploading = self.uploading
+        if uploading or self._uploading:
+            app.on_upload_progress(*self.upload_progress())
+        if uploading:
+            self.invalidate()
+        self._uploading = uploading
 
     def _on_mouse_down(self, event):
         self.SetFocus()
@@ -1443,12 +1633,39 @@ class BaseScene(glcanvas.GLCanvas):
         middle = event.MiddleIsDown()
         right  = event.RightIsDown()
 
+        if left or middle or right:
+            self.begin_interaction()
         self.button_motion(x, y, left, middle, right)
 
+        if not (left or middle or right):
+            self._update_tooltip(x, y)
+
+    def _update_tooltip(self, x, y):
+        tip = self.hover(x, y)
+        if tip:
+            self.SetToolTipString(tip)
+        else:
+            self.UnsetToolTip()
+
     def _on_mouse_wheel(self, event):
+        self.begin_interaction()
         self.wheel_scroll(event.GetWheelRotation())
 
 
+class Scene(SceneRenderer, BaseScene):
+    """
+    Scene drawn on a wx OpenGL canvas.
+    """
+    def __init__(self, parent):
+        BaseScene.__init__(self, parent)
+        SceneRenderer.__init__(self)
+
+    def close(self):
+        if self.initialized:
+            self.SetCurrent(self.context)
+        SceneRenderer.close(self)
+
+
 class BaseApp(wx.App):
 
     def __init__(self):
@@ -1463,6 +1680,12 @@ class BaseApp(wx.App):
     def process_ui_events(self):
         self.Yield()
 
+    def call_after(self, func, *args):
+        """
+        Call func on the UI thread; safe to use from other threads.
+        """
+        wx.CallAfter(func, *args)
+
     def set_wait_cursor(self):
         wx.SetCursor(wx.StockCursor(wx.CURSOR_WAIT))
 
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 Denis Kobozev
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Uploading vertex data to the graphics card over several frames.
+
+Buffers are allocated in full when first bound and filled from the front in
+chunks of bounded size, so that copying a large model does not stall a
+single frame. Items in the part of a buffer that has been filled can be
+drawn right away.
+"""
+
+from __future__ import division
+
+import numpy
+
+from OpenGL.GL import *
+from OpenGL.arrays.vbo import VBO
+
+
+class BufferUpload(object):
+    """
+    An array being copied into a vertex buffer object a number of rows at
+    a time.
+    """
+    def __init__(self, data, usage='GL_STATIC_DRAW', target='GL_ARRAY_BUFFER'):
+        self.data   = buffer_data(data, target)
+        self.length = len(self.data)
+        self.row_bytes = self.data.itemsize * int(numpy.prod(self.data.shape[1:]))
+
+        # storage is allocated without contents on the first bind
+        self.buffer = VBO(None, usage, target, size=self.data.nbytes)
+        self.rows   = 0
+
+    @property
+    def done(self):
+        return self.rows == self.length
+
+    @property
+    def remaining_bytes(self):
+        return (self.length - self.rows) * self.row_bytes
+
+    def copy(self, count):
+        """
+        Copy the next count rows to the buffer. Returns the number of bytes
+        copied.
+        """
+        chunk = self.data[self.rows:self.rows + count]
+        if len(chunk) > 0:
+            self.buffer.bind()
+            glBufferSubData(self.buffer.target, self.rows * self.row_bytes, chunk.nbytes, chunk)
+            self.buffer.unbind()
+            self.rows += len(chunk)
+
+        if self.done:
+            self.data = None # the buffer has its own copy now
+        return chunk.nbytes
+
+
+class UploadQueue(object):
+    """
+    Buffers to be filled in the order they were added.
+
+    Buffers added together form a group whose members advance by the same
+    number of rows, e.g. vertices and their colors, so that the same items
+    are complete in all of them.
+    """
+    def __init__(self):
+        self._groups = []
+        self.total_bytes = 0
+        self.done_bytes  = 0
+
+    def add(self, *arrays):
+        """
+        Queue arrays with the same number of rows for upload and return a
+        list of their vertex buffer objects.
+        """
+        group = [BufferUpload(data) for data in arrays]
+        if len(set(upload.length for upload in group)) > 1:
+            raise ValueError('Arrays uploaded together must have the same number of rows')
+        return self._add(group)
+
+    def add_indices(self, indices):
+        """
+        Queue vertex indices for upload to an element array buffer and
+        return the buffer.
+        """
+        return self._add([BufferUpload(indices, target='GL_ELEMENT_ARRAY_BUFFER')])[0]
+
+    def _add(self, group):
+        if not self._groups:
+            # progress is counted from the start of the current batch
+            self.total_bytes = self.done_bytes = 0
+        self._groups.append(group)
+        self.total_bytes += sum(upload.remaining_bytes for upload in group)
+        return [upload.buffer for upload in group]
+
+    @property
+    def pending(self):
+        return len(self._groups) > 0
+
+    def step(self, max_bytes):
+        """
+        Copy about max_bytes, at least one row, from the front of the queue.
+        Returns the number of bytes copied.
+        """
+        copied = 0
+        while self._groups and copied < max_bytes:
+            group = self._groups[0]
+            row_bytes = sum(upload.row_bytes for upload in group)
+            rows = max(1, (max_bytes - copied) // max(row_bytes, 1))
+            for upload in group:
+                copied += upload.copy(rows)
+            if group[0].done:
+                self._groups.pop(0)
+
+        self.done_bytes += copied
+        return copied
+
+    def finish(self):
+        """
+        Copy everything that is left.
+        """
+        while self._groups:
+            self.step(max(self.total_bytes - self.done_bytes, 1))
+
+    def resident_rows(self, buffer):
+        """
+        Return how many rows of buffer have been copied, or None if it is
+        not being uploaded, i.e. is complete.
+        """
+        for group in self._groups:
+            for upload in group:
+                if upload.buffer is buffer:
+                    return upload.rows
+        return None
+
+    def discard(self, buffers):
+        """
+        Stop uploading the groups any of buffers belong to, e.g. when they
+        are deleted or replaced. Returns True if any were being uploaded.
+        """
+        buffers = [buf for buf in buffers if buf is not None]
+        discarded = [group for group in self._groups
+                     if any(upload.buffer is buf for upload in group for buf in buffers)]
+        for group in discarded:
+            self._groups.remove(group)
+            self.total_bytes -= sum(upload.remaining_bytes for upload in group)
+        return len(discarded) > 0
+
+
+def buffer_data(data, target='GL_ARRAY_BUFFER'):
+    """
+    Return data as an array for a buffer of target: 32-bit indices for
+    element array buffers, otherwise 32-bit floats, except for bytes such as
+    packed normals.
+    """
+    data = numpy.asarray(data)
+    if target == 'GL_ELEMENT_ARRAY_BUFFER':
+        dtype = numpy.uint32
+    elif data.dtype == numpy.int8:
+        dtype = numpy.int8
+    else:
+        dtype = 'f'
+    return numpy.require(data, dtype, 'C')
+
+def clip_ranges(ranges, limit):
+    """
+    Clip ranges of items, given as arrays of start and end indices, to the
+    first limit items, dropping the ones that become empty.
+    """
+    starts, ends = ranges
+    ends = numpy.minimum(ends, limit)
+    keep = ends > starts
+    return starts[keep], ends[keep]
@@ -59,3 +59,54 @@ def rotate(vertices, angle, x, y, z):
     rotated = numpy.dot(vertices, matrix)
     return rotated
 
+
+# ----------------------------------------------------------------------------
+# 4x4 MATRICES
+#
+# The following functions return the same matrices the OpenGL functions of
+# the same name multiply the current matrix by. Matrices are meant to be
+# applied to column vectors, i.e. p' = numpy.dot(matrix, p).
+# ----------------------------------------------------------------------------
+
+def gl_translate(x, y, z):
+    matrix = numpy.identity(4)
+    matrix[:3, 3] = x, y, z
+    return matrix
+
+def gl_scale(x, y, z):
+    return numpy.diag([x, y, z, 1.0])
+
+def gl_rotate(angle, x, y, z):
+    norm = math.sqrt(x ** 2 + y ** 2 + z ** 2)
+    matrix = numpy.identity(4)
+    matrix[:3, :3] = rotation_matrix(angle, x / norm, y / norm, z / norm)
+    return matrix
+
+def gl_ortho(left, right, bottom, top, near, far):
+    matrix = numpy.identity(4)
+    matrix[0, 0] = 2 / (right - left)
+    matrix[1, 1] = 2 / (top - bottom)
+    matrix[2, 2] = -2 / (far - near)
+    matrix[:3, 3] = (-(right + left) / (right - left),
+                     -(top + bottom) / (top - bottom),
+                     -(far + near) / (far - near))
+    return matrix
+
+def glu_perspective(fovy, aspect, near, far):
+    f = 1 / math.tan(math.radians(fovy) / 2)
+    matrix = numpy.zeros((4, 4))
+    matrix[0, 0] = f / aspect
+    matrix[1, 1] = f
+    matrix[2, 2] = (far + near) / (near - far)
+    matrix[2, 3] = 2 * far * near / (near - far)
+    matrix[3, 2] = -1.0
+    return matrix
+
+def chain(*matrices):
+    """
+    Multiply matrices in the order OpenGL calls would apply them.
+    """
+    result = numpy.identity(4)
+    for matrix in matrices:
+        result = numpy.dot(result, matrix)
+    return result
@@ -18,9 +18,13 @@
 
 from __future__ import division
 
+import math
+
 from OpenGL.GL import *
 from OpenGL.GLU import *
-from OpenGL.GLUT import *
+
+from . import vector
+from .overlay import RotationCenterBead
 
 
 class ViewMode(object):
@@ -69,12 +73,45 @@ class ViewMode(object):
         """
         raise NotImplementedError('method not implemented')
 
+    def pixel_size(self):
+        """
+        Return the size of a screen pixel in model units at the center of
+        the scene.
+        """
+        raise NotImplementedError('method not implemented')
+
+    def projection_matrix(self):
+        """
+        Return the projection matrix set up by begin() and
+        display_transform() as a numpy array.
+        """
+        raise NotImplementedError('method not implemented')
+
+    def view_matrix(self):
+        """
+        Return the modelview matrix set up by display_transform() as a numpy
+        array.
+        """
+        raise NotImplementedError('method not implemented')
+
     def zoom(self, delta_x, delta_y):
         if delta_y > 0:
             self.zoom_factor = min(self.zoom_factor * 1.2, self.ZOOM_MAX)
         elif delta_y < 0:
             self.zoom_factor = max(self.zoom_factor * 0.83, self.ZOOM_MIN)
 
+    def zoom_to_fit(self, size, w, h):
+        """
+        Zoom so that an object of the given size at the center of the scene
+        spans the smaller dimension of a w by h viewport.
+        """
+        self.w, self.h = w, h
+        # pixel size is inversely proportional to the zoom factor
+        factor = self.pixel_size() * min(w, h) / size
+        self.w, self.h = None, None
+
+        self.zoom_factor = min(max(self.zoom_factor * factor, self.ZOOM_MIN), self.ZOOM_MAX)
+
 
 class View2D(ViewMode):
     """
@@ -135,10 +172,23 @@ class View2D(ViewMode):
         glOrtho(-x, x, -y, y, self.NEAR, self.FAR)
         glMatrixMode(GL_MODELVIEW)
 
+    def projection_matrix(self):
+        x, y = self.w / 2, self.h / 2
+        return vector.gl_ortho(-x, x, -y, y, self.NEAR, self.FAR)
+
+    def view_matrix(self):
+        f = self.zoom_factor
+        return vector.chain(vector.gl_translate(self.x, self.y, self.z),
+                            vector.gl_rotate(self.azimuth, 0.0, 0.0, 1.0),
+                            vector.gl_scale(f, f, f))
+
     def ui_transform(self, length):
         glTranslate(length + 20.0, length + 20.0, 0.0)
         glRotate(self.azimuth, 0.0, 0.0, 1.0)
 
+    def pixel_size(self):
+        return 1.0 / self.zoom_factor
+
     def rotate(self, delta_x, delta_y):
         self.azimuth += delta_x
 
@@ -176,11 +226,17 @@ class View3D(ViewMode):
         self.supports_ortho = True
         self.ortho          = False
 
+        self.show_rotation_center = True
+        self._bead = None
+
         self._save_vars.extend(['x', 'y', 'z', 'zoom_factor', 'azimuth',
                                 'elevation', 'offset_x', 'offset_y'])
         self.push_state()
 
+        self.w, self.h = None, None
+
     def begin(self, w, h):
+        self.w, self.h = w, h
         glMatrixMode(GL_PROJECTION)
         glPushMatrix()
         glLoadIdentity()
@@ -196,11 +252,21 @@ class View3D(ViewMode):
         glLoadIdentity()
 
     def end(self):
+        self.w, self.h = None, None
         glMatrixMode(GL_PROJECTION)
         glPopMatrix() # restore the projection matrix
         glMatrixMode(GL_MODELVIEW)
         glPopMatrix() # restore the modelview matrix
 
+    def pixel_size(self):
+        if self.ortho:
+            return 1.0 / (self.zoom_factor * self.ZOOM_ORTHO_ADJ)
+
+        # height of the view frustum at the distance of the rotation center
+        # divided by the height of the viewport in pixels
+        frustum_h = 2 * abs(self.y) * math.tan(math.radians(self.FOVY / 2))
+        return frustum_h / (max(self.h, 1) * self.zoom_factor)
+
     def display_transform(self):
         glRotate(-90, 1.0, 0.0, 0.0)  # make z point up
         glTranslate(0.0, self.y, 0.0) # move away from the displayed object
@@ -220,33 +286,32 @@ class View3D(ViewMode):
         self._draw_rotation_center_bead()
         glTranslate(self.offset_x, self.offset_y, 0)
 
+    def projection_matrix(self):
+        if self.ortho:
+            x, y = self.w / 2, self.h / 2
+            return vector.gl_ortho(-x, x, -y, y, -self.FAR, self.FAR)
+        return vector.glu_perspective(self.FOVY, self.w / self.h, self.NEAR, self.FAR)
+
+    def view_matrix(self):
+        f = self.zoom_factor
+        if self.ortho:
+            f *= self.ZOOM_ORTHO_ADJ
+
+        return vector.chain(vector.gl_rotate(-90, 1.0, 0.0, 0.0),
+                            vector.gl_translate(0.0, self.y, 0.0),
+                            vector.gl_scale(f, f, f),
+                            vector.gl_translate(self.x, 0.0, self.z),
+                            vector.gl_rotate(-self.elevation, 1.0, 0.0, 0.0),
+                            vector.gl_rotate(self.azimuth, 0.0, 0.0, 1.0),
+                            vector.gl_translate(self.offset_x, self.offset_y, 0))
+
     def _draw_rotation_center_bead(self):
-        glEnable(GL_LIGHTING)
-        glEnable(GL_LIGHT0)
-        glEnable(GL_LIGHT1)
-        glShadeModel(GL_SMOOTH)
-
-        # material properties (white plastic)
-        glMaterial(GL_FRONT, GL_AMBIENT, (0.0, 0.0, 0.0, 1.0))
-        glMaterial(GL_FRONT, GL_DIFFUSE, (0.55, 0.55, 0.55, 1.0))
-        glMaterial(GL_FRONT, GL_SPECULAR, (0.7, 0.7, 0.7, 1.0))
-        glMaterial(GL_FRONT, GL_SHININESS, 32.0)
-
-        # lights properties
-        glLight(GL_LIGHT0, GL_AMBIENT, (0.3, 0.3, 0.3, 1.0))
-        glLight(GL_LIGHT0, GL_DIFFUSE, (0.3, 0.3, 0.3, 1.0))
-        glLight(GL_LIGHT1, GL_DIFFUSE, (0.3, 0.3, 0.3, 1.0))
-
-        # lights position
-        glLightfv(GL_LIGHT0, GL_POSITION, (20.0, 20.0, 20.0))
-        glLightfv(GL_LIGHT1, GL_POSITION, (-20.0, -20.0, 20.0))
-
-        glColor(1.0, 0.0, 0.0)
-        glutSolidSphere(0.8, 100, 100)
-
-        glDisable(GL_LIGHT1)
-        glDisable(GL_LIGHT0)
-        glDisable(GL_LIGHTING)
+        if not self.show_rotation_center:
+            return
+
+        if self._bead is None:
+            self._bead = RotationCenterBead()
+        self._bead.draw()
 
     def ui_transform(self, length):
         glRotate(-90, 1.0, 0.0, 0.0) # make z point up
@@ -23,10 +23,11 @@ import os, os.path
 import logging
 
 from libtatlin.actors import Platform
-from libtatlin.scene import Scene
-from libtatlin.ui import load_icon, BaseApp, MainWindow, StlPanel, GcodePanel, XburnPanel, \
-        XburnPanel2, OpenDialog, OpenErrorAlert, ProgressDialog, SaveDialog, QuitDialog, AboutDialog
-from libtatlin.storage import ModelFile, ModelFileError
+from libtatlin.ui import load_icon, BaseApp, MainWindow, Scene, StlPanel, GcodePanel, XburnPanel, \
+        XburnPanel2, OpenDialog, OpenErrorAlert, ProgressDialog, SaveDialog, QuitDialog, AboutDialog, \
+        PreviewSaveDialog, ContourSaveDialog
+from libtatlin.storage import ModelFile
+from libtatlin.loader import ModelLoader, HotspotFinder
 from libtatlin.config import Config
 
 
@@ -118,8 +119,15 @@ Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
         self.panel2 = None
         self.scene = None
         self.model_file = None
+        self.loader = None
+        self.loader_preview = False
+        self.progress_dialog = None
+        self.hotspot_finder = HotspotFinder(self, self.call_after)
+        self.file_status = ''
         #TODO SETTINGS PROFILES
         self.arrows = 1
+        self.burn_preview = 0
+        self.hotspots = 1
         self.shades = 24
         self.wv = 240
         self.de = 3
@@ -149,6 +157,14 @@ Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
             'rotation-x':       self.model_rotation_x,
             'rotation-y':       self.model_rotation_y,
             'rotation-z':       self.model_rotation_z,
+            'analyzed':         lambda: self.scene.get_property('analyzed'),
+            'volume':           self.model_volume,
+            'area':             self.model_area,
+            'watertight':       self.model_watertight,
+            'open-edges':       self.model_open_edges,
+            'non-manifold-edges': self.model_non_manifold_edges,
+            'misoriented-edges': self.model_misoriented_edges,
+            'flipped-normals':  self.model_flipped_normals,
         }
 
     def show_window(self):
@@ -192,6 +208,29 @@ Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
         angle = self.scene.get_property('rotation-z')
         return format_float(angle)
 
+    def model_volume(self):
+        volume = self.scene.get_property('metrics').volume
+        return format_float(abs(volume))
+
+    def model_area(self):
+        area = self.scene.get_property('metrics').area
+        return format_float(area)
+
+    def model_watertight(self):
+        return 'yes' if self.scene.get_property('metrics').watertight else 'no'
+
+    def model_open_edges(self):
+        return str(self.scene.get_property('metrics').boundary_edges)
+
+    def model_non_manifold_edges(self):
+        return str(self.scene.get_property('metrics').non_manifold_edges)
+
+    def model_misoriented_edges(self):
+        return str(self.scene.get_property('metrics').misoriented_edges)
+
+    def model_flipped_normals(self):
+        return str(self.scene.get_property('metrics').flipped_normals)
+
     @property
     def current_dir(self):
         """
@@ -246,6 +285,38 @@ Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
             self.window.filename = stl_file.basename
             self.window.file_modified = False
 
+    def on_export_preview(self, event=None):
+        """
+        Save the burn preview of the displayed layer as a PNG image.
+        """
+        dialog = PreviewSaveDialog(self.window, self.current_dir)
+        fpath = dialog.get_path()
+        if fpath:
+            self.scene.export_burn_preview(fpath)
+
+    def on_export_contours(self, layer_height):
+        """
+        Save the contours of the model, sliced into layers, as G-code for
+        cutting them out with the laser.
+        """
+        try:
+            layer_height = float(layer_height)
+        except ValueError:
+            return # ignore invalid values
+        if layer_height <= 0:
+            return
+
+        dialog = ContourSaveDialog(self.window, self.current_dir)
+        fpath = dialog.get_path()
+        if fpath:
+            # G-code is shown shifted by the platform offsets, see place_model()
+            platform_offset = [self.config.read('machine.platform_offset_' + axis, float) or 0
+                               for axis in 'xy']
+            self.scene.export_contours(fpath, layer_height, platform_offset,
+                                       laseron=self.laseron, laseroff=self.laseroff,
+                                       burnrate=self.burnrate, skiprate=self.skiprate,
+                                       power=self.laserhigh, lasermod=self.lasermod)
+
     def on_quit(self, event=None):
         """
         On quit, write config settings and show a dialog proposing to save the
@@ -267,6 +338,7 @@ Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
             logging.warning('Could not write settings to config file %s' % self.config.fname)
 
         if self.save_changes_dialog():
+            self.cancel_loading()
             self.window.quit()
 
     def save_changes_dialog(self):
@@ -321,6 +393,10 @@ Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
     def on_layers_changed(self, layers):
         self.scene.change_num_layers(layers)
+        if self.model_file.filetype == 'gcode':
+            # overburn is checked for the displayed layer only, in the
+            # background
+            self.update_file_status(self.scene.model)
         self.scene.invalidate()
 
     def rotation_changed(self, axis, angle):
@@ -339,6 +415,16 @@ Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
         self.scene.invalidate()
         self.window.file_modified = self.scene.model_modified
 
+    def on_lay_flat(self):
+        """
+        Lay model flat on platform.
+        """
+        self.scene.lay_flat_model()
+        self.scene.invalidate()
+        self.panel.model_size_changed()
+        self.panel.model_angle_changed()
+        self.window.file_modified = self.scene.model_modified
+
     def on_arrows_toggled(self, value):
         """
         Show/hide arrows on the Gcode model.
@@ -349,6 +435,67 @@ Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
         self.scene.show_arrows(value)
         self.scene.invalidate()
 
+    def on_burn_preview_toggled(self, event=None):
+        """
+        Switch the 2D view between drawing lines and the burn preview image.
+        """
+        self.burn_preview = 0 if self.burn_preview else 1
+        self.scene.show_burn_preview(self.burn_preview)
+        self.scene.invalidate()
+
+    def on_hotspots_toggled(self, event=None):
+        """
+        Show/hide highlighted overburn areas on the Gcode model.
+        """
+        self.hotspots = 0 if self.hotspots else 1
+        self.scene.show_hotspots(self.hotspots)
+        if self.model_file.filetype == 'gcode':
+            # the check only runs while highlighting is on
+            self.update_file_status(self.scene.model)
+        self.scene.invalidate()
+
+    def check_overburn(self):
+        """
+        Start looking for areas of the displayed layer that receive more
+        energy than the configured threshold, and return what the status bar
+        shows until the summary is ready.
+        """
+        self.hotspot_finder.cancel()
+        if not self.hotspots:
+            return 'overburn check off'
+
+        watts = self.config.read('machine.laser_watts', float)
+        threshold = self.config.read('laser.overburn_threshold', float)
+        try:
+            power_scale = float(self.laserhigh)
+        except ValueError:
+            power_scale = 0
+
+        if power_scale <= 0:
+            return 'overburn check skipped'
+
+        model = self.scene.model
+        self.hotspot_finder.find(model, model.num_layers_to_draw - 1,
+                                 watts, power_scale, threshold)
+        return 'checking for overburn...'
+
+    def on_hotspots_found(self, model, layer_idx, hotspots):
+        # the file may have been closed or another one opened since
+        if self.scene is None or self.scene.model is not model:
+            return
+
+        self.scene.set_hotspots(hotspots, layer_idx)
+        self.scene.invalidate()
+        if hotspots.count == 0:
+            summary = 'no overburn, peak %.2f J/mm2' % hotspots.peak
+        else:
+            summary = 'overburn: %.1f mm2 above %.2f J/mm2, peak %.2f J/mm2' % (
+                hotspots.area, hotspots.threshold, hotspots.peak)
+        self.window.update_status(self.file_status + ' - ' + summary)
+
+    def on_hotspots_failed(self, error):
+        self.window.update_status(self.file_status + ' - overburn check failed')
+
     def on_reset_view(self):
         """
         Restore the view of the model shown on startup.
@@ -394,112 +541,172 @@ Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
         self.window.update_recent_files_menu(self.recent_files)
 
     def open_and_display_file(self, fpath, ftype=None):
-        self.set_wait_cursor()
-        progress_dialog_read = None
-        progress_dialog_load = None
-        success = True
-
-        try:
-            self.update_recent_files(fpath, ftype)
-            app.filename = fpath
-            os.system("cd ../xburn;python cli.py "+fpath+" "+str(app.width)+" -pa -s " +
-                str(app.shades) +" -wv "+ str(app.wv) + " -de "+ str(app.de))
-            fpath = "../xburn/workfile.gcode"
-            ftype = "gcode"
-            self.model_file = ModelFile(fpath, ftype)
-
-            self.scene = Scene(self.window)
-
-            progress_dialog_read = ProgressDialog('Reading file...')
-            model, model_data = self.model_file.read(progress_dialog_read.step)
+        """
+        Start loading a file in the background. The model is displayed once
+        loaded, or its first part earlier if it is large.
+        """
+        self.cancel_loading()
+        self.update_recent_files(fpath, ftype)
+        app.filename = fpath
+
+        command = ['python', 'cli.py', fpath, str(app.width), '-pa', '-s', str(app.shades),
+                   '-wv', str(app.wv), '-de', str(app.de)]
+        model_file = ModelFile('../xburn/workfile.gcode', 'gcode')
+
+        self.progress_dialog = ProgressDialog('Generating Gcode...', self.cancel_loading)
+        self.loader = ModelLoader(model_file, self, self.call_after, command, cwd='../xburn',
+                                  use_process=True)
+        self.loader_preview = False
+        self.loader.start()
+        return True
+
+    def cancel_loading(self):
+        if self.loader is not None:
+            self.loader.cancel()
+            self.finish_loading()
+
+    def finish_loading(self):
+        self.loader = None
+        if self.progress_dialog is not None:
+            self.progress_dialog.destroy()
+            self.progress_dialog = None
+
+    def on_load_progress(self, text, count, limit):
+        self.progress_dialog.step(count, limit, text)
+
+    def on_load_preview(self, model):
+        self.display_model(self.loader.model_file, model)
+        self.window.update_status(' %s - loading...' % self.model_file.basename)
+        self.loader_preview = True
+
+    def on_load_done(self, model):
+        model_file = self.loader.model_file
+        if self.loader_preview:
+            # keep the view the user may have changed while the rest loaded,
+            # and the model where the preview was, rather than centering it
+            # again now that it is larger
+            preview = self.scene.model
+            model.offset_x = preview.offset_x
+            model.offset_y = preview.offset_y
+            model.offset_z = preview.offset_z
+            self.scene.replace_model(model)
+            self.panel.set_initial_values()
+            self.scene.invalidate()
+        else:
+            self.display_model(model_file, model)
+        self.finish_loading()
+        self.update_file_status(model)
 
-            progress_dialog_load = ProgressDialog('Loading model...')
-            model.load_data(model_data, progress_dialog_load.step)
+    def on_load_analyzed(self, model):
+        # the file may have been closed or another one opened since
+        if self.scene is not None and self.scene.model is model:
+            self.panel.model_analyzed()
 
-            self.scene.clear()
-            self.scene.add_model(model)
+    def on_load_failed(self, error):
+        fpath = self.loader.model_file.path
+        self.finish_loading()
 
-            if self.model_file.filetype == 'gcode':
-                offset_x = self.config.read('machine.platform_offset_x', float)
-                offset_y = self.config.read('machine.platform_offset_y', float)
-                offset_z = self.config.read('machine.platform_offset_z', float)
+        if isinstance(error, IOError):
+            message = error.strerror
+        else:
+            message = error.message or str(error)
+        error_dialog = OpenErrorAlert(fpath, message)
+        error_dialog.show()
+
+    def on_upload_progress(self, done, total):
+        if done < total:
+            self.window.update_status_suffix(' - uploading to the graphics card %d%%' %
+                                             (100 * done // total))
+        else:
+            self.window.update_status_suffix('')
+
+    def display_model(self, model_file, model):
+        self.model_file = model_file
+
+        if self.scene is not None:
+            self.hotspot_finder.cancel()
+            self.scene.close()
+        self.scene = Scene(self.window)
+        self.scene.use_shaders = (self.config.read('ui.renderer') == 'shaders')
+        self.scene.layer_fade = self.config.read('ui.layer_fade', float)
+        self.scene.show_frame_stats = bool(self.config.read('ui.frame_stats', int))
+        frame_stats_log = self.config.read('ui.frame_stats_log')
+        if frame_stats_log:
+            self.scene.frame_stats.start_log(os.path.expanduser(frame_stats_log))
+
+        self.scene.clear()
+        self.scene.add_model(model)
+        self.place_model(model)
+
+        # platform needs to be added last to be translucent
+        platform_w = self.config.read('machine.platform_w', float)
+        platform_d = self.config.read('machine.platform_d', float)
+        platform = Platform(platform_w, platform_d)
+        self.scene.add_supporting_actor(platform)
+
+        self.panel = self.create_panel()
+        # update panel to reflect new model properties
+        self.panel.set_initial_values()
+        self.panel.connect_handlers()
+
+        self.panel2 = self.create_laser_panel()
+        self.panel2.set_initial_values(app.filename)
+
+
+        # always start with the same view on the scene
+        self.scene.reset_view(True)
+        if self.model_file.filetype == 'gcode':
+            self.scene.mode_2d = bool(self.config.read('ui.gcode_2d', int))
+            self.scene.show_burn_preview(self.burn_preview)
 
-                if offset_x is None and offset_y is None and offset_z is None:
-                    self.scene.view_model_center()
-                    logging.info('Platform offsets not set, showing model in the center')
-                else:
-                    model.offset_x = offset_x if offset_x is not None else 0
-                    model.offset_y = offset_y if offset_y is not None else 0
-                    model.offset_z = offset_z if offset_z is not None else 0
-                    logging.info('Using platform offsets: (%s, %s, %s)' % (
-                        model.offset_x, model.offset_y, model.offset_z))
-
-            # platform needs to be added last to be translucent
-            platform_w = self.config.read('machine.platform_w', float)
-            platform_d = self.config.read('machine.platform_d', float)
-            platform = Platform(platform_w, platform_d)
-            self.scene.add_supporting_actor(platform)
-
-            self.panel = self.create_panel()
-            # update panel to reflect new model properties
-            self.panel.set_initial_values()
-            self.panel.connect_handlers()
+        else:
+            self.scene.mode_2d = False
 
-            self.panel2 = self.create_laser_panel()
-            self.panel2.set_initial_values(app.filename)
+        if hasattr(self.panel, 'set_3d_view'):
+            self.panel.set_3d_view(not self.scene.mode_2d)
 
+        self.window.set_file_widgets(self.scene, self.panel, self.panel2)
+        self.window.filename = self.model_file.basename
+        self.window.file_modified = False
+        self.window.menu_enable_file_items(self.model_file.filetype != 'gcode')
+        self.window.menu_enable_gcode_items(self.model_file.filetype == 'gcode')
 
-            # always start with the same view on the scene
-            self.scene.reset_view(True)
-            if self.model_file.filetype == 'gcode':
-                self.scene.mode_2d = bool(self.config.read('ui.gcode_2d', int))
+    def place_model(self, model):
+        if self.model_file.filetype == 'gcode':
+            offset_x = self.config.read('machine.platform_offset_x', float)
+            offset_y = self.config.read('machine.platform_offset_y', float)
+            offset_z = self.config.read('machine.platform_offset_z', float)
 
+            if offset_x is None and offset_y is None and offset_z is None:
+                self.scene.view_model_center()
+                logging.info('Platform offsets not set, showing model in the center')
             else:
-                self.scene.mode_2d = False
-
-            if hasattr(self.panel, 'set_3d_view'):
-                self.panel.set_3d_view(not self.scene.mode_2d)
+                model.offset_x = offset_x if offset_x is not None else 0
+                model.offset_y = offset_y if offset_y is not None else 0
+                model.offset_z = offset_z if offset_z is not None else 0
+                logging.info('Using platform offsets: (%s, %s, %s)' % (
+                    model.offset_x, model.offset_y, model.offset_z))
+
+    def update_file_status(self, model):
+        if self.model_file.size > 2**30:
+            size = self.model_file.size / 2**30
+            units = 'GB'
+        elif self.model_file.size > 2**20:
+            size = self.model_file.size / 2**20
+            units = 'MB'
+        elif self.model_file.size > 2**10:
+            size = self.model_file.size / 2**10
+            units = 'KB'
+        else:
+            size = self.model_file.size
+            units = 'B'
 
-            self.window.set_file_widgets(self.scene, self.panel, self.panel2)
-            self.window.filename = self.model_file.basename
-            self.window.file_modified = False
-            self.window.menu_enable_file_items(self.model_file.filetype != 'gcode')
-
-
-            if self.model_file.size > 2**30:
-                size = self.model_file.size / 2**30
-                units = 'GB'
-            elif self.model_file.size > 2**20:
-                size = self.model_file.size / 2**20
-                units = 'MB'
-            elif self.model_file.size > 2**10:
-                size = self.model_file.size / 2**10
-                units = 'KB'
-            else:
-                size = self.model_file.size
-                units = 'B'
-
-            vertex_plural = 'vertex' if int(str(model.vertex_count)[-1]) == 1 else 'vertices'
-            self.window.update_status(' %s (%.1f%s, %d %s)' % (
-                self.model_file.basename, size, units, model.vertex_count, vertex_plural))
-        except IOError, e:
-            self.set_normal_cursor()
-            error_dialog = OpenErrorAlert(fpath, e.strerror)
-            error_dialog.show()
-            success = False
-        except ModelFileError, e:
-            self.set_normal_cursor()
-            error_dialog = OpenErrorAlert(fpath, e.message)
-            error_dialog.show()
-            success = False
-        finally:
-            if progress_dialog_read:
-                progress_dialog_read.destroy()
-            if progress_dialog_load:
-                progress_dialog_load.destroy()
-            self.set_normal_cursor()
-
-        return success
+        vertex_plural = 'vertex' if int(str(model.vertex_count)[-1]) == 1 else 'vertices'
+        status = self.file_status = ' %s (%.1f%s, %d %s)' % (
+            self.model_file.basename, size, units, model.vertex_count, vertex_plural)
+        if self.model_file.filetype == 'gcode':
+            status += ' - ' + self.check_overburn()
+        self.window.update_status(status)
 
     def create_panel(self):
         if self.model_file.filetype == 'gcode':
@@ -0,0 +1,108 @@
+import os
+import unittest
+import numpy
+from libtatlin import analysis, mesh, vector
+from libtatlin.storage import ModelFile
+from libtatlin.actors import StlModel
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def cube_facets():
+    """Two triangles per face of a unit cube, counter-clockwise outside."""
+    corners = numpy.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)], 'f')
+    quads = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+    triangles = [t for a, b, c, d in quads for t in ((a, b, c), (a, c, d))]
+    return corners[numpy.array(triangles)]
+
+
+class AnalyzeTest(unittest.TestCase):
+
+    def test_closed_cube(self):
+        facets = cube_facets()
+        metrics = analysis.analyze(facets.reshape(-1, 3), normals=mesh.facet_normals(facets))
+        self.assertEqual(metrics.facet_count, 12)
+        self.assertAlmostEqual(metrics.volume, 1)
+        self.assertAlmostEqual(metrics.area, 6)
+        self.assertTrue(metrics.watertight)
+        self.assertEqual(metrics.misoriented_edges, 0)
+        self.assertEqual(metrics.flipped_normals, 0)
+        self.assertEqual(metrics.degenerate_facets, 0)
+
+    def test_inside_out(self):
+        metrics = analysis.analyze(cube_facets()[:, ::-1].reshape(-1, 3))
+        self.assertAlmostEqual(metrics.volume, -1)
+        self.assertTrue(metrics.watertight)
+
+    def test_open(self):
+        metrics = analysis.analyze(cube_facets()[1:].reshape(-1, 3))
+        self.assertFalse(metrics.watertight)
+        self.assertEqual(metrics.boundary_edges, 3)
+        self.assertEqual(metrics.non_manifold_edges, 0)
+
+    def test_non_manifold(self):
+        facets = cube_facets()
+        metrics = analysis.analyze(numpy.concatenate([facets, facets[:1]]).reshape(-1, 3))
+        self.assertFalse(metrics.watertight)
+        self.assertEqual(metrics.boundary_edges, 0)
+        self.assertEqual(metrics.non_manifold_edges, 3)
+
+    def test_flipped_facet(self):
+        facets = cube_facets()
+        normals = mesh.facet_normals(facets)
+        facets[0] = facets[0, ::-1]
+        metrics = analysis.analyze(facets.reshape(-1, 3), normals=normals)
+        self.assertTrue(metrics.watertight)
+        self.assertEqual(metrics.misoriented_edges, 3)
+        self.assertEqual(metrics.flipped_normals, 1)
+
+    def test_degenerate(self):
+        facets = cube_facets()
+        facets[0, 2] = facets[0, 1]
+        metrics = analysis.analyze(facets.reshape(-1, 3))
+        self.assertEqual(metrics.degenerate_facets, 1)
+
+    def test_indexed(self):
+        vertices = cube_facets().reshape(-1, 3)
+        kept, indices = mesh.weld(vertices, 1e-4)
+        soup = analysis.analyze(vertices)
+        indexed = analysis.analyze(vertices[kept], indices)
+        self.assertEqual(indexed.__dict__, soup.__dict__)
+
+    def test_transformed(self):
+        metrics = analysis.analyze(cube_facets().reshape(-1, 3))
+        matrix = numpy.dot(vector.gl_rotate(30, 1, 0, 0), vector.gl_scale(2, 2, 2))
+        scaled = metrics.transformed(matrix)
+        self.assertAlmostEqual(scaled.volume, 8, places=5)
+        self.assertAlmostEqual(scaled.area, 24, places=5)
+        self.assertEqual(scaled.boundary_edges, metrics.boundary_edges)
+
+
+class StlMetricsTest(unittest.TestCase):
+
+    def load(self, **kwargs):
+        model_file = ModelFile(os.path.join(DATA_DIR, 'stl', 'top.stl'))
+        model = StlModel(**kwargs)
+        model.load_data(model_file.read()[1])
+        return model
+
+    def test_top(self):
+        metrics = self.load().metrics()
+        self.assertTrue(metrics.watertight)
+        self.assertEqual(metrics.misoriented_edges, 0)
+        self.assertEqual(metrics.flipped_normals, 0)
+        self.assertGreater(metrics.volume, 0)
+
+    def test_welded_matches_soup(self):
+        soup = self.load().metrics()
+        for smooth_normals in (False, True):
+            welded = self.load(weld_tolerance=1e-4, smooth_normals=smooth_normals).metrics()
+            self.assertAlmostEqual(welded.volume, soup.volume, places=2)
+            self.assertEqual(welded.boundary_edges, soup.boundary_edges)
+            self.assertEqual(welded.non_manifold_edges, soup.non_manifold_edges)
+
+    def test_scaled(self):
+        model = self.load()
+        volume = model.metrics().volume
+        model.scale(2)
+        self.assertAlmostEqual(model.metrics().volume / volume, 8, places=5)
@@ -0,0 +1,66 @@
+import unittest
+import numpy
+from libtatlin.culling import Frustum, ChunkTree, build_layer_chunks
+
+
+def box_frustum(x0, y0, x1, y1):
+    """Return a frustum that sees the rectangle x0, y0 - x1, y1 from above."""
+    return Frustum([
+        [1, 0, 0, -x0], [-1, 0, 0, x1],
+        [0, 1, 0, -y0], [0, -1, 0, y1],
+    ])
+
+
+class CullingTest(unittest.TestCase):
+
+    def test_frustum_from_matrices(self):
+        # identity transformation sees the -1..1 cube
+        frustum = Frustum.from_matrices(numpy.identity(4), numpy.identity(4))
+        lower = numpy.array([[0.0, 0.0, 0.0], [2.0, 2.0, 0.0], [-5.0, -5.0, -5.0]])
+        upper = numpy.array([[0.5, 0.5, 0.5], [3.0, 3.0, 0.0], [5.0, 5.0, 5.0]])
+        visible, contained = frustum.test(lower, upper)
+
+        self.assertEqual(list(visible), [True, False, True])
+        self.assertEqual(list(contained), [True, False, False])
+
+    def test_tree_ranges_are_contiguous(self):
+        points = numpy.random.RandomState(0).uniform(0, 100, (1000, 3)).astype('f')
+        tree = ChunkTree(points, points, leaf_size=16)
+        points = points[tree.order]
+
+        for node, (start, end) in enumerate(zip(tree.starts, tree.ends)):
+            self.assertTrue((points[start:end] >= tree.lower[node]).all())
+            self.assertTrue((points[start:end] <= tree.upper[node]).all())
+
+        # a view of everything is a single range
+        starts, ends = tree.visible_ranges(box_frustum(0, 0, 100, 100))
+        self.assertEqual(zip(starts, ends), [(0, 1000)])
+
+        # a view of a corner only contains points near it
+        starts, ends = tree.visible_ranges(box_frustum(0, 0, 10, 10))
+        shown = numpy.concatenate([numpy.arange(s, e) for s, e in zip(starts, ends)])
+        inside = numpy.flatnonzero((points[:, 0] <= 10) & (points[:, 1] <= 10))
+        self.assertTrue(set(inside) <= set(shown))
+        self.assertTrue(len(shown) < 200)
+
+    def test_layer_chunks(self):
+        vertices = numpy.array([
+            [0, 0, 0], [1, 0, 0],
+            [50, 0, 0], [51, 0, 0],
+            [0, 0, 1], [1, 0, 1],
+        ], 'f')
+        order, chunks = build_layer_chunks(vertices, [0, 4, 6], leaf_size=1)
+        self.assertEqual(sorted(order), [0, 1, 2])
+        self.assertEqual(order[2], 2)
+
+        visible = chunks.visible_leaves(box_frustum(-1, -1, 2, 1))
+        self.assertEqual(zip(*chunks.layer_ranges(visible, 0, 2)), [(0, 1), (2, 3)])
+        self.assertEqual(zip(*chunks.layer_ranges(visible, 1, 2)), [(2, 3)])
+        self.assertEqual(zip(*chunks.layer_ranges(visible, 0, 2, reverse=True)), [(2, 3), (0, 1)])
+
+        visible[:] = True
+        self.assertEqual(zip(*chunks.layer_ranges(visible, 0, 2)), [(0, 3)])
+
+
+if __name__ == '__main__':
+    unittest.main()
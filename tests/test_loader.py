@@ -0,0 +1,190 @@
+import os
+import unittest
+from libtatlin.gcodeparser import GcodeParser
+from libtatlin.storage import ModelFile
+from libtatlin.loader import ModelLoader, HotspotFinder
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+class Listener(object):
+
+    def __init__(self):
+        self.loader   = None
+        self.progress = []
+        self.previews = []
+        self.models   = []
+        self.analyzed = []
+        self.errors   = []
+        self.cancel_after = None
+
+    def on_load_progress(self, text, count, limit):
+        self.progress.append((text, count, limit))
+        if self.cancel_after is not None and len(self.progress) >= self.cancel_after:
+            self.loader.cancel()
+
+    def on_load_preview(self, model):
+        self.previews.append(model)
+
+    def on_load_done(self, model):
+        self.models.append(model)
+
+    def on_load_analyzed(self, model):
+        self.analyzed.append(model)
+
+    def on_load_failed(self, error):
+        self.errors.append(error)
+
+
+def post(func, *args):
+    func(*args)
+
+
+class ModelLoaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.preview_movements = GcodeParser.PREVIEW_MOVEMENTS
+        GcodeParser.PREVIEW_MOVEMENTS = 500
+
+    def tearDown(self):
+        GcodeParser.PREVIEW_MOVEMENTS = self.preview_movements
+
+    def load(self, fname, listener, use_process=False):
+        model_file = ModelFile(os.path.join(DATA_DIR, os.path.splitext(fname)[1][1:], fname))
+        listener.loader = ModelLoader(model_file, listener, post, use_process=use_process)
+        listener.loader.start()
+        listener.loader.wait(30)
+        return listener
+
+    def test_load(self):
+        listener = self.load('top.gcode', Listener())
+
+        self.assertEqual(listener.errors, [])
+        self.assertEqual(len(listener.models), 1)
+        self.assertEqual(len(listener.previews), 1)
+        self.assertEqual(listener.previews[0].vertex_count, 2 * (500 - 1))
+        self.assertTrue(listener.models[0].vertex_count > listener.previews[0].vertex_count)
+
+        stages = set(text for text, count, limit in listener.progress)
+        self.assertEqual(stages, set(['Reading file...', 'Loading model...']))
+
+    def test_load_in_process(self):
+        listener = self.load('top.gcode', Listener(), use_process=True)
+        self.assertEqual(listener.errors, [])
+        self.assertEqual(len(listener.previews), 1)
+        model = listener.models[0]
+
+        expected = self.load('top.gcode', Listener()).models[0]
+        self.assertEqual(model.vertex_count, expected.vertex_count)
+        self.assertEqual(model.layer_stops, expected.layer_stops)
+        self.assertTrue((model.vertices == expected.vertices).all())
+
+        path = model.shared_arrays.path
+        self.assertTrue(os.path.exists(path))
+        model.delete()
+        self.assertIsNone(model.shared_arrays)
+        self.assertFalse(os.path.exists(path))
+        listener.previews[0].delete()
+
+    def test_analyze(self):
+        # STL models are analyzed in the worker once they are handed over
+        for use_process in (False, True):
+            listener = self.load('top.stl', Listener(), use_process=use_process)
+            self.assertEqual(listener.errors, [])
+            self.assertEqual(listener.analyzed, listener.models)
+            model = listener.models[0]
+            self.assertTrue(model.local_metrics.watertight)
+            model.delete()
+
+        listener = self.load('top.gcode', Listener())
+        self.assertEqual(listener.analyzed, [])
+
+    def test_cancel(self):
+        listener = Listener()
+        listener.cancel_after = 1
+        self.load('top.gcode', listener)
+
+        self.assertEqual(len(listener.progress), 1)
+        self.assertEqual(listener.previews, [])
+        self.assertEqual(listener.models, [])
+        self.assertEqual(listener.errors, [])
+
+    def test_missing_file(self):
+        listener = self.load('missing.gcode', Listener())
+
+        self.assertEqual(listener.models, [])
+        self.assertEqual(len(listener.errors), 1)
+        self.assertIsInstance(listener.errors[0], IOError)
+
+        listener = self.load('missing.gcode', Listener(), use_process=True)
+        self.assertEqual(len(listener.errors), 1)
+        self.assertIsInstance(listener.errors[0], IOError)
+
+
+
+class HotspotListener(object):
+
+    def __init__(self):
+        self.found  = []
+        self.errors = []
+
+    def on_hotspots_found(self, model, layer_idx, hotspots):
+        self.found.append((model, layer_idx, hotspots))
+
+    def on_hotspots_failed(self, error):
+        self.errors.append(error)
+
+
+class HotspotFinderTest(unittest.TestCase):
+
+    def setUp(self):
+        model_file = ModelFile(os.path.join(DATA_DIR, 'gcode', 'top.gcode'))
+        self.model, model_data = model_file.read()
+        self.model.load_data(model_data)
+        self.listener = HotspotListener()
+        # calls are run later, the way the UI thread would
+        self.posted = []
+        self.finder = HotspotFinder(self.listener,
+                                    lambda func, *args: self.posted.append((func, args)))
+
+    def deliver(self):
+        self.finder.wait(30)
+        for func, args in self.posted:
+            func(*args)
+
+    def test_find(self):
+        self.finder.find(self.model, 3, 5.0, 255, 1.0)
+        self.deliver()
+
+        self.assertEqual(len(self.listener.found), 1)
+        model, layer_idx, hotspots = self.listener.found[0]
+        self.assertTrue(model is self.model)
+        self.assertEqual(layer_idx, 3)
+        self.assertTrue(hotspots is self.model.layer_hotspots(3, 5.0, 255, 1.0))
+        self.assertTrue(hotspots.peak > 0)
+
+    def test_latest_request_wins(self):
+        for layer_idx in range(5):
+            self.finder.find(self.model, layer_idx, 5.0, 255, 1.0)
+        self.deliver()
+
+        self.assertEqual([found[1] for found in self.listener.found], [4])
+
+    def test_cancel(self):
+        self.finder.find(self.model, 3, 5.0, 255, 1.0)
+        self.finder.cancel()
+        self.deliver()
+
+        self.assertEqual(self.listener.found, [])
+
+    def test_failure(self):
+        self.finder.find(self.model, len(self.model.layer_stops), 5.0, 255, 1.0)
+        self.deliver()
+
+        self.assertEqual(self.listener.found, [])
+        self.assertEqual(len(self.listener.errors), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
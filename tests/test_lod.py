@@ -0,0 +1,104 @@
+import unittest
+import numpy
+from libtatlin.lod import simplify, build_detail_levels, choose_level, segment_layers
+from libtatlin.gcodeparser import GcodeParser
+from libtatlin.actors import GcodeModel
+
+
+def scanline(n, step, y=0.0, color=(0.0, 0.0, 0.0, 0.5)):
+    """Return a connected run of n segments along the x axis."""
+    xs = numpy.arange(n + 1) * step
+    points = numpy.zeros((n + 1, 3), 'f')
+    points[:, 0] = xs
+    points[:, 1] = y
+    vertices = numpy.empty((n * 2, 3), 'f')
+    vertices[0::2] = points[:-1]
+    vertices[1::2] = points[1:]
+    colors = numpy.array([color] * n, 'f')
+    return vertices, colors
+
+
+class LodTest(unittest.TestCase):
+
+    def test_segment_layers(self):
+        layers = segment_layers([0, 4, 4, 10])
+        self.assertEqual(list(layers), [0, 0, 2, 2, 2])
+
+    def test_same_color_run_merges(self):
+        vertices, colors = scanline(100, 0.1)
+        level = simplify(vertices, colors, [0, len(vertices)], 1.0)
+
+        self.assertEqual(level.vertex_count, 2)
+        self.assertAlmostEqual(level.vertices[0][0], 0.0)
+        self.assertAlmostEqual(level.vertices[1][0], 10.0, places=4)
+        self.assertEqual(level.layer_stops, [0, 2])
+
+    def test_colors_are_averaged(self):
+        vertices, colors = scanline(4, 0.1)
+        colors[:2, 3] = 0.0
+        colors[2:, 3] = 1.0
+        level = simplify(vertices, colors, [0, len(vertices)], 1.0)
+
+        self.assertEqual(level.vertex_count, 2)
+        self.assertAlmostEqual(level.colors[0][3], 0.5)
+
+    def test_layers_are_kept_apart(self):
+        v1, c1 = scanline(10, 0.1, y=0.0)
+        v2, c2 = scanline(10, 0.1, y=0.0)
+        v2[:, 2] = 0.2
+        vertices = numpy.concatenate([v1, v2])
+        colors = numpy.concatenate([c1, c2])
+
+        level = simplify(vertices, colors, [0, 20, 40], 5.0)
+        self.assertEqual(level.layer_stops, [0, 2, 4])
+
+    def test_disconnected_segments_survive(self):
+        v1, c1 = scanline(1, 0.01, y=0.0)
+        v2, c2 = scanline(1, 0.01, y=3.0)
+        vertices = numpy.concatenate([v1, v2])
+        colors = numpy.concatenate([c1, c2])
+
+        level = simplify(vertices, colors, [0, 4], 1.0)
+        self.assertEqual(level.vertex_count, 4)
+
+    def test_build_and_choose(self):
+        vertices, colors = scanline(1000, 0.05)
+        colors[::2, 3] = 0.2
+        levels = build_detail_levels(vertices, colors, [0, len(vertices)])
+
+        self.assertTrue(len(levels) > 0)
+        counts = [level.vertex_count for level in levels]
+        self.assertEqual(counts, sorted(counts, reverse=True))
+
+        self.assertEqual(choose_level(levels, 0.0), -1)
+        self.assertEqual(choose_level(levels, 1000.0), len(levels) - 1)
+
+
+def raster_gcode(rows, columns, step=0.1):
+    """Return an engraving job: rows of short burns with varying power."""
+    lines = ['G21', 'G90', 'M3']
+    for row in range(rows):
+        y = row * step
+        lines.append('G0 X0 Y%.3f F3000' % y)
+        for column in range(1, columns + 1):
+            lines.append('G1 X%.3f Y%.3f S%d F800' % (column * step, y, 1 + (column * 7) % 255))
+    lines.append('M5')
+    return '\n'.join(lines) + '\n'
+
+
+class GcodeModelLodTest(unittest.TestCase):
+
+    def test_raster_job_has_detail_levels(self):
+        parser = GcodeParser()
+        parser.load(raster_gcode(100, 200))
+        model = GcodeModel()
+        model.load_data(parser.parse())
+        # chunking reorders movements, which must not stop the rows from
+        # merging into a few segments each
+        self.assertTrue(len(model.detail_levels) > 0)
+        self.assertLess(model.detail_levels[0].vertex_count, len(model.vertices) // 4)
+        self.assertEqual(len(model.detail_chunks), len(model.detail_levels))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,239 @@
+import os
+import unittest
+import numpy
+from libtatlin import mesh, vector
+from libtatlin.storage import ModelFile
+from libtatlin.actors import StlModel
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def cube_facets():
+    """Two triangles per face of a unit cube, counter-clockwise outside."""
+    corners = numpy.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)], 'f')
+    quads = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+    triangles = [t for a, b, c, d in quads for t in ((a, b, c), (a, c, d))]
+    return corners[numpy.array(triangles)]
+
+
+class WeldTest(unittest.TestCase):
+
+    def test_weld_cube(self):
+        vertices = cube_facets().reshape(-1, 3)
+        kept, indices = mesh.weld(vertices, 1e-4)
+        self.assertEqual(len(kept), 8)
+        self.assertEqual(indices.dtype, numpy.uint32)
+        numpy.testing.assert_array_equal(vertices[kept][indices], vertices)
+        # kept vertices are numbered in order of appearance
+        self.assertEqual(list(indices[:3]), [0, 1, 2])
+
+    def test_tolerance(self):
+        vertices = numpy.array([[0, 0, 0], [1e-6, 0, 0], [1, 0, 0]], 'f')
+        kept, indices = mesh.weld(vertices, 1e-4)
+        self.assertEqual(list(kept), [0, 2])
+        self.assertEqual(list(indices), [0, 0, 1])
+
+    def test_keep_normals_apart(self):
+        facets = cube_facets()
+        vertices = facets.reshape(-1, 3)
+        normals = mesh.facet_normals(facets).repeat(3, 0)
+        kept, indices = mesh.weld(vertices, 1e-4, normals)
+        self.assertEqual(len(kept), 24) # four corners for each face
+        numpy.testing.assert_array_equal(normals[kept][indices], normals)
+
+    def test_vertex_normals(self):
+        vertices = cube_facets().reshape(-1, 3)
+        kept, indices = mesh.weld(vertices, 1e-4)
+        normals = mesh.vertex_normals(vertices[kept], indices)
+        numpy.testing.assert_allclose(numpy.linalg.norm(normals, axis=1), 1.0, rtol=1e-5)
+        # corner normals point away from the center
+        outwards = vertices[kept] - 0.5
+        self.assertTrue(((normals * outwards).sum(1) > 0).all())
+
+    def test_degenerate_facet_normal(self):
+        facets = numpy.zeros((1, 3, 3), 'f')
+        numpy.testing.assert_array_equal(mesh.facet_normals(facets), [[0, 0, 0]])
+
+
+class IndexedStlModelTest(unittest.TestCase):
+
+    def load(self, **kwargs):
+        model_file = ModelFile(os.path.join(DATA_DIR, 'stl', 'top.stl'), **kwargs)
+        model, model_data = model_file.read()
+        model.load_data(model_data)
+        return model
+
+    def test_same_facets(self):
+        soup = self.load()
+        indexed = self.load(weld_tolerance=1e-4)
+        self.assertLess(len(indexed.vertices), len(soup.vertices))
+        self.assertEqual(indexed.facet_count, soup.facet_count)
+        numpy.testing.assert_array_equal(indexed.facets(), soup.facets())
+        numpy.testing.assert_allclose(indexed.facet_normals(), soup.facet_normals(),
+                                      atol=mesh.NORMAL_TOLERANCE)
+
+    def test_no_duplicates(self):
+        vertices = self.load(weld_tolerance=1e-4, smooth_normals=True).vertices
+        self.assertEqual(len(mesh.unique_rows(vertices)), len(vertices))
+
+    def test_smooth_normals(self):
+        soup = self.load()
+        indexed = self.load(weld_tolerance=1e-4, smooth_normals=True)
+        self.assertLess(len(indexed.vertices), len(soup.vertices) // 3)
+        self.assertEqual(len(indexed.normals), len(indexed.vertices))
+        numpy.testing.assert_allclose(numpy.linalg.norm(indexed.facet_normals(), axis=1), 1.0,
+                                      rtol=1e-5)
+
+
+class NormalsTest(unittest.TestCase):
+
+    def test_missing_normals(self):
+        facets = cube_facets()
+        facets[1] = facets[1, 0] # degenerate
+        normals = mesh.facet_normals(facets)
+        given = normals.copy()
+        given[2] = 0
+        given[3] = numpy.nan
+
+        for data_normals, expected in ((given, normals), (numpy.zeros_like(normals), normals)):
+            model = StlModel()
+            model.load_data((facets.reshape(-1, 3), data_normals))
+            self.assertEqual(model.normals.shape, (len(facets), 3))
+            numpy.testing.assert_allclose(model.facet_normals(), expected, atol=1e-6)
+
+    def test_pack_normals(self):
+        normals = mesh.facet_normals(cube_facets())
+        packed = mesh.pack_normals(normals)
+        self.assertEqual(packed.dtype, numpy.int8)
+        self.assertEqual(packed.shape, (len(normals), 4))
+        numpy.testing.assert_allclose(packed[:, :3] / 127.0, normals, atol=0.5 / 127)
+
+
+class HullTest(unittest.TestCase):
+
+    def test_cube(self):
+        rng = numpy.random.RandomState(0)
+        corners = cube_facets().reshape(-1, 3)
+        points = numpy.concatenate([rng.rand(1000, 3), corners])
+        vertices, faces = mesh.convex_hull(points)
+        self.assertEqual(sorted(map(tuple, vertices)), sorted(set(map(tuple, corners))))
+        self.assertEqual(len(faces), 12)
+
+        # every face has the other points behind it
+        facets = vertices[faces]
+        normals = numpy.cross(facets[:, 1] - facets[:, 0], facets[:, 2] - facets[:, 0])
+        heights = numpy.dot(points, normals.T) - (normals * facets[:, 0]).sum(1)
+        self.assertTrue((heights < 1e-9).all())
+
+    def test_flat(self):
+        points = numpy.random.RandomState(0).rand(100, 3)
+        points[:, 2] = 1.0
+        self.assertRaises(ValueError, mesh.convex_hull, points)
+
+    def test_extreme_points(self):
+        model, data = ModelFile(os.path.join(DATA_DIR, 'stl', 'top.stl')).read()
+        model.load_data(data)
+        points = mesh.extreme_points(model.vertices)
+        self.assertTrue(len(points) < len(model.vertices) // 5)
+
+        matrix = numpy.dot(vector.gl_rotate(30, 1, 0, 0), vector.gl_rotate(50, 0, 1, 1))
+        for expected, found in zip(mesh.transformed_bounds(model.vertices, matrix),
+                                   mesh.transformed_bounds(points, matrix)):
+            self.assertTrue(numpy.allclose(expected, found, atol=1e-5))
+
+    def test_enclosing_points(self):
+        # every point of a sphere is on its hull, too many to compute it
+        rng = numpy.random.RandomState(0)
+        sphere = rng.randn(mesh.MAX_HULL_POINTS * 20, 3).astype('f')
+        sphere *= 10 / numpy.sqrt((sphere ** 2).sum(1))[:, None]
+        points = mesh.extreme_points(sphere)
+        self.assertTrue(len(points) <= 4 * len(mesh.ENCLOSING_DIRECTIONS))
+
+        matrix = numpy.dot(vector.gl_rotate(30, 1, 0, 0), vector.gl_rotate(50, 0, 1, 1))
+        lower, upper = mesh.transformed_bounds(sphere, matrix)
+        found_lower, found_upper = mesh.transformed_bounds(points, matrix)
+        self.assertTrue((found_lower <= lower).all() and (found_upper >= upper).all())
+        self.assertTrue(numpy.allclose(lower, found_lower, atol=0.5))
+        self.assertTrue(numpy.allclose(upper, found_upper, atol=0.5))
+
+
+class RestingTest(unittest.TestCase):
+
+    def box_hull(self):
+        corners = cube_facets().reshape(-1, 3) * [4, 2, 1]
+        return mesh.convex_hull(corners)
+
+    def test_hull_centroid(self):
+        self.assertTrue(numpy.allclose(mesh.hull_centroid(*self.box_hull()), [2, 1, 0.5]))
+
+    def test_largest_face(self):
+        # both large faces are as good, the one facing down wins
+        normal = mesh.resting_normal(*self.box_hull())
+        self.assertTrue(numpy.allclose(normal, [0, 0, -1]))
+        normal = mesh.resting_normal(*self.box_hull(), down=(0, 0, 1))
+        self.assertTrue(numpy.allclose(normal, [0, 0, 1]))
+
+    def test_tips_over(self):
+        points = numpy.array([[1, 3, 4], [12, 1, 4], [11, 1, 2],
+                              [17, 0, 2], [13, 4, 0], [10, 3, 3]], 'd')
+        vertices, faces = mesh.convex_hull(points)
+        facets = vertices[faces]
+        normals = numpy.cross(facets[:, 1] - facets[:, 0], facets[:, 2] - facets[:, 0])
+        lengths = numpy.sqrt((normals * normals).sum(1))
+        # the largest face has the center beyond its edge
+        largest = normals[lengths.argmax()] / lengths.max()
+        normal = mesh.resting_normal(vertices, faces)
+        self.assertFalse(numpy.allclose(normal, largest))
+
+    def test_sample_points(self):
+        rng = numpy.random.RandomState(0)
+        corners = cube_facets().reshape(-1, 3)
+        points = numpy.concatenate([rng.rand(10000, 3), corners]).astype('f')
+        sample = mesh.sample_points(points, 100)
+        self.assertTrue(len(sample) < 150)
+        self.assertEqual(set(map(tuple, mesh.convex_hull(sample)[0])), set(map(tuple, corners)))
+
+
+class TransformTest(unittest.TestCase):
+
+    def setUp(self):
+        model, data = ModelFile(os.path.join(DATA_DIR, 'stl', 'top.stl')).read()
+        model.load_data(data)
+        self.model = model
+
+    def test_rotate_keeps_vertices(self):
+        vertices = self.model.vertices.copy()
+        self.model.rotate_abs(90, self.model.AXIS_Z)
+        self.model.scale(2.0)
+        self.assertTrue((self.model.vertices == vertices).all())
+
+        facets, normals = self.model.transformed_facets()
+        # rotation angles turn the model clockwise: (x, y) moves to (y, -x)
+        expected = 2.0 * vertices.reshape(-1, 3, 3)[..., [1, 0, 2]] * [1, -1, 1]
+        self.assertTrue(numpy.allclose(facets, expected, atol=1e-4))
+        expected = self.model.facet_normals()[:, [1, 0, 2]] * [1, -1, 1]
+        self.assertTrue(numpy.allclose(normals, expected, atol=1e-5))
+
+    def test_lay_flat(self):
+        self.model.rotate_abs(37, self.model.AXIS_X)
+        self.model.rotate_abs(20, self.model.AXIS_Y)
+        self.model.rotate_abs(30, self.model.AXIS_Z)
+        self.assertTrue(self.model.lay_flat())
+        # back on its bottom, turned about z as before
+        self.assertEqual([self.model.rotation_angle[axis] for axis in
+                          (self.model.AXIS_X, self.model.AXIS_Y, self.model.AXIS_Z)], [0, 0, 30])
+        expected = self.model.rotation_matrix(self.model.rotation_angle)
+        self.assertTrue(numpy.allclose(self.model.matrix, expected, atol=1e-5))
+
+    def test_bounding_box(self):
+        for angle in (90, 30):
+            self.model.rotate_abs(angle, self.model.AXIS_X)
+            self.model.translate(1, 2, 3)
+            facets = self.model.transformed_facets()[0].reshape(-1, 3)
+            box = self.model.bounding_box
+            self.assertTrue(numpy.allclose(box.lower_corner, facets.min(0), atol=1e-5))
+            self.assertTrue(numpy.allclose(box.upper_corner, facets.max(0), atol=1e-5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import unittest
+import numpy
+from libtatlin.config import Config
+from libtatlin.storage import ModelFile
+
+GCODE_PATH = os.path.join(os.path.dirname(__file__), 'data', 'gcode', 'top.gcode')
+
+
+class DrawnBoundsTest(unittest.TestCase):
+
+    def setUp(self):
+        model, model_data = ModelFile(GCODE_PATH).read()
+        model.load_data(model_data)
+        self.model = model
+
+    def test_travel_is_left_out(self):
+        # the job starts from a waiting position and ends at a cooling one,
+        # both far from the part
+        drawn = self.model.drawn_bounding_box
+        whole = self.model.bounding_box
+        self.assertLess(drawn.width * drawn.depth, whole.width * whole.depth / 2)
+
+    def test_drawn_layers(self):
+        # the last layer only moves the head away
+        self.assertEqual(self.model.drawn_layers, self.model.max_layers - 1)
+
+
+@unittest.skipUnless(os.environ.get('PYOPENGL_PLATFORM') == 'egl',
+                     'offscreen rendering requires PYOPENGL_PLATFORM=egl')
+class ThumbnailTest(unittest.TestCase):
+    size = 128
+
+    def setUp(self):
+        from libtatlin.offscreen import OffscreenContext
+        self.context = OffscreenContext(self.size, self.size)
+        self.config = Config(os.path.join(os.path.dirname(__file__), 'data', 'missing.conf'))
+
+    def tearDown(self):
+        self.context.destroy()
+
+    def coverage(self, mode_2d):
+        from libtatlin.offscreen import load_scene
+        scene = load_scene(GCODE_PATH, self.context, self.config, mode_2d=mode_2d,
+                           platform=False)
+        try:
+            pixels = scene.render()
+        finally:
+            scene.close()
+        return (pixels[..., :3] < 250).any(-1).mean()
+
+    def test_part_fills_3d_image(self):
+        self.assertGreater(self.coverage(False), 0.1)
+
+    def test_part_shown_in_2d(self):
+        self.assertGreater(self.coverage(True), 0.005)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+import numpy
+from libtatlin.actors import Platform
+from libtatlin.overlay import sphere_mesh
+
+
+class SphereMeshTest(unittest.TestCase):
+
+    def test_vertices_on_sphere(self):
+        vertices, normals = sphere_mesh(2.0, 12, 8)
+        self.assertEqual(len(vertices), 12 * 8 * 6)
+        numpy.testing.assert_allclose(numpy.linalg.norm(vertices, axis=1), 2.0, rtol=1e-5)
+        numpy.testing.assert_allclose(vertices, normals * 2.0, rtol=1e-5)
+
+    def test_triangles_face_outwards(self):
+        vertices, normals = sphere_mesh(1.0, 12, 8)
+        a, b, c = vertices[0::3], vertices[1::3], vertices[2::3]
+        face_normals = numpy.cross(b - a, c - a)
+        centers = (a + b + c) / 3
+        # triangles touching the poles are degenerate
+        facing = (face_normals * centers).sum(1)
+        self.assertTrue((facing >= -1e-6).all())
+        self.assertTrue((facing > 1e-6).sum() > len(facing) * 0.8)
+
+
+class PlatformTest(unittest.TestCase):
+
+    def test_grid_arrays(self):
+        platform = Platform(20, 10)
+        vertices, colors = platform.grid_arrays()
+
+        # 21 lines along Y, 11 along X, then the fill
+        self.assertEqual(len(vertices), (21 + 11) * 2 + 4)
+        self.assertEqual(len(colors), len(vertices))
+
+        numpy.testing.assert_array_equal(vertices[2:4], [(1, 0, 0), (1, 10, 0)])
+        numpy.testing.assert_array_equal(vertices[42:44], [(0, 0, 0), (20, 0, 0)])
+        numpy.testing.assert_array_equal(vertices[-2], (20, 10, 0))
+
+        numpy.testing.assert_allclose(colors[0], platform.color_grads_major)
+        numpy.testing.assert_allclose(colors[2], platform.color_grads_minor)
+        numpy.testing.assert_allclose(colors[10], platform.color_grads_interm)
+        numpy.testing.assert_allclose(colors[-1], platform.color_fill)
+
+
+if __name__ == '__main__':
+    unittest.main()
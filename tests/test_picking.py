@@ -0,0 +1,96 @@
+import os
+import tempfile
+import unittest
+import numpy
+from libtatlin.picking import SegmentGrid, unproject, intersect_plane, point_segment_distance
+from libtatlin.gcodeparser import GcodeLexer, LineIndex
+
+
+class PickingTest(unittest.TestCase):
+
+    def test_point_segment_distance(self):
+        starts = numpy.array([[0.0, 0.0], [0.0, 0.0]])
+        ends = numpy.array([[10.0, 0.0], [0.0, 0.0]])
+        distances = point_segment_distance((13.0, 4.0), starts, ends)
+
+        self.assertAlmostEqual(distances[0], 5.0)
+        self.assertAlmostEqual(distances[1], numpy.hypot(13.0, 4.0))
+
+    def test_nearest(self):
+        # a raster of short segments plus one long travel move across it
+        xs = numpy.arange(100) * 0.5
+        starts = numpy.zeros((200, 2))
+        ends = numpy.zeros((200, 2))
+        starts[:100, 0] = xs
+        ends[:100, 0] = xs + 0.5
+        starts[100:, 0] = xs
+        starts[100:, 1] = ends[100:, 1] = 1.0
+        ends[100:, 0] = xs + 0.5
+        starts[-1] = (0.0, -10.0)
+        ends[-1] = (50.0, -10.0)
+        grid = SegmentGrid(starts, ends)
+
+        self.assertEqual(grid.nearest(10.2, 0.1, 0.3), 20)
+        self.assertEqual(grid.nearest(10.2, 0.9, 0.3), 120)
+        self.assertEqual(grid.nearest(25.0, -9.9, 0.3), 199)
+        self.assertIsNone(grid.nearest(25.0, 5.0, 0.3))
+
+        # restricted to the first row
+        self.assertEqual(grid.nearest(10.2, 0.9, 1.0, 0, 100), 20)
+
+    def test_long_segments(self):
+        # long segments are found anywhere along them, and only near them
+        rng = numpy.random.RandomState(0)
+        starts = rng.rand(2000, 2) * 100
+        ends = starts + (rng.rand(2000, 2) - 0.5) * 0.5
+        ends[:200] = rng.rand(200, 2) * 100
+        grid = SegmentGrid(starts, ends)
+
+        for x, y in rng.rand(200, 2) * 100:
+            distances = point_segment_distance((x, y), starts, ends)
+            expected = int(distances.argmin()) if distances.min() <= 1.0 else None
+            self.assertEqual(grid.nearest(x, y, 1.0), expected)
+        self.assertTrue(len(grid.candidates((50.0, 50.0), 0.5)) < 100)
+
+    def test_nearest_per_range(self):
+        # two layers of the same row, looked at through different points
+        starts = numpy.zeros((20, 2))
+        starts[:, 0] = numpy.tile(numpy.arange(10), 2)
+        ends = starts + (1.0, 0.0)
+        grid = SegmentGrid(starts, ends)
+
+        # the upper layer wins where both have a segment
+        self.assertEqual(grid.nearest_per_range([(2.5, 0.1), (7.5, 0.1)], 0.3, [0, 10, 20]), 17)
+        # the upper layer has nothing near its point
+        self.assertEqual(grid.nearest_per_range([(2.5, 0.1), (7.5, 5.0)], 0.3, [0, 10, 20]), 2)
+        self.assertIsNone(grid.nearest_per_range([(2.5, 5.0), (7.5, 5.0)], 0.3, [0, 10, 20]))
+
+    def test_unproject(self):
+        modelview = numpy.identity(4)
+        projection = numpy.identity(4)
+        near, far = unproject(50, 25, modelview, projection, (0, 0, 100, 100))
+
+        self.assertTrue(numpy.allclose(near, [0.0, -0.5, -1.0]))
+        self.assertTrue(numpy.allclose(far, [0.0, -0.5, 1.0]))
+        self.assertTrue(numpy.allclose(intersect_plane(near, far, 0.0), [0.0, -0.5]))
+
+    def test_line_index(self):
+        fd, path = tempfile.mkstemp()
+        os.write(fd, 'G21\r\nG1 X1 Y2\r\n\r\nG1 X3\n')
+        os.close(fd)
+        try:
+            lexer = GcodeLexer()
+            with open(path, 'rb') as f:
+                lexer.load(f)
+            index = LineIndex(path, lexer.line_offsets)
+
+            self.assertEqual(len(index), 4)
+            self.assertEqual(index.line(2), 'G1 X1 Y2')
+            self.assertEqual(index.line(4), 'G1 X3')
+            self.assertIsNone(index.line(5))
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import unittest
+import numpy
+from libtatlin.raster import accumulate, burn_image, burn_tiles, segment_durations, \
+        to_intensity, energy_density, find_hotspots
+
+
+class RasterTest(unittest.TestCase):
+
+    def test_segment_durations(self):
+        starts = numpy.array([[0, 0, 0], [0, 0, 0]], 'f')
+        ends = numpy.array([[10, 0, 0], [3, 4, 0]], 'f')
+        durations = segment_durations(starts, ends, [600, 0])
+
+        self.assertAlmostEqual(durations[0], 1.0)
+        self.assertEqual(durations[1], 0.0)
+
+    def test_value_is_conserved(self):
+        starts = numpy.array([[0.0, 0.0], [1.0, 2.0]])
+        ends = numpy.array([[5.0, 0.0], [1.0, 4.0]])
+        raster = accumulate(starts, ends, [3.0, 7.0], 0.5)
+
+        self.assertAlmostEqual(raster.data.sum(), 10.0)
+
+    def test_value_spread_along_segment(self):
+        starts = numpy.array([[0.0, 0.0]])
+        ends = numpy.array([[4.0, 0.0]])
+        raster = accumulate(starts, ends, [4.0], 1.0, origin=(0.0, -0.5), shape=(1, 4))
+
+        self.assertEqual(list(raster.data[0]), [1.0, 1.0, 1.0, 1.0])
+
+    def test_value_split_at_cell_boundaries(self):
+        # crosses x = 1 and x = 2 at a quarter and three quarters of its
+        # length, and y = 1 halfway
+        starts = numpy.array([[0.5, 0.5]])
+        ends = numpy.array([[2.5, 1.5]])
+        raster = accumulate(starts, ends, [1.0], 1.0, origin=(0.0, 0.0), shape=(2, 3))
+
+        self.assertTrue(numpy.allclose(raster.data, [[0.25, 0.25, 0.0], [0.0, 0.25, 0.25]]))
+
+    def test_long_segments_leave_no_residue(self):
+        rng = numpy.random.RandomState(0)
+        starts = rng.rand(500, 2) * 10
+        ends = starts + [[5.0, 0.0]]
+        ends[::2, 1] += 3.0
+        values = rng.rand(500)
+        raster = accumulate(starts, ends, values, 0.1, origin=(0.0, 0.0), shape=(200, 200))
+
+        # cells past the ends of the segments are exactly zero
+        self.assertEqual((raster.data[:, 151:] != 0).sum(), 0)
+        self.assertTrue((raster.data >= 0).all())
+        self.assertAlmostEqual(raster.data.sum(), values.sum())
+
+    def test_burn_image_skips_travel(self):
+        vertices = numpy.array([
+            [0, 0, 0], [10, 0, 0],   # travel
+            [10, 0, 0], [10, 10, 0], # burn
+        ], 'f')
+        raster = burn_image(vertices, [0, 6000], [3000, 600], 0.5)
+
+        # 6000 S over one second
+        self.assertAlmostEqual(raster.data.sum(), 6000.0, places=3)
+        self.assertEqual(raster.width, 1)
+
+    def test_burn_image_max_size(self):
+        vertices = numpy.array([[0, 0, 0], [100, 0, 0]], 'f')
+        raster = burn_image(vertices, [100], [600], 0.01, max_size=64)
+
+        self.assertTrue(raster.width <= 64)
+
+    def test_energy_density(self):
+        # full power of a 5W laser for one second on a single 1mm^2 cell
+        vertices = numpy.array([[0, 0, 0], [0.5, 0, 0]], 'f')
+        raster = burn_image(vertices, [12000], [30], 1.0)
+        density = energy_density(raster, 5.0, 12000)
+
+        self.assertAlmostEqual(density.data.sum(), 5.0, places=4)
+
+    def test_hotspots(self):
+        vertices = numpy.array([[0, 0, 0], [2, 0, 0], [0, 0, 0], [1, 0, 0]], 'f')
+        # 2 and 10 J over cells of 1mm^2 centered on 0, 1 and 2
+        hotspots = find_hotspots(vertices, [1, 10], [60, 60], 1.0, 1.0, 1, 5.0, 64)
+
+        self.assertEqual(hotspots.count, 2)
+        self.assertEqual(hotspots.area, 2.0)
+        self.assertEqual(hotspots.peak, 6.0)
+        self.assertEqual(list(hotspots.mask.data[0]), [True, True, False])
+
+    def random_toolpath(self):
+        rng = numpy.random.RandomState(0)
+        vertices = (rng.rand(400, 3) * 20).astype('f')
+        return vertices, rng.randint(0, 100, 200), [600] * 200
+
+    def test_tiles(self):
+        vertices, powers, feedrates = self.random_toolpath()
+        whole = burn_image(vertices, powers, feedrates, 0.1)
+        image = numpy.zeros_like(whole.data)
+        for row, column, tile in burn_tiles(vertices, powers, feedrates, 0.1, tile_size=64):
+            image[row:row + tile.height, column:column + tile.width] = tile.data
+
+        self.assertTrue(numpy.allclose(image, whole.data))
+
+    def test_hotspots_full_resolution(self):
+        # peaks are found at the resolution asked for, however coarse the mask
+        vertices, powers, feedrates = self.random_toolpath()
+        density = energy_density(burn_image(vertices, powers, feedrates, 0.1), 5.0, 100)
+        threshold = numpy.percentile(density.data[density.data > 0], 99)
+        hotspots = find_hotspots(vertices, powers, feedrates, 0.1, 5.0, 100, threshold, 32)
+
+        self.assertEqual(hotspots.count, (density.data > threshold).sum())
+        self.assertAlmostEqual(hotspots.peak, density.data.max())
+        self.assertTrue(hotspots.mask.width <= 32 and hotspots.mask.height <= 32)
+        lower, upper = numpy.split(numpy.array(hotspots.mask.extent), 2)
+        image_lower, image_upper = numpy.split(numpy.array(density.extent), 2)
+        self.assertTrue((lower <= image_lower + 1e-6).all() and (upper >= image_upper - 1e-6).all())
+
+    def test_to_intensity(self):
+        data = numpy.array([[0.0, 1.0, 2.0]])
+        intensity = to_intensity(data, percentile=100)
+
+        self.assertEqual(list(intensity[0]), [0, 127, 255])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import array
+import unittest
+import numpy
+from libtatlin import sharedarrays
+
+
+class Holder(object):
+    pass
+
+
+class SharedArraysTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = sharedarrays.create_path()
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            sharedarrays.remove(self.path)
+
+    def test_round_trip(self):
+        big = numpy.arange(300000, dtype='f').reshape(-1, 3)
+        obj = Holder()
+        obj.big = big
+        obj.same = big
+        obj.strided = big[:, 1]
+        obj.small = numpy.arange(10)
+        obj.offsets = array.array('l', range(20000))
+        obj.name = 'model'
+        sharedarrays.dump(obj, self.path)
+
+        loaded, shared = sharedarrays.load(self.path)
+        numpy.testing.assert_array_equal(loaded.big, big)
+        numpy.testing.assert_array_equal(loaded.strided, big[:, 1])
+        numpy.testing.assert_array_equal(loaded.small, obj.small)
+        self.assertEqual(loaded.offsets, obj.offsets)
+        self.assertEqual(loaded.name, 'model')
+
+        # large arrays are views of the mapping, written once
+        self.assertIs(loaded.same, loaded.big)
+        self.assertFalse(loaded.big.flags.owndata)
+        self.assertEqual(loaded.big.ctypes.data % sharedarrays.ALIGNMENT, 0)
+        self.assertTrue(shared.nbytes > big.nbytes + obj.strided.nbytes)
+
+        # changes are private to the process
+        loaded.big[0] = -1
+        again, shared_again = sharedarrays.load(self.path)
+        numpy.testing.assert_array_equal(again.big[0], (0, 1, 2))
+
+        shared.close()
+        shared_again.close()
+        self.assertFalse(os.path.exists(self.path))
+        # arrays outlive the file
+        self.assertEqual(loaded.big[1, 0], 3)
+
+    def test_not_shared_file(self):
+        with open(self.path, 'wb') as f:
+            f.write('x' * 64)
+        self.assertRaises(ValueError, sharedarrays.SharedArrays, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import unittest
+import cStringIO
+import numpy
+from libtatlin import slicer
+from libtatlin.storage import ModelFile
+from libtatlin.gcodeparser import GcodeParser
+from libtatlin.scene import SceneRenderer
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def cube_facets():
+    """Two triangles per face of a unit cube, counter-clockwise outside."""
+    corners = numpy.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)], 'f')
+    quads = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+    triangles = [t for a, b, c, d in quads for t in ((a, b, c), (a, c, d))]
+    return corners[numpy.array(triangles)]
+
+
+class SliceTest(unittest.TestCase):
+
+    def test_cube(self):
+        polylines = slicer.slice_contours(cube_facets(), 0.5)
+        self.assertEqual(len(polylines), 1)
+        square = polylines[0]
+        numpy.testing.assert_array_equal(square[0], square[-1])
+        self.assertAlmostEqual(slicer.signed_area(square), 1)
+        self.assertTrue(slicer.is_outline(square))
+
+    def test_vertices_on_plane(self):
+        # the bottom is cut through its edges, the top is not cut at all
+        self.assertAlmostEqual(slicer.signed_area(slicer.slice_contours(cube_facets(), 0)[0]), 1)
+        self.assertEqual(slicer.slice_contours(cube_facets(), 1), [])
+
+    def test_hole(self):
+        # a cube turned inside out is a hole in the material around it
+        hole = slicer.slice_contours(cube_facets()[:, ::-1], 0.5)[0]
+        self.assertAlmostEqual(slicer.signed_area(hole), -1)
+        self.assertFalse(slicer.is_outline(hole))
+
+    def test_open_chain(self):
+        points = numpy.array([[0, 0], [1, 0], [1, 1], [0, 1]], 'f')
+        order = [2, 0, 1]
+        polylines = slicer.chain_segments(points[:-1][order], points[1:][order])
+        self.assertEqual(len(polylines), 1)
+        numpy.testing.assert_array_equal(polylines[0], points)
+
+    def test_parallel(self):
+        model, data = ModelFile(os.path.join(DATA_DIR, 'stl', 'top.stl')).read()
+        model.load_data(data)
+        heights = numpy.linspace(0.5, 14.5, 10)
+        serial = model.slice(heights, processes=1)
+        parallel = model.slice(heights, processes=2)
+        self.assertEqual(len(parallel), len(heights))
+        for expected, found in zip(serial, parallel):
+            self.assertEqual(len(expected), len(found))
+            for a, b in zip(expected, found):
+                numpy.testing.assert_array_equal(a, b)
+        # top.stl is closed, so all of its contours are too
+        for polylines in serial:
+            self.assertTrue(all(slicer.is_outline(p) for p in polylines))
+
+
+class GcodeTest(unittest.TestCase):
+
+    def test_write(self):
+        heights = [0.25, 0.75]
+        layers = [slicer.slice_contours(cube_facets(), height) for height in heights]
+        f = cStringIO.StringIO()
+        slicer.write_gcode(f, heights, layers, laseron='M3', laseroff='M5',
+                           burnrate=800, skiprate=3000, power=255)
+        gcode = f.getvalue()
+        self.assertEqual(gcode.count('M3 S255'), 2)
+        self.assertEqual(gcode.count('M5'), 2)
+
+        parser = GcodeParser()
+        parser.load(gcode)
+        parsed = parser.parse()
+        self.assertEqual(len(parsed), 2)
+        # the laser is on along the square and off on the way to it
+        burning = [move for move in parsed[0] if move.spindle_speed > 0]
+        self.assertEqual(len(burning), 8)
+        self.assertTrue(all(move.feedrate == 800 for move in burning))
+
+    def test_export_platform_offset(self):
+        # G-code is shown shifted by the platform offsets, so the contours
+        # are shifted back to land where the model is shown
+        model, data = ModelFile(os.path.join(DATA_DIR, 'stl', 'top.stl')).read()
+        model.load_data(data)
+        scene = SceneRenderer()
+        scene.add_model(model)
+
+        def export(platform_offset):
+            path = os.path.join(tmpdir, 'contours.gcode')
+            scene.export_contours(path, 5.0, platform_offset)
+            parser = GcodeParser()
+            with open(path, 'rb') as f:
+                parser.load(f)
+                layers = parser.parse()
+            return numpy.array([move.v[:2] for layer in layers for move in layer])
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            unshifted = export((0, 0))
+            shifted = export((10, 20))
+        finally:
+            shutil.rmtree(tmpdir)
+
+        self.assertTrue(len(unshifted) > 0)
+        self.assertTrue(numpy.allclose(shifted, unshifted - (10, 20), atol=1e-3))
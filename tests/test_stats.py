@@ -0,0 +1,61 @@
+import os
+import csv
+import shutil
+import tempfile
+import unittest
+from libtatlin.stats import FrameStats, count_draw
+
+
+class Actor(object):
+    pass
+
+
+class FrameStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def draw_frame(self, stats, calls, vertices):
+        stats.begin_frame()
+        count_draw(calls, vertices)
+        stats.add_actor_time(Actor(), 0.002)
+        stats.end_frame(buffer_bytes=1024)
+
+    def test_summary(self):
+        stats = FrameStats(timer_queries=False)
+        self.assertIsNone(stats.summary())
+
+        self.draw_frame(stats, 2, 100)
+        self.draw_frame(stats, 1, 30)
+
+        summary = stats.summary()
+        self.assertEqual(summary['draw_calls'], 1)
+        self.assertEqual(summary['vertices'], 30)
+        self.assertEqual(summary['buffer_bytes'], 1024)
+        self.assertIsNone(summary['gpu_ms'])
+        self.assertEqual(summary['actor_ms'][0][0], 'Actor')
+        self.assertAlmostEqual(summary['actor_ms'][0][1], 2.0)
+        self.assertEqual(stats.fps(), 2.0)
+
+    def test_log_rotation(self):
+        path = os.path.join(self.tempdir, 'frames.csv')
+        stats = FrameStats(timer_queries=False)
+        stats.start_log(path, max_rows=3)
+        for calls in range(5):
+            self.draw_frame(stats, calls, 10)
+        stats.stop_log()
+
+        with open(path + '.1', 'rb') as f:
+            old_rows = list(csv.DictReader(f))
+        with open(path, 'rb') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([row['draw_calls'] for row in old_rows], ['0', '1', '2'])
+        self.assertEqual([row['draw_calls'] for row in rows], ['3', '4'])
+        self.assertEqual(rows[0]['actors'], 'Actor:2.000')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import os
+import struct
+import tempfile
+import unittest
+import numpy
+from libtatlin.stlparser import StlAsciiParser, StlBinaryParser, StlParseError
+
+
+def binary_stl(facets, count=None):
+    data = '\0' * 80 + struct.pack('<I', len(facets) if count is None else count)
+    for normal, vertices in facets:
+        data += struct.pack('<12fH', *(list(normal) + [c for v in vertices for c in v] + [0]))
+    return data
+
+
+def parse(data):
+    parser = StlBinaryParser()
+    parser.load(data)
+    return parser.parse()
+
+
+class StlBinaryParserTest(unittest.TestCase):
+
+    facets = [
+        ((0, 0, 1), [(0, 0, 0), (1, 0, 0), (0, 1, 0)]),
+        ((0, 0, -1), [(0, 0, 2), (0, 1, 2), (1, 0, 2)]),
+    ]
+
+    def test_parse(self):
+        vertices, normals = parse(binary_stl(self.facets))
+        self.assertEqual(vertices.dtype, numpy.float32)
+        numpy.testing.assert_array_equal(vertices, [v for n, vs in self.facets for v in vs])
+        numpy.testing.assert_array_equal(normals, [n for n, vs in self.facets])
+
+    def test_arrays_are_writeable(self):
+        vertices, normals = parse(binary_stl(self.facets[:1]))
+        vertices *= 2.0
+        self.assertEqual(vertices[1, 0], 2.0)
+
+    def test_empty(self):
+        vertices, normals = parse(binary_stl([]))
+        self.assertEqual(vertices.shape, (0, 3))
+        self.assertEqual(normals.shape, (0, 3))
+
+    def test_truncated(self):
+        data = binary_stl(self.facets)[:-10]
+        self.assertRaises(StlParseError, parse, data)
+        self.assertRaises(StlParseError, parse, binary_stl(self.facets, count=5))
+        self.assertRaises(StlParseError, parse, data[:82])
+
+    def test_corrupt_count(self):
+        # a count far beyond the end of the file is rejected without
+        # allocating room for reading that many facets
+        with tempfile.TemporaryFile() as f:
+            f.write(binary_stl(self.facets, count=0xFFFFFFF0))
+            f.seek(0)
+            self.assertRaises(StlParseError, parse, f)
+
+
+class StlAsciiParserTest(unittest.TestCase):
+
+    path = os.path.join(os.path.dirname(__file__), 'data', 'stl', 'top.stl')
+
+    def parse(self, text, **kwargs):
+        parser = StlAsciiParser(**kwargs)
+        parser.load(text)
+        return parser.parse()
+
+    def parse_strict(self, text):
+        parser = StlAsciiParser()
+        parser.load(text)
+        return parser._parse_strict(text)
+
+    def test_bulk_matches_strict(self):
+        with open(self.path, 'rb') as f:
+            text = f.read()
+        vertices, normals = self.parse(text)
+        self.assertIsInstance(vertices, numpy.ndarray)
+
+        strict_vertices, strict_normals = self.parse_strict(text)
+        numpy.testing.assert_array_equal(vertices, numpy.array(strict_vertices, 'f'))
+        numpy.testing.assert_array_equal(normals, numpy.array(strict_normals, 'f'))
+
+    def test_chunks(self):
+        with open(self.path, 'rb') as f:
+            text = f.read()
+        vertices, normals = self.parse(text)
+
+        parser = StlAsciiParser()
+        parser.CHUNK_BYTES = 1000
+        with open(self.path, 'rb') as f:
+            parser.load(f)
+            chunked_vertices, chunked_normals = parser.parse()
+        numpy.testing.assert_array_equal(chunked_vertices, vertices)
+        numpy.testing.assert_array_equal(chunked_normals, normals)
+
+    def test_fallback(self):
+        text = """solid test
+facet normal 0 0 1
+  outer loop
+    vertex 0 0 0
+    vertex 1 0 0
+    vertex 0 1 0
+  endloop
+endfacet
+facet  normal 0 0 -1
+  outer loop
+    vertex 0 0 2
+    vertex 0 1 2
+    vertex 1e0 0 2
+  endloop
+endfacet
+endsolid test
+"""
+        vertices, normals = self.parse(text)
+        self.assertEqual(len(vertices), 6)
+        self.assertEqual(normals[1], [0.0, 0.0, -1.0])
+
+    def test_malformed(self):
+        text = """solid test
+facet normal 0 0 1
+  outer loop
+    vertex 0 0 0
+    vertex 1 0 x
+    vertex 0 1 0
+  endloop
+endfacet
+endsolid test
+"""
+        self.assertRaises(ValueError, self.parse, text)
+
+    def test_processes(self):
+        with open(self.path, 'rb') as f:
+            vertices, normals = self.parse(f.read())
+
+        fd, path = tempfile.mkstemp(suffix='.stl')
+        os.close(fd)
+        try:
+            with open(self.path, 'rb') as src, open(path, 'wb') as dst:
+                dst.write(src.read())
+
+            parser = StlAsciiParser(processes=2)
+            parser.CHUNK_BYTES = 10000
+            parser.PARALLEL_MIN_BYTES = 0
+            with open(path, 'rb') as f:
+                parser.load(f)
+                parallel_vertices, parallel_normals = parser.parse()
+        finally:
+            os.remove(path)
+        numpy.testing.assert_array_equal(parallel_vertices, vertices)
+        numpy.testing.assert_array_equal(parallel_normals, normals)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+from libtatlin.storage import ModelFile, atomic_write
+
+
+def read_model(path):
+    model, data = ModelFile(path).read()
+    model.load_data(data)
+    return model
+
+
+class WriteStlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.source = os.path.join(os.path.dirname(__file__), 'data', 'stl', 'top.stl')
+        self.model = read_model(self.source)
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def write(self, binary):
+        path = os.path.join(self.dirname, 'out.stl')
+        ModelFile(path).write_stl(self.model, binary)
+        return path
+
+    def assert_same_model(self, path):
+        model = read_model(path)
+        self.assertTrue(numpy.allclose(model.facets(), self.model.facets(), atol=1e-5))
+        self.assertTrue(numpy.allclose(model.facet_normals(), self.model.facet_normals(), atol=1e-5))
+
+    def test_binary(self):
+        path = self.write(True)
+        self.assertEqual(os.path.getsize(path), 84 + 50 * self.model.facet_count)
+        self.assert_same_model(path)
+
+    def test_ascii(self):
+        path = self.write(False)
+        with open(path, 'rb') as f:
+            self.assertTrue(f.readline().startswith('solid'))
+        self.assert_same_model(path)
+
+    def test_keeps_format(self):
+        path = self.write(True)
+        ModelFile(path).write_stl(self.model)
+        self.assertEqual(os.path.getsize(path), 84 + 50 * self.model.facet_count)
+
+    def test_failed_write_keeps_original(self):
+        path = self.write(False)
+        with open(path, 'rb') as f:
+            original = f.read()
+
+        def fail():
+            with atomic_write(path) as f:
+                f.write('partial')
+                raise IOError('disk full')
+        self.assertRaises(IOError, fail)
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), original)
+        self.assertEqual(os.listdir(self.dirname), ['out.stl'])
+
+
+if __name__ == '__main__':
+    unittest.main()
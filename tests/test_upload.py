@@ -0,0 +1,51 @@
+import unittest
+import numpy
+from libtatlin.upload import UploadQueue, clip_ranges
+
+
+class ClipRangesTest(unittest.TestCase):
+
+    def test_clip(self):
+        starts = numpy.array([0, 10, 20, 30])
+        ends   = numpy.array([5, 15, 25, 35])
+        clipped_starts, clipped_ends = clip_ranges((starts, ends), 22)
+        numpy.testing.assert_array_equal(clipped_starts, [0, 10, 20])
+        numpy.testing.assert_array_equal(clipped_ends, [5, 15, 22])
+
+    def test_clip_all(self):
+        starts, ends = clip_ranges((numpy.array([3]), numpy.array([8])), 0)
+        self.assertEqual(len(starts), 0)
+        self.assertEqual(len(ends), 0)
+
+
+class UploadQueueTest(unittest.TestCase):
+
+    def test_add(self):
+        queue = UploadQueue()
+        vertex_buffer, color_buffer = queue.add(numpy.zeros((6, 3)), numpy.zeros((6, 4)))
+        self.assertTrue(queue.pending)
+        self.assertEqual(queue.total_bytes, 6 * 3 * 4 + 6 * 4 * 4)
+        self.assertEqual(vertex_buffer.size, 6 * 3 * 4)
+        self.assertEqual(queue.resident_rows(color_buffer), 0)
+        self.assertIsNone(queue.resident_rows(object()))
+
+    def test_rows_must_match(self):
+        queue = UploadQueue()
+        self.assertRaises(ValueError, queue.add, numpy.zeros((6, 3)), numpy.zeros((3, 4)))
+
+    def test_discard(self):
+        queue = UploadQueue()
+        first, = queue.add(numpy.zeros((6, 3)))
+        second, third = queue.add(numpy.zeros((2, 3)), numpy.zeros((2, 3)))
+
+        self.assertTrue(queue.discard([None, third]))
+        self.assertIsNone(queue.resident_rows(second))
+        self.assertEqual(queue.total_bytes, 6 * 3 * 4)
+        self.assertFalse(queue.discard([third]))
+
+        queue.discard([first])
+        self.assertFalse(queue.pending)
+
+
+if __name__ == '__main__':
+    unittest.main()
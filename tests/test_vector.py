@@ -0,0 +1,31 @@
+import unittest
+import numpy
+from libtatlin import vector
+
+
+class MatrixTest(unittest.TestCase):
+
+    def test_gl_rotate(self):
+        matrix = vector.gl_rotate(90, 0, 0, 2)
+        point = numpy.dot(matrix, [1.0, 0.0, 0.0, 1.0])
+        self.assertTrue(numpy.allclose(point, [0.0, 1.0, 0.0, 1.0]))
+
+    def test_chain(self):
+        # translate, then scale in the order OpenGL calls would be made
+        matrix = vector.chain(vector.gl_translate(1, 2, 3), vector.gl_scale(2, 2, 2))
+        point = numpy.dot(matrix, [1.0, 1.0, 1.0, 1.0])
+        self.assertTrue(numpy.allclose(point, [3.0, 4.0, 5.0, 1.0]))
+
+    def test_projections(self):
+        ortho = vector.gl_ortho(-2, 2, -1, 1, 0, 10)
+        self.assertTrue(numpy.allclose(numpy.dot(ortho, [2.0, 1.0, -10.0, 1.0]), [1, 1, 1, 1]))
+
+        perspective = vector.glu_perspective(90, 1.0, 1.0, 100.0)
+        near = numpy.dot(perspective, [1.0, 1.0, -1.0, 1.0])
+        far = numpy.dot(perspective, [0.0, 0.0, -100.0, 1.0])
+        self.assertTrue(numpy.allclose(near[:3] / near[3], [1, 1, -1]))
+        self.assertTrue(numpy.allclose(far[:3] / far[3], [0, 0, 1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
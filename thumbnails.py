@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 Denis Kobozev
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+Render PNG thumbnails of Gcode and STL files without a window.
+
+    $ python thumbnails.py -o thumbs/ queue/ part.stl
+
+Directories are searched recursively. Rendering uses EGL, so no display
+server is needed; with Mesa it runs on the CPU.
+"""
+
+from __future__ import division
+
+import os, os.path
+
+# PyOpenGL picks its platform on first import
+os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+os.environ.setdefault('EGL_PLATFORM', 'surfaceless')
+
+import sys
+import logging
+import argparse
+
+from libtatlin.offscreen import render_thumbnails
+
+
+EXTENSIONS = ('.gcode', '.nc', '.stl')
+
+
+def find_models(paths):
+    """
+    Yield (model path, path relative to the given root) pairs.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for fname in sorted(filenames):
+                    if os.path.splitext(fname)[1].lower() in EXTENSIONS:
+                        fpath = os.path.join(dirpath, fname)
+                        yield fpath, os.path.relpath(fpath, path)
+        else:
+            yield path, os.path.basename(path)
+
+def thumbnail_path(path, relpath, output_dir):
+    if output_dir is None:
+        return path + '.png'
+    return os.path.join(output_dir, relpath + '.png')
+
+def is_up_to_date(path, out_path):
+    return (os.path.exists(out_path) and
+            os.path.getmtime(out_path) >= os.path.getmtime(path))
+
+def parse_size(value):
+    try:
+        w, h = [int(part) for part in value.lower().split('x')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected WIDTHxHEIGHT, e.g. 320x240')
+    return w, h
+
+def main():
+    parser = argparse.ArgumentParser(description='Render thumbnails of Gcode and STL files.')
+    parser.add_argument('paths', nargs='+', metavar='PATH',
+                        help='model file or directory to search for models')
+    parser.add_argument('-o', '--output', metavar='DIR',
+                        help='directory for thumbnails, next to the models by default')
+    parser.add_argument('-s', '--size', type=parse_size, default=(320, 240),
+                        help='thumbnail size, 320x240 by default')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes, one per CPU by default')
+    parser.add_argument('--view', choices=['2d', '3d'],
+                        help='view to render, the viewer default if not given')
+    parser.add_argument('--no-platform', action='store_true',
+                        help='do not draw the platform')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='render thumbnails that are newer than their models too')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='--- [%(levelname)s] %(message)s', level=logging.WARNING)
+
+    jobs = []
+    for path, relpath in find_models(args.paths):
+        out_path = thumbnail_path(path, relpath, args.output)
+        if args.force or not is_up_to_date(path, out_path):
+            jobs.append((path, out_path))
+
+    for path, out_path in jobs:
+        out_dir = os.path.dirname(out_path)
+        if out_dir and not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+
+    options = {'platform': not args.no_platform}
+    if args.view is not None:
+        options['mode_2d'] = (args.view == '2d')
+
+    width, height = args.size
+    config_path = os.path.expanduser(os.path.join('~', '.tatlin'))
+    failed = 0
+    for path, out_path, error in render_thumbnails(jobs, width, height, config_path,
+                                                   args.jobs, **options):
+        if error is None:
+            print '%s -> %s' % (path, out_path)
+        else:
+            print >>sys.stderr, '%s: %s' % (path, error)
+            failed += 1
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())